@@ -1,35 +1,242 @@
 from django.contrib import admin
 
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, QuerySet
+from django.forms.models import BaseInlineFormSet
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html
 from django.contrib.auth.admin import UserAdmin
+from .deletion import delete_account, delete_post
+from .fastpath import count_subquery
 from .models import *
 
 # Register of models for the Admin panel
-class CommentInline(admin.TabularInline):
-    model = Comment
+
+def estimated_row_count(model, using):
+    """
+    Return the database's estimate of a table's row count, or None when the
+    backend has no cheap estimate
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Quoted, or regclass folds the mixed-case table name to lowercase
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(table)],
+            )
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # Largest rowid: a B-tree lookup, and an upper bound once rows are deleted
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the table's estimated row count for unfiltered changelists
+    of more than ``estimate_above`` rows instead of running COUNT(*)
+    """
+    estimate_above = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.estimate_above:
+                return estimate
+        return super().count
+
+
+class DateHierarchyQuerySet(QuerySet):
+    """
+    Answers the year and month levels of the admin date hierarchy from MIN and
+    MAX of the (indexed) date field instead of a DISTINCT over every row.
+    Years and months without rows in between are listed too.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        first, last = (timezone.localtime(bounds[name], tzinfo) for name in ('first', 'last'))
+        first = first.replace(month=1 if kind == 'year' else first.month, day=1, hour=0, minute=0, second=0, microsecond=0)
+        moments = []
+        while first <= last:
+            moments.append(first)
+            if kind == 'year':
+                first = first.replace(year=first.year + 1)
+            else:
+                first = first.replace(year=first.year + first.month // 12, month=first.month % 12 + 1)
+        return moments if order == 'ASC' else moments[::-1]
+
+
+class ScalableAdminMixin:
+    """
+    Changelist settings for large tables: estimated counts, no full result
+    count and a date hierarchy that does not scan the table
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = DateHierarchyQuerySet(self.model)
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+
+class SoftDeleteAdminMixin:
+    """
+    Deletes through deletion.py: the objects are hidden at once and removed
+    in the background, so the confirmation page does not collect every
+    dependent row either
+    """
+    soft_delete = None
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        return [str(obj) for obj in objs], {self.model._meta.verbose_name_plural: len(objs)}, set(), []
+
+    def delete_model(self, request, obj):
+        self.soft_delete(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.soft_delete(obj)
+
+
+class UsernameFilter(admin.SimpleListFilter):
+    """
+    Filter on an account foreign key by typing a username, instead of listing
+    every account as a choice
+    """
+    template = 'API/admin/input_filter.html'
+    title = 'user'
+    parameter_name = 'user'
+    field_path = 'user'
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return []
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = [
+            (name, value)
+            for name, values in changelist.get_filters_params().items() if name != self.parameter_name
+            for value in (values if isinstance(values, list) else [values])
+        ]
+        yield all_choice
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{f'{self.field_path}__username': self.value()})
+        return queryset
+
+
+class FollowerFilter(UsernameFilter):
+    title = 'follower'
+    parameter_name = field_path = 'follower'
+
+
+class FollowingFilter(UsernameFilter):
+    title = 'following'
+    parameter_name = field_path = 'following'
+
+
+class CappedInlineFormSet(BaseInlineFormSet):
+    max_rows = 20
+
+    def get_queryset(self):
+        if not hasattr(self, '_capped_queryset'):
+            self._capped_queryset = super().get_queryset()[:self.max_rows]
+        return self._capped_queryset
+
+
+class CappedInline(admin.TabularInline):
+    """
+    Read-only inline showing the newest ``max_rows`` related rows; the full
+    list is in the related model's own changelist
+    """
+    formset = CappedInlineFormSet
+    max_rows = 20
     extra = 0
-    readonly_fields = ['created_at', 'user']
+    can_delete = False
+    ordering = ['-pk']
+    related_fields = ['user']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.related_fields)
+
+    def get_readonly_fields(self, request, obj=None):
+        return self.fields
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.max_rows = self.max_rows
+        return formset
 
-class LikesInline(admin.TabularInline):
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class CommentInline(CappedInline):
+    model = Comment
+    fields = ['created_at', 'user', 'text']
+    verbose_name_plural = 'Comments (newest 20)'
+
+class LikesInline(CappedInline):
     model = Likes
-    extra = 0
-    readonly_fields = ['user']
+    fields = ['user']
+    verbose_name_plural = 'Likes (newest 20)'
 
-class SeenPostInline(admin.TabularInline):
+class SeenPostInline(CappedInline):
     model = SeenPost
-    extra = 0
-    readonly_fields = ['user']
+    fields = ['user']
+    verbose_name_plural = 'Seen by (newest 20)'
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(SoftDeleteAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'user', 'created_at', 'description_preview', 'post_image', 'likes_count', 'comments_count']
-    list_filter = ['created_at', 'user']
+    list_filter = ['created_at', ('deleted_at', admin.EmptyFieldListFilter), UsernameFilter]
+    list_select_related = ['user']
     search_fields = ['description', 'user__username']
     readonly_fields = ['created_at', 'post_image', 'likes_count', 'comments_count']
+    autocomplete_fields = ['user']
     inlines = [CommentInline, LikesInline, SeenPostInline]
     date_hierarchy = 'created_at'
+    soft_delete = staticmethod(delete_post)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            likes_total=count_subquery(Likes),
+            comments_total=count_subquery(Comment),
+        )
     
     def description_preview(self, obj):
         """Return a truncated description"""
@@ -45,31 +252,35 @@ class PostAdmin(admin.ModelAdmin):
     
     def likes_count(self, obj):
         """Count the likes on a post"""
-        return obj.likes.count()
+        return obj.likes_total
     likes_count.short_description = 'Likes'
+    likes_count.admin_order_field = 'likes_total'
     
     def comments_count(self, obj):
         """Count the comments on a post"""
-        return obj.comments.count()
+        return obj.comments_total
     comments_count.short_description = 'Comments'
+    comments_count.admin_order_field = 'comments_total'
 
 
-class FollowerConnectionInline(admin.TabularInline):
+class FollowerConnectionInline(CappedInline):
     model = FollowerConnection
     fk_name = 'following'
+    fields = ['follower']
+    related_fields = ['follower']
     verbose_name = 'Follower'
-    verbose_name_plural = 'Followers'
-    extra = 0
+    verbose_name_plural = 'Followers (newest 20)'
 
-class FollowingConnectionInline(admin.TabularInline):
+class FollowingConnectionInline(CappedInline):
     model = FollowerConnection
     fk_name = 'follower'
+    fields = ['following']
+    related_fields = ['following']
     verbose_name = 'Following'
-    verbose_name_plural = 'Following'
-    extra = 0
+    verbose_name_plural = 'Following (newest 20)'
 
 
-class AccountAdmin(UserAdmin):
+class AccountAdmin(SoftDeleteAdminMixin, ScalableAdminMixin, UserAdmin):
     list_display = ['username', 'email', 'first_name', 'last_name', 'profile_picture_preview', 'followers_count', 'posts_count']
     search_fields = ['username', 'email', 'first_name', 'last_name']
     readonly_fields = ['profile_picture_preview', 'date_joined', 'last_login', 'followers_count', 'posts_count']
@@ -78,6 +289,14 @@ class AccountAdmin(UserAdmin):
         ('Stats', {'fields': ('followers_count', 'posts_count')}),
     )
     inlines = [FollowerConnectionInline, FollowingConnectionInline]
+    list_filter = UserAdmin.list_filter + (('deleted_at', admin.EmptyFieldListFilter),)
+    soft_delete = staticmethod(delete_account)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            followers_total=count_subquery(FollowerConnection, 'following'),
+            posts_total=count_subquery(Post, 'user'),
+        )
     
     def profile_picture_preview(self, obj):
         """Display thumbnail of profile picture"""
@@ -88,23 +307,27 @@ class AccountAdmin(UserAdmin):
     
     def followers_count(self, obj):
         """Count followers"""
-        return obj.followers.count()
+        return obj.followers_total
     followers_count.short_description = 'Followers'
+    followers_count.admin_order_field = 'followers_total'
     
     def posts_count(self, obj):
         """Count posts"""
-        return obj.posts.count()
+        return obj.posts_total
     posts_count.short_description = 'Posts'
+    posts_count.admin_order_field = 'posts_total'
 
 admin.site.register(Account, AccountAdmin)
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'user', 'post', 'text_preview', 'created_at']
-    list_filter = ['created_at', 'user']
+    list_filter = ['created_at', UsernameFilter]
     search_fields = ['text', 'user__username']
     readonly_fields = ['created_at']
+    autocomplete_fields = ['user', 'post']
+    date_hierarchy = 'created_at'
     
     def text_preview(self, obj):
         """Return a truncated text"""
@@ -113,11 +336,13 @@ class CommentAdmin(admin.ModelAdmin):
 
 
 @admin.register(Story)
-class StoryAdmin(admin.ModelAdmin):
+class StoryAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'user', 'created_at', 'story_image']
-    list_filter = ['created_at', 'user']
+    list_filter = ['created_at', UsernameFilter]
     search_fields = ['user__username']
     readonly_fields = ['created_at', 'story_image']
+    autocomplete_fields = ['user']
+    date_hierarchy = 'created_at'
     
     def story_image(self, obj):
         """Display thumbnail of the story image"""
@@ -128,21 +353,47 @@ class StoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Likes)
-class LikesAdmin(admin.ModelAdmin):
+class LikesAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'user', 'post']
-    list_filter = ['user']
+    list_filter = [UsernameFilter]
     search_fields = ['user__username', 'post__description']
+    autocomplete_fields = ['user', 'post']
 
 
 @admin.register(SeenPost)
-class SeenPostAdmin(admin.ModelAdmin):
+class SeenPostAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'user', 'post']
-    list_filter = ['user']
+    list_filter = [UsernameFilter]
     search_fields = ['user__username', 'post__description']
+    autocomplete_fields = ['user', 'post']
 
 
 @admin.register(FollowerConnection)
-class FollowerConnectionAdmin(admin.ModelAdmin):
+class FollowerConnectionAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'follower', 'following']
-    list_filter = ['follower', 'following']
+    list_filter = [FollowerFilter, FollowingFilter]
     search_fields = ['follower__username', 'following__username']
+    autocomplete_fields = ['follower', 'following']
+
+
+@admin.register(Hashtag)
+class HashtagAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['id', 'name']
+    search_fields = ['name']
+
+
+@admin.register(Notification)
+class NotificationAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['id', 'recipient', 'verb', 'post', 'last_actor', 'actor_count', 'updated_at', 'read']
+    list_filter = ['verb', 'read']
+    raw_id_fields = ['recipient', 'post', 'last_actor']
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ['id', 'kind', 'object_id', 'step', 'rows_deleted', 'files_deleted', 'created_at', 'updated_at', 'finished_at']
+    list_filter = ['kind', ('finished_at', admin.EmptyFieldListFilter)]
+    readonly_fields = [field.name for field in DeletionJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
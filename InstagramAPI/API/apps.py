@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'InstagramAPI.API'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - connects the signal handlers
@@ -0,0 +1,194 @@
+"""
+Stateless signed-token authentication.
+
+``UserLogin`` issues a token signed with SECRET_KEY holding the account id
+and its ``token_version``; requests send it as ``Authorization: Token <token>``.
+Checking a token needs no session row, and the account it names is kept in
+an in-process cache for PRINCIPAL_CACHE_TIMEOUT seconds, so an authenticated
+request usually runs no query at all for authentication.
+
+Incrementing ``Account.token_version`` (``revoke_tokens``) invalidates every
+token issued to the account, and a RevokedToken row (``revoke_token``) the
+one token with that id: immediately in the current process, and in other
+processes once their cached principal, which holds the account's revoked
+token ids, expires.
+"""
+import copy
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+
+from .cache import LRUCache
+from .models import RevokedToken
+
+TOKEN_SALT = 'InstagramAPI.API.token'
+
+DEFAULTS = {
+    'MAX_AGE': 30 * 24 * 3600,
+    'PRINCIPAL_CACHE_TIMEOUT': 30,
+    'PRINCIPAL_CACHE_SIZE': 10000,
+}
+
+
+def token_options():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH', {})}
+
+
+class PrincipalCache:
+    """
+    Accounts by id with the ids of their revoked tokens, kept for
+    PRINCIPAL_CACHE_TIMEOUT seconds
+    """
+
+    def __init__(self):
+        self._local = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            options = token_options()
+            self._local = LRUCache(options['PRINCIPAL_CACHE_SIZE'], options['PRINCIPAL_CACHE_TIMEOUT'])
+        return self._local
+
+    def _entry(self, user_id):
+        entry = self.local.get(user_id)
+        if entry is None:
+            user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+            if user is None:
+                return None
+            revoked = RevokedToken.objects.filter(user_id=user_id, expires_at__gt=timezone.now())
+            entry = (user, frozenset(revoked.values_list('token_id', flat=True)))
+            self.local.set(user_id, entry)
+        return entry
+
+    def get(self, user_id):
+        entry = self._entry(user_id)
+        # Requests get their own copy so nothing they cache on it leaks
+        return copy.copy(entry[0]) if entry else None
+
+    def revoked(self, user_id):
+        """Return the ids of the account's tokens revoked one by one"""
+        entry = self._entry(user_id)
+        return entry[1] if entry else frozenset()
+
+    def forget(self, user_id):
+        self.local.delete(user_id)
+
+
+principals = PrincipalCache()
+
+
+def issue_token(user):
+    """Return a new API token for the user"""
+    payload = {'u': user.pk, 'v': user.token_version, 'j': secrets.token_urlsafe(9)}
+    return signing.dumps(payload, salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token):
+    """
+    Return the (user id, token version, token id) of a valid token, or None.
+    Tokens issued before tokens had ids have None as their id.
+    """
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=token_options()['MAX_AGE'])
+    except signing.BadSignature:
+        return None
+    if not isinstance(payload, dict) or 'u' not in payload or 'v' not in payload:
+        return None
+    return payload['u'], payload['v'], payload.get('j')
+
+
+def user_for_token(token):
+    """Return the active account a token was issued to, or None for an invalid or revoked token"""
+    claims = read_token(token)
+    if claims is None:
+        return None
+    user_id, version, token_id = claims
+    user = principals.get(user_id)
+    if user is not None and user.token_version < version:
+        # Cached before the account's tokens were revoked elsewhere
+        principals.forget(user_id)
+        user = principals.get(user_id)
+    if user is None or user.token_version != version or token_id in principals.revoked(user_id):
+        return None
+    return user
+
+
+def revoke_token(token):
+    """Invalidate one token, or every token of its account for a token without an id"""
+    claims = read_token(token)
+    if claims is None:
+        return
+    user_id, token_id = claims[0], claims[2]
+    if token_id is None:
+        _revoke_all(user_id)
+        return
+    now = timezone.now()
+    # Rows of tokens that have expired since are no longer needed
+    RevokedToken.objects.filter(user_id=user_id, expires_at__lte=now).delete()
+    RevokedToken.objects.get_or_create(
+        user_id=user_id,
+        token_id=token_id,
+        defaults={'expires_at': now + timedelta(seconds=token_options()['MAX_AGE'])},
+    )
+    principals.forget(user_id)
+
+
+def revoke_tokens(user):
+    """Invalidate every token issued to the user"""
+    _revoke_all(user.pk)
+
+
+def _revoke_all(user_id):
+    get_user_model().objects.filter(pk=user_id).update(token_version=F('token_version') + 1)
+    # All covered by the new token version
+    RevokedToken.objects.filter(user_id=user_id).delete()
+    principals.forget(user_id)
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """
+    DRF authentication class for the tokens issued by ``issue_token``
+    """
+    keyword = 'Token'
+
+    @classmethod
+    def get_token(cls, request):
+        parts = authentication.get_authorization_header(request).split()
+        if not parts or parts[0].lower() != cls.keyword.lower().encode():
+            return None
+        if len(parts) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            return parts[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+    @classmethod
+    def user_id(cls, request):
+        """Return the user id of the request's token without querying, or None"""
+        try:
+            token = cls.get_token(request)
+        except exceptions.AuthenticationFailed:
+            return None
+        claims = read_token(token) if token else None
+        return claims[0] if claims else None
+
+    def authenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+        user = user_for_token(token)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid or expired token.'))
+        return user, token
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,382 @@
+"""
+Caching layer for feed and profile post-list pages.
+
+Pages are stored as lists of post ids keyed per user, action and pagination
+query, separately from the per-post rendered fragments, so a like on one post
+only drops that post's fragment instead of every page that contains it.
+The page key holds the user's generation: the newest of the user's own
+generation, bumped by their likes and follows, and the post generations of
+the accounts they follow and of themselves, bumped when those accounts post.
+A new post therefore costs one cache write however many followers see it.
+Fragments are invalidated by bumping the post's or its author's stamp (see
+signals.py).
+
+Bumps wait for the writing transaction to commit: a reader that looked up the
+new stamp while the write was still uncommitted would otherwise cache the old
+rows under it.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import FollowerConnection
+from .routers import reads_as_of
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe in-process cache with per-entry expiry
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class BaseCache:
+    """
+    Settings, backend lookup and hit/miss counters shared by the caches below
+    """
+    setting = None
+    defaults = {}
+    prefix = None
+    stat_names = []
+
+    @property
+    def options(self):
+        return {**self.defaults, **getattr(settings, self.setting, {})}
+
+    @property
+    def enabled(self):
+        return self.options['ENABLED']
+
+    @property
+    def cache(self):
+        return caches[self.options['ALIAS']]
+
+    def _stat_key(self, name):
+        return f'{self.prefix}:stats:{name}'
+
+    def _incr(self, name, delta=1):
+        if not delta:
+            return
+        key = self._stat_key(name)
+        try:
+            self.cache.incr(key, delta)
+        except ValueError:
+            if not self.cache.add(key, delta, timeout=None):
+                self.cache.incr(key, delta)
+
+    def stats(self):
+        """Return the hit/miss counters of this cache"""
+        values = self.cache.get_many([self._stat_key(name) for name in self.stat_names])
+        return {name: values.get(self._stat_key(name), 0) for name in self.stat_names}
+
+    def reset_stats(self):
+        self.cache.delete_many([self._stat_key(name) for name in self.stat_names])
+
+
+class FeedCache(BaseCache):
+    """
+    Post id pages backed by the Django cache framework
+    """
+    setting = 'FEED_CACHE'
+    defaults = {
+        'ENABLED': True,
+        'ALIAS': 'default',
+        'PAGE_TIMEOUT': 300,
+        'LOCK_TIMEOUT': 10,
+        'LOCK_WAIT': 2.0,
+    }
+    prefix = 'feed'
+    stat_names = ['hits', 'misses']
+    # Query parameters that change how posts are rendered, not which posts
+    render_params = {'fields', 'expand'}
+
+    # Keys
+
+    def _generation_key(self, user_id):
+        return f'{self.prefix}:gen:{user_id}'
+
+    def _author_key(self, author_id):
+        return f'{self.prefix}:author:{author_id}'
+
+    def _sources_key(self, user_id, generation):
+        return f'{self.prefix}:sources:{user_id}:{generation}'
+
+    def _page_key(self, user_id, name, request, generation):
+        query = sorted(
+            (param, values) for param, values in request.query_params.lists()
+            if param not in self.render_params
+        )
+        digest = hashlib.md5(repr(query).encode()).hexdigest()
+        return f'{self.prefix}:page:{user_id}:{generation}:{name}:{digest}'
+
+    # Generations
+
+    def _generations(self, keys):
+        """Read generation keys, starting the missing ones at the current time"""
+        generations = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in generations]
+        if missing:
+            for key in missing:
+                self.cache.add(key, time.time_ns(), timeout=None)
+            generations.update(self.cache.get_many(missing))
+        return generations
+
+    def _sources(self, user_id, own):
+        """
+        Return the accounts whose posts appear in the user's pages, cached
+        under the user's own generation, which following someone bumps
+        """
+        key = self._sources_key(user_id, own)
+        sources = self.cache.get(key)
+        if sources is None:
+            with reads_as_of(own):
+                following = FollowerConnection.objects.filter(follower_id=user_id).values_list('following_id', flat=True)
+                sources = [user_id, *following]
+            self.cache.set(key, sources, timeout=self.options['PAGE_TIMEOUT'])
+        return sources
+
+    def generation(self, user_id):
+        """
+        Return the current page generation of a user. Every bump is a fresh
+        timestamp, so the newest of the generations involved changes with
+        each of them, and an evicted generation can never come back with an
+        old value.
+        """
+        key = self._generation_key(user_id)
+        own = self._generations([key])[key]
+        authors = self._generations([self._author_key(author_id) for author_id in self._sources(user_id, own)])
+        return max(own, *authors.values())
+
+    def invalidate_users(self, user_ids):
+        """Drop every cached page of the given users"""
+        self._bump([self._generation_key(user_id) for user_id in set(user_ids)])
+
+    def invalidate_authors(self, author_ids):
+        """Drop every cached page showing posts of the given accounts"""
+        self._bump([self._author_key(author_id) for author_id in set(author_ids)])
+
+    def _bump(self, keys):
+        if keys:
+            transaction.on_commit(lambda: self.cache.set_many(dict.fromkeys(keys, time.time_ns()), timeout=None))
+
+    # Pages
+
+    def get_page(self, user_id, name, request, build, generation=None):
+        """
+        Return the cached page for a user, building it with ``build`` on a miss.
+        Only one caller builds a given page at a time; the others wait up to
+        LOCK_WAIT seconds for it to appear before building it themselves.
+        """
+        options = self.options
+        if generation is None:
+            generation = self.generation(user_id)
+        key = self._page_key(user_id, name, request, generation)
+        page = self.cache.get(key)
+        if page is not None:
+            self._incr('hits')
+            return page
+
+        self._incr('misses')
+        lock_key = f'{key}:lock'
+        if self.cache.add(lock_key, 1, timeout=options['LOCK_TIMEOUT']):
+            try:
+                # Cached under the current generation, so built from the primary
+                # while a replica may lag behind it
+                with reads_as_of(generation):
+                    page = build()
+                self.cache.set(key, page, timeout=options['PAGE_TIMEOUT'])
+            finally:
+                self.cache.delete(lock_key)
+            return page
+
+        deadline = time.monotonic() + options['LOCK_WAIT']
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            page = self.cache.get(key)
+            if page is not None:
+                return page
+        return build()
+
+    def stats(self):
+        stats = super().stats()
+        total = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+        return stats
+
+
+class PostFragmentCache(BaseCache):
+    """
+    Viewer-independent serialized posts, versioned by post and author stamps.
+
+    A fragment is stored under the stamps current when it was rendered, so
+    bumping a stamp makes every older copy unreachable in both tiers without
+    having to find and delete them. The in-process LRU tier sits in front of
+    the shared cache; only the stamps are read from the shared cache on a
+    local hit.
+    """
+    setting = 'POST_FRAGMENT_CACHE'
+    defaults = {
+        'ENABLED': True,
+        'ALIAS': 'default',
+        'TIMEOUT': 300,
+        'LOCAL_MAXSIZE': 1024,
+        'LOCAL_TIMEOUT': 30,
+    }
+    prefix = 'fragment'
+    stat_names = ['local_hits', 'shared_hits', 'misses']
+
+    def __init__(self):
+        self._local = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            options = self.options
+            self._local = LRUCache(options['LOCAL_MAXSIZE'], options['LOCAL_TIMEOUT'])
+        return self._local
+
+    # Stamps
+
+    def _stamp_key(self, kind, object_id):
+        return f'{self.prefix}:stamp:{kind}:{object_id}'
+
+    def stamps(self, refs):
+        """
+        Return the (post stamp, author stamp) pair of each post given as
+        (post id, author id). Stamps are the time_ns() of the last change, or
+        of the first lookup when the cache has none.
+        """
+        keys = {}
+        for post_id, author_id in refs:
+            keys[self._stamp_key('post', post_id)] = None
+            keys[self._stamp_key('account', author_id)] = None
+        stamps = self._get_stamps(keys)
+        return {
+            post_id: (stamps[self._stamp_key('post', post_id)], stamps[self._stamp_key('account', author_id)])
+            for post_id, author_id in refs
+        }
+
+    def account_stamps(self, account_ids):
+        """Return the stamp of each given account, for responses embedding accounts outside posts"""
+        keys = {account_id: self._stamp_key('account', account_id) for account_id in set(account_ids)}
+        stamps = self._get_stamps(keys.values())
+        return {account_id: stamps[key] for account_id, key in keys.items()}
+
+    def _get_stamps(self, keys):
+        stamps = self.cache.get_many(list(keys))
+        missing = {key: time.time_ns() for key in keys if key not in stamps}
+        if missing:
+            self.cache.set_many(missing, timeout=None)
+            stamps.update(missing)
+        return stamps
+
+    def versions(self, refs, stamps=None):
+        """
+        Return the current version of each post given as (post id, author id),
+        made of its ``stamps`` when they were read already
+        """
+        stamps = self.stamps(refs) if stamps is None else stamps
+        return {post_id: '{}.{}'.format(*pair) for post_id, pair in stamps.items()}
+
+    def bump_posts(self, post_ids):
+        """Invalidate the fragments of the given posts"""
+        self._bump('post', post_ids)
+
+    def bump_accounts(self, account_ids):
+        """Invalidate the fragments of every post by the given accounts"""
+        self._bump('account', account_ids)
+
+    def _bump(self, kind, object_ids):
+        keys = [self._stamp_key(kind, object_id) for object_id in set(object_ids)]
+        if keys:
+            transaction.on_commit(lambda: self.cache.set_many(dict.fromkeys(keys, time.time_ns()), timeout=None))
+
+    # Fragments
+
+    def _fragment_key(self, name, post_id, version):
+        return f'{self.prefix}:{name}:{post_id}:{version}'
+
+    def get_many(self, name, versions):
+        """Return the cached fragments of the given post versions keyed by post id"""
+        fragments = {}
+        remote = {}
+        for post_id, version in versions.items():
+            key = self._fragment_key(name, post_id, version)
+            fragment = self.local.get(key)
+            if fragment is None:
+                remote[key] = post_id
+            else:
+                fragments[post_id] = fragment
+
+        found = self.cache.get_many(list(remote)) if remote else {}
+        for key, fragment in found.items():
+            self.local.set(key, fragment)
+            fragments[remote[key]] = fragment
+
+        self._incr('local_hits', len(versions) - len(remote))
+        self._incr('shared_hits', len(found))
+        self._incr('misses', len(remote) - len(found))
+        return fragments
+
+    def set_many(self, name, versions, fragments):
+        """Store freshly rendered fragments in both tiers"""
+        keys = {}
+        for post_id, fragment in fragments.items():
+            key = self._fragment_key(name, post_id, versions[post_id])
+            self.local.set(key, fragment)
+            keys[key] = fragment
+        if keys:
+            self.cache.set_many(keys, timeout=self.options['TIMEOUT'])
+
+    def stats(self):
+        stats = super().stats()
+        total = sum(stats.values())
+        stats['hit_ratio'] = (stats['local_hits'] + stats['shared_hits']) / total if total else 0.0
+        stats['local_size'] = len(self.local)
+        return stats
+
+
+feed_cache = FeedCache()
+post_fragments = PostFragmentCache()
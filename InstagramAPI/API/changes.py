@@ -0,0 +1,124 @@
+"""
+Change log behind delta sync (/api/sync).
+
+Signals append a Change row for every saved or deleted post and story, for
+every like and comment (as a change of its post's counts) and for every
+follow, tagged with the account owning the object. A client keeps the
+``since`` token of its last sync and asks for the entries after it by the
+accounts it follows and by itself; the entries of one object collapse into
+its current state, so a post liked a hundred times is sent once.
+
+``compact_change_log`` deletes entries superseded by a newer entry for the
+same object, which no client needs, and entries older than RETENTION_DAYS.
+Tokens older than that, and the entries of a follow or unfollow by the
+client's account, answer with ``reset``: the client refetches its lists and
+syncs from the returned token.
+
+Entries are read in id order, which is their commit order as long as writes
+are serialized (SQLite with ``transaction_mode`` IMMEDIATE, see settings).
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .helpers import decode_cursor, encode_cursor
+from .models import Change, FollowerConnection
+
+DEFAULTS = {
+    'RETENTION_DAYS': 30,
+    'PAGE_SIZE': 500,
+}
+
+
+def sync_options():
+    return {**DEFAULTS, **getattr(settings, 'DELTA_SYNC', {})}
+
+
+def log_change(kind, object_id, author_id, deleted=False):
+    Change.objects.create(kind=kind, object_id=object_id, author_id=author_id, deleted=deleted)
+
+
+def make_token(position, moment):
+    """
+    Return the sync token of a log position; every entry after it is newer
+    than ``moment``
+    """
+    return encode_cursor([position, moment.isoformat()])
+
+
+def read_token(token):
+    """Return the (position, moment) of a token, or None for an invalid one"""
+    value = decode_cursor(token)
+    if not isinstance(value, list) or len(value) != 2 or not isinstance(value[0], int):
+        return None
+    try:
+        moment = datetime.fromisoformat(value[1])
+    except (TypeError, ValueError):
+        return None
+    if timezone.is_naive(moment):
+        return None
+    return value[0], moment
+
+
+SyncResult = namedtuple('SyncResult', [
+    'token', 'reset', 'has_more', 'posts', 'stories', 'counts', 'deleted_posts', 'deleted_stories',
+])
+
+
+def changes_since(user, token, limit=None):
+    """
+    Return the changes relevant to ``user`` after a sync token: ``posts`` as
+    (post id, author id) pairs, ``stories`` and ``counts`` as ids of stories
+    and posts, and the ids of deleted posts and stories.
+    """
+    options = sync_options()
+    limit = limit or options['PAGE_SIZE']
+    now = timezone.now()
+    head = Change.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    head_token = make_token(head, now)
+    position = read_token(token) if token else None
+    if position is None or position[1] < now - timedelta(days=options['RETENTION_DAYS']):
+        # Entries after the position may have been compacted away
+        return SyncResult(head_token, True, False, [], [], [], [], [])
+    since = position[0]
+
+    followed = FollowerConnection.objects.filter(follower=user).values('following_id')
+    entries = list(
+        Change.objects.filter(pk__gt=since, pk__lte=head)
+        .filter((Q(author_id__in=followed) & ~Q(kind=Change.FOLLOW)) | Q(author_id=user.pk))
+        .order_by('pk')
+        .values_list('pk', 'kind', 'object_id', 'author_id', 'deleted', 'created_at')[:limit + 1]
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    if any(kind == Change.FOLLOW for _, kind, _, _, _, _ in entries):
+        return SyncResult(head_token, True, False, [], [], [], [], [])
+
+    # Later entries of an object replace the earlier ones
+    latest = {}
+    for _, kind, object_id, author_id, deleted, _ in entries:
+        latest.pop((kind, object_id), None)
+        latest[(kind, object_id)] = (author_id, deleted)
+    posts, stories, deleted_posts, deleted_stories = [], [], [], []
+    for (kind, object_id), (author_id, deleted) in latest.items():
+        if kind == Change.POST and deleted:
+            deleted_posts.append(object_id)
+        elif kind == Change.POST:
+            posts.append((object_id, author_id))
+        elif kind == Change.STORY and deleted:
+            deleted_stories.append(object_id)
+        elif kind == Change.STORY:
+            stories.append(object_id)
+    # Sent posts carry their counts already
+    skip = {post_id for post_id, _ in posts}.union(deleted_posts)
+    counts = [object_id for kind, object_id in latest if kind == Change.COUNTS and object_id not in skip]
+
+    if has_more:
+        last = entries[-1]
+        token = make_token(last[0], last[5])
+    else:
+        token = head_token
+    return SyncResult(token, False, has_more, posts, stories, counts, deleted_posts, deleted_stories)
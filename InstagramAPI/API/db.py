@@ -0,0 +1,99 @@
+"""
+Write serialization for SQLite.
+
+SQLite lets one connection write at a time. Request handlers run their writes
+through ``write()``, which runs them in a transaction (BEGIN IMMEDIATE with
+the default DATABASES options, so the write lock is taken up front). With
+DATABASE_WRITER_QUEUE enabled the transaction runs on a single writer thread
+instead: request threads wait on an in-process queue rather than on the
+database lock. Like a request, each job starts and ends with
+close_old_connections(), so the writer's connection follows CONN_MAX_AGE and
+is replaced when it breaks.
+"""
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .routers import mark_write
+
+
+class WriterBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many pending writes, try again later.'
+    default_code = 'writer_busy'
+
+
+class WriterQueue:
+    """
+    Runs submitted callables one at a time, in order, on a daemon thread
+    """
+
+    def __init__(self, maxsize=1000, put_timeout=5.0):
+        self._queue = queue.Queue(maxsize)
+        self.put_timeout = put_timeout
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def in_writer(self):
+        return threading.current_thread() is self._thread
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            if future.set_running_or_notify_cancel():
+                close_old_connections()
+                try:
+                    with transaction.atomic():
+                        result = func(*args, **kwargs)
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+                finally:
+                    close_old_connections()
+            self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a call and return its Future, raising WriterBusy when the queue stays full"""
+        self._start()
+        future = Future()
+        try:
+            self._queue.put((future, func, args, kwargs), timeout=self.put_timeout)
+        except queue.Full:
+            raise WriterBusy()
+        return future
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+writer_queue = WriterQueue(getattr(settings, 'DATABASE_WRITER_QUEUE_SIZE', 1000))
+
+
+def write(func, *args, **kwargs):
+    """
+    Run ``func(*args, **kwargs)`` in a write transaction and return its result.
+    Calls made inside a transaction run inline: the writer thread could not see
+    its uncommitted rows and would wait for the lock it holds.
+    """
+    mark_write()
+    if (
+        getattr(settings, 'DATABASE_WRITER_QUEUE', False)
+        and not connection.in_atomic_block
+        and not writer_queue.in_writer
+    ):
+        return writer_queue.submit(func, *args, **kwargs).result()
+    with transaction.atomic():
+        return func(*args, **kwargs)
@@ -0,0 +1,248 @@
+"""
+Soft deletion of accounts and posts, and the background reaper removing them.
+
+Deleting an account or a post only stamps ``deleted_at`` on it (and on the
+account's posts and stories), which hides it from the default managers at
+once, and queues a DeletionJob. ``reap_deleted`` then works through the
+jobs: the dependent rows are deleted step by step in batches of at most
+``batch_size`` rows, each batch in its own short transaction together with
+the job's progress, and the image files are removed from storage before
+their rows. An interrupted job is simply run again: every step deletes
+whatever is left of its rows, so the steps already done find nothing.
+
+The likes, comments and views of a deleted account are deleted at once
+instead, since the post counts are made of them: these are the account's
+own rows, found through their user indexes, while the bulk of a heavy
+account, the likes, comments and views of everybody on its posts, is left
+to the job. The count changes of the posts that lose them are logged once,
+when the account is deleted. Its follows stay until the job, so that delta
+sync keeps sending its followers the deletion of its posts, and the follow
+counts leave them out. Deletions whose changes are logged already, those
+and the reaper's, are made under ``reaping`` and not logged again.
+"""
+import time
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .authentication import principals
+from .cache import feed_cache, post_fragments
+from .hashtags import forget_posts
+from .models import (
+    Account,
+    Change,
+    Comment,
+    DeletionJob,
+    FollowerConnection,
+    Likes,
+    Mention,
+    Notification,
+    Post,
+    PostViewSketch,
+    SeenPost,
+    Story,
+)
+from .notifications import forget_unread, unread_counts
+from .search import get_search_backend
+
+
+# True while rows whose removal is logged already are deleted
+reaping = ContextVar('reaping', default=False)
+
+
+def _hide(kind, queryset, now):
+    """Stamp the rows of a post or story queryset as deleted; return their (id, author id) pairs"""
+    refs = list(queryset.values_list('pk', 'user_id'))
+    if refs:
+        queryset.update(deleted_at=now)
+        Change.objects.bulk_create(
+            [Change(kind=kind, object_id=pk, author_id=author_id, deleted=True) for pk, author_id in refs],
+            batch_size=500,
+        )
+    return refs
+
+
+def _forget_posts(refs):
+    """Take hidden posts out of the search index and the caches"""
+    search = get_search_backend()
+    for post_id, _ in refs:
+        search.remove_post(post_id)
+    post_fragments.bump_posts([post_id for post_id, _ in refs])
+    feed_cache.invalidate_authors([author_id for _, author_id in refs])
+
+
+def delete_post(post):
+    """Hide a post and queue the removal of it and its likes, comments and views"""
+    with transaction.atomic():
+        forget_posts(Post.objects.filter(pk=post.pk))
+        refs = _hide(Change.POST, Post.objects.filter(pk=post.pk), timezone.now())
+        if refs:
+            DeletionJob.objects.create(kind=DeletionJob.POST, object_id=post.pk)
+            _forget_posts(refs)
+
+
+def delete_account(account):
+    """
+    Hide an account with its posts and stories, delete its likes, comments
+    and views, revoke its tokens and queue the removal of everything else it
+    owns
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if not Account.objects.filter(pk=account.pk).update(
+            deleted_at=now, token_version=F('token_version') + 1
+        ):
+            return
+        forget_posts(Post.objects.filter(user=account))
+        refs = _hide(Change.POST, Post.objects.filter(user=account), now)
+        _hide(Change.STORY, Story.objects.filter(user=account), now)
+        DeletionJob.objects.create(kind=DeletionJob.ACCOUNT, object_id=account.pk)
+        get_search_backend().remove_account(account.pk)
+        _forget_posts(refs)
+        # Its activity leaves the counts of the posts it interacted with
+        post_ids = _interacted_posts(account.pk)
+        token = reaping.set(True)
+        try:
+            for queryset in _activity(account.pk):
+                queryset.delete()
+        finally:
+            reaping.reset(token)
+        _log_counts(post_ids)
+        post_fragments.bump_posts(post_ids)
+        # Its followers lose a feed source
+        feed_cache.invalidate_authors([account.pk])
+    principals.forget(account.pk)
+
+
+def _interacted_posts(account_id):
+    """Return the ids of the posts an account liked or commented on"""
+    liked = Likes.objects.filter(user_id=account_id).values_list('post_id', flat=True)
+    commented = Comment.objects.filter(user_id=account_id).values_list('post_id', flat=True)
+    return set(liked.union(commented))
+
+
+def _activity(account_id):
+    """The rows of an account counted on posts"""
+    return [
+        SeenPost.objects.filter(user_id=account_id),
+        Likes.objects.filter(user_id=account_id),
+        Comment.objects.filter(user_id=account_id),
+    ]
+
+
+def _post_steps(post_ids):
+    """Dependent rows of posts, deleted before the posts themselves"""
+    return [
+        ('likes', Likes.objects.filter(post_id__in=post_ids), None),
+        ('comments', Comment.objects.filter(post_id__in=post_ids), None),
+        ('seen', SeenPost.objects.filter(post_id__in=post_ids), None),
+        ('notifications', Notification.objects.filter(post_id__in=post_ids), None),
+        ('mentions', Mention.objects.filter(post_id__in=post_ids), None),
+        ('sketches', PostViewSketch.objects.filter(post_id__in=post_ids), None),
+        ('posts', Post.all_objects.filter(pk__in=post_ids), 'image'),
+    ]
+
+
+def _account_steps(account_id):
+    """
+    Rows owned by an account, its posts being reaped separately. Its views,
+    likes and comments are deleted with the account already; those steps
+    only find rows written concurrently.
+    """
+    return [
+        ('seen_posts', SeenPost.objects.filter(user_id=account_id), None),
+        ('likes', Likes.objects.filter(user_id=account_id), None),
+        ('comments', Comment.objects.filter(user_id=account_id), None),
+        ('following', FollowerConnection.objects.filter(follower_id=account_id), None),
+        ('followers', FollowerConnection.objects.filter(following_id=account_id), None),
+        ('notifications', Notification.objects.filter(recipient_id=account_id), None),
+        ('mentions', Mention.objects.filter(user_id=account_id), None),
+        ('stories', Story.all_objects.filter(user_id=account_id), 'image'),
+    ]
+
+
+def _log_counts(post_ids):
+    """Log a count change for each visible post that lost likes or comments"""
+    Change.objects.bulk_create(
+        [
+            Change(kind=Change.COUNTS, object_id=pk, author_id=author_id)
+            for pk, author_id in Post.objects.filter(pk__in=post_ids).values_list('pk', 'user_id')
+        ],
+        batch_size=500,
+    )
+
+
+class Reaper:
+    """
+    Runs deletion jobs in batches of ``batch_size`` rows, sleeping ``pause``
+    seconds between batches to leave the database to requests
+    """
+
+    def __init__(self, batch_size=500, pause=0.0):
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def run(self, job):
+        """Run a new or interrupted job to the end"""
+        if job.kind == DeletionJob.POST:
+            self._run_steps(job, _post_steps([job.object_id]))
+        else:
+            self._run_steps(job, _account_steps(job.object_id))
+            while True:
+                post_ids = list(
+                    Post.all_objects.filter(user_id=job.object_id).order_by('pk')
+                    .values_list('pk', flat=True)[:self.batch_size]
+                )
+                if not post_ids:
+                    break
+                self._run_steps(job, _post_steps(post_ids))
+            self._run_steps(job, [('account', Account.all_objects.filter(pk=job.object_id), 'profile_picture')])
+        job.step = ''
+        job.finished_at = timezone.now()
+        job.save(update_fields=['step', 'finished_at', 'updated_at'])
+
+    def _run_steps(self, job, steps):
+        for name, queryset, file_field in steps:
+            while self._delete_batch(job, name, queryset, file_field):
+                if self.pause:
+                    time.sleep(self.pause)
+
+    def _delete_batch(self, job, step, queryset, file_field):
+        """
+        Delete up to ``batch_size`` rows of a step; return how many there were
+        (their cascades being counted in the job's progress too)
+        """
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+        if not pks:
+            return 0
+        files = 0
+        if file_field:
+            # Files go first: an interrupted batch is retried and finds them gone
+            storage = queryset.model._meta.get_field(file_field).storage
+            for name in queryset.filter(pk__in=pks).values_list(file_field, flat=True):
+                if name:
+                    storage.delete(name)
+                    files += 1
+        with transaction.atomic():
+            rows = queryset.model._base_manager.filter(pk__in=pks)
+            if queryset.model is Notification:
+                forget_unread(unread_counts(rows))
+            token = reaping.set(True)
+            try:
+                deleted, _ = rows.delete()
+            finally:
+                reaping.reset(token)
+            DeletionJob.objects.filter(pk=job.pk).update(
+                step=step,
+                rows_deleted=F('rows_deleted') + deleted,
+                files_deleted=F('files_deleted') + files,
+                updated_at=timezone.now(),
+            )
+        job.step = step
+        return len(pks)
+
+
+def pending_jobs():
+    return DeletionJob.objects.filter(finished_at__isnull=True).order_by('pk')
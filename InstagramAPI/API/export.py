@@ -0,0 +1,146 @@
+"""
+Streaming export of an account's data.
+
+The account, its posts, comments, likes, follows and stories are written as
+NDJSON, one ``{"type": ..., ...}`` object per line, reading each table with
+``.iterator(chunk_size=...)`` and handing out the output in blocks of about
+BUFFER_SIZE bytes. The zip variant holds the same lines as ``data.ndjson``
+and the account's images under ``media/``, written by zipfile into a stream
+(with data descriptors, since nothing is seekable), so memory stays the same
+whatever the size of the account.
+"""
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from .models import Account, Comment, FollowerConnection, Likes, Post, Story
+
+DEFAULT_CHUNK_SIZE = 1000
+BUFFER_SIZE = 64 * 1024
+
+ACCOUNT_FIELDS = [
+    'id', 'username', 'email', 'first_name', 'last_name', 'description', 'profile_picture',
+    'date_joined', 'last_login',
+]
+
+
+def export_sections(account):
+    """
+    Return the (record type, values queryset) pairs of an account's export.
+    The follows of deleted accounts wait for the reaper and are left out.
+    """
+    return [
+        ('account', Account.objects.filter(pk=account.pk).values(*ACCOUNT_FIELDS)),
+        ('post', Post.objects.filter(user=account).values('id', 'created_at', 'description', 'image')),
+        ('comment', Comment.objects.filter(user=account).values('id', 'created_at', 'post_id', 'text')),
+        ('like', Likes.objects.filter(user=account).values('id', 'post_id')),
+        ('following', FollowerConnection.objects.filter(follower=account, following__deleted_at__isnull=True).values(
+            'id', 'following_id', username=F('following__username'),
+        )),
+        ('follower', FollowerConnection.objects.filter(following=account, follower__deleted_at__isnull=True).values(
+            'id', 'follower_id', username=F('follower__username'),
+        )),
+        ('story', Story.objects.filter(user=account).values('id', 'created_at', 'image')),
+    ]
+
+
+def export_lines(account, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the NDJSON lines of an account's export as bytes"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for record_type, queryset in export_sections(account):
+        for row in queryset.order_by('pk').iterator(chunk_size=chunk_size):
+            yield (encoder.encode({'type': record_type, **row}) + '\n').encode()
+
+
+def media_files(account, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the (storage, name) of every image of an account"""
+    sources = [
+        (Account, Account.objects.filter(pk=account.pk), 'profile_picture'),
+        (Post, Post.objects.filter(user=account), 'image'),
+        (Story, Story.objects.filter(user=account), 'image'),
+    ]
+    for model, queryset, field_name in sources:
+        storage = model._meta.get_field(field_name).storage
+        names = queryset.order_by('pk').values_list(field_name, flat=True)
+        for name in names.iterator(chunk_size=chunk_size):
+            if name:
+                yield storage, name
+
+
+def buffered(chunks, size=BUFFER_SIZE):
+    """Join small chunks into blocks of at least ``size`` bytes"""
+    pending, length = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b''.join(pending)
+            pending, length = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def export_ndjson(account, chunk_size=DEFAULT_CHUNK_SIZE):
+    return buffered(export_lines(account, chunk_size))
+
+
+class _Stream:
+    """Write-only file object collecting what zipfile writes until it is taken"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+
+def export_zip(account, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield a zip of the NDJSON export and the account's images"""
+    stream = _Stream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('data.ndjson', 'w', force_zip64=True) as data:
+            for line in export_lines(account, chunk_size):
+                data.write(line)
+                if stream.size >= BUFFER_SIZE:
+                    yield stream.take()
+        for storage, name in media_files(account, chunk_size):
+            try:
+                source = storage.open(name)
+            except FileNotFoundError:
+                continue
+            # Images are compressed already
+            info = zipfile.ZipInfo(f'media/{name}')
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(info, 'w', force_zip64=True) as target:
+                for chunk in source.chunks(BUFFER_SIZE):
+                    target.write(chunk)
+                    if stream.size >= BUFFER_SIZE:
+                        yield stream.take()
+    yield stream.take()
+
+
+async def async_chunks(chunks):
+    """
+    Async iterator over a synchronous chunk iterator, for ASGI, which would
+    otherwise read the whole iterator into memory before sending it
+    """
+    chunks = iter(chunks)
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(chunks, done)
+        if chunk is done:
+            break
+        yield chunk
@@ -0,0 +1,202 @@
+"""
+values()-based serialization for list responses.
+
+A compiled serializer walks a serializer's readable fields once and turns
+them into a plan of values() columns and converters, then serializes a whole
+queryset from a single query. Every value is still converted by the
+serializer's own field instance, so the output is identical to
+``serializer.data``; SerializerMethodFields must be computed in SQL by the
+compiled class, and serializers using anything it cannot express fall back
+to the regular path.
+"""
+from django.conf import settings
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+
+from .models import Comment, Likes, Post, SeenPost, Story
+from .sketches import approximate, seen_counts
+
+
+class NotCompilable(Exception):
+    pass
+
+
+def count_subquery(model, field='post'):
+    """Correlated COUNT(*) of ``model`` rows pointing at the outer row"""
+    counts = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+class CompiledSerializer:
+    """
+    Base class of the compiled serializers
+    """
+    model = None
+    # Serializer fields read from another values() lookup than their source
+    sources = {}
+
+    def __init__(self, serializer, exclude=()):
+        self.context = serializer.context
+        self.exclude = set(exclude)
+        self.annotations = self.get_annotations()
+        self.loaders = self.get_loaders()
+        self.loaded = []
+        self.columns = ['pk']
+        self.plan = self._compile(serializer, prefix='')
+
+    def get_annotations(self):
+        """Return the SQL expressions of the serializer's method fields"""
+        return {}
+
+    def get_loaders(self):
+        """
+        Return functions computing method fields outside of SQL, each taking a
+        list of pks and returning the values keyed by pk
+        """
+        return {}
+
+    def _column(self, lookup):
+        if lookup not in self.columns:
+            self.columns.append(lookup)
+        return lookup
+
+    def _compile(self, serializer, prefix):
+        model = serializer.Meta.model
+        plan = []
+        for field in serializer._readable_fields:
+            name = field.field_name
+            if not prefix and name in self.exclude:
+                continue
+            key = prefix + name
+            if key in self.sources:
+                plan.append((name, self._column(self.sources[key]), None))
+            elif isinstance(field, serializers.BaseSerializer):
+                plan.append((name, None, self._compile(field, f'{prefix}{field.source}__')))
+            elif isinstance(field, serializers.SerializerMethodField):
+                if not prefix and name in self.loaders:
+                    self.loaded.append(name)
+                    plan.append((name, name, None))
+                    continue
+                if prefix or name not in self.annotations:
+                    raise NotCompilable(key)
+                plan.append((name, self._column(name), None))
+            elif isinstance(field, serializers.FileField):
+                model_field = model._meta.get_field(field.source)
+                plan.append((name, self._column(prefix + field.source), self._file(field, model_field)))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                plan.append((name, self._column(prefix + field.source), None))
+            elif isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField)):
+                raise NotCompilable(key)
+            elif '.' in field.source or field.source == '*':
+                raise NotCompilable(key)
+            else:
+                plan.append((name, self._column(prefix + field.source), field.to_representation))
+        return plan
+
+    @staticmethod
+    def _file(field, model_field):
+        def convert(name):
+            return field.to_representation(model_field.attr_class(None, model_field, name))
+        return convert
+
+    def _build(self, plan, row):
+        ret = {}
+        for name, column, convert in plan:
+            if column is None:
+                ret[name] = self._build(convert, row)
+                continue
+            value = row[column]
+            ret[name] = convert(value) if convert is not None and value is not None else value
+        return ret
+
+    def _rows(self, queryset):
+        # Annotations for fields left out by ?fields= are never queried
+        annotations = {name: value for name, value in self.annotations.items() if name in self.columns}
+        rows = queryset.annotate(**annotations).values(*self.columns)
+        if not self.loaded:
+            return rows
+        rows = list(rows)
+        pks = [row['pk'] for row in rows]
+        for name in self.loaded:
+            values = self.loaders[name](pks)
+            for row in rows:
+                row[name] = values[row['pk']]
+        return rows
+
+    def serialize(self, queryset):
+        """Serialize a queryset with a single query, keeping its order"""
+        return [self._build(self.plan, row) for row in self._rows(queryset)]
+
+    def serialize_map(self, pks):
+        """Serialize the given objects keyed by pk"""
+        rows = self._rows(self.model.objects.filter(pk__in=pks))
+        return {row['pk']: self._build(self.plan, row) for row in rows}
+
+    def serialize_pks(self, pks):
+        """Serialize the given objects in the given order"""
+        rows = self.serialize_map(pks)
+        return [rows[pk] for pk in pks if pk in rows]
+
+
+class CompiledPostSerializer(CompiledSerializer):
+    model = Post
+
+    def get_annotations(self):
+        annotations = {
+            'likes_count': count_subquery(Likes),
+            'comments_count': count_subquery(Comment),
+        }
+        if not approximate():
+            annotations['seen_count'] = count_subquery(SeenPost)
+        if 'is_liked' not in self.exclude:
+            request = self.context.get('request')
+            if request and request.user.is_authenticated:
+                annotations['is_liked'] = Exists(Likes.objects.filter(post=OuterRef('pk'), user=request.user))
+            else:
+                annotations['is_liked'] = Value(False)
+        return annotations
+
+    def get_loaders(self):
+        if approximate():
+            return {'seen_count': seen_counts}
+        return {}
+
+
+class CompiledCommentSerializer(CompiledSerializer):
+    model = Comment
+    # StringRelatedField renders str(account), which is the username
+    sources = {'user': 'user__username'}
+
+
+class CompiledStorySerializer(CompiledSerializer):
+    model = Story
+
+
+COMPILED_SERIALIZERS = {
+    Post: CompiledPostSerializer,
+    Comment: CompiledCommentSerializer,
+    Story: CompiledStorySerializer,
+}
+
+
+def compile_serializer(serializer, exclude=()):
+    """
+    Return the compiled version of a serializer, or None when the fast path is
+    disabled or the serializer uses fields it cannot express
+    """
+    if not getattr(settings, 'API_FAST_SERIALIZATION', False):
+        return None
+    compiled_class = COMPILED_SERIALIZERS.get(serializer.Meta.model)
+    if compiled_class is None:
+        return None
+    try:
+        return compiled_class(serializer, exclude=exclude)
+    except NotCompilable:
+        return None
@@ -0,0 +1,96 @@
+"""
+Password hashing off the request worker.
+
+Checking or setting a password costs a full PBKDF2 run. Login and
+registration run it on a small thread pool (hashlib releases the GIL while
+hashing) so at most PASSWORD_HASHING['WORKERS'] hashes use the CPU at once,
+and at most MAX_PENDING more wait for it: past that, requests fail fast with
+503 instead of piling up on every worker during a login burst.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+DEFAULTS = {
+    'WORKERS': 4,
+    'MAX_PENDING': 32,
+    'TIMEOUT': 30,
+}
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, try again later.'
+    default_code = 'hashing_busy'
+
+
+class HashingPool:
+    """
+    Bounded executor: ``workers`` threads and at most ``max_pending`` queued
+    calls. With no workers, calls run inline on the caller's thread.
+    """
+
+    def __init__(self, workers, max_pending, timeout=None):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending) if workers else None
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='hashing') if workers else None
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING', {})}
+        return cls(options['WORKERS'], options['MAX_PENDING'], options['TIMEOUT'])
+
+    @staticmethod
+    def _call(func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    def run(self, func, *args, **kwargs):
+        """Run ``func`` on the pool and wait for its result"""
+        if self._executor is None:
+            return func(*args, **kwargs)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._executor.submit(self._call, func, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HashingBusy()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool.from_settings()
+    return _pool
+
+
+def check_credentials(username, password):
+    """``authenticate()`` run on the hashing pool"""
+    return get_pool().run(authenticate, username=username, password=password)
+
+
+def hash_password(password):
+    """``make_password()`` run on the hashing pool"""
+    return get_pool().run(make_password, password)
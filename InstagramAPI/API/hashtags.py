@@ -0,0 +1,106 @@
+"""
+Hashtag and mention indexing.
+
+Post descriptions are parsed on save into PostHashtag and Mention rows, and
+HashtagTrend keeps a running count of posts per hashtag and time bucket, so
+trending hashtags are a sum over a handful of buckets instead of an
+aggregate over every post.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .helpers import extract_hashtags, extract_mentions, time_bucket
+from .models import Account, Hashtag, HashtagTrend, Mention, PostHashtag
+
+
+def bucket_size():
+    return getattr(settings, 'HASHTAG_TREND_BUCKET_SECONDS', 3600)
+
+
+def bucket_start(moment):
+    """Return the start of the trend bucket containing ``moment``"""
+    return time_bucket(moment, bucket_size())
+
+
+def _add_to_trend(hashtag_ids, bucket, delta):
+    for hashtag_id in hashtag_ids:
+        updated = HashtagTrend.objects.filter(hashtag_id=hashtag_id, bucket_start=bucket).update(
+            count=F('count') + delta
+        )
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                HashtagTrend.objects.create(hashtag_id=hashtag_id, bucket_start=bucket, count=delta)
+        except IntegrityError:
+            # Created concurrently
+            HashtagTrend.objects.filter(hashtag_id=hashtag_id, bucket_start=bucket).update(
+                count=F('count') + delta
+            )
+
+
+def _hashtag_ids(names):
+    if not names:
+        return {}
+    Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+    return dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+
+
+@transaction.atomic
+def sync_post(post):
+    """
+    Update the hashtag, mention and trend rows of a post from its description.
+    Only the difference with the stored rows is written.
+    """
+    names = extract_hashtags(post.description)
+    wanted = set(_hashtag_ids(names).values())
+    current = set(PostHashtag.objects.filter(post=post).values_list('hashtag_id', flat=True))
+    added, removed = wanted - current, current - wanted
+
+    PostHashtag.objects.bulk_create([PostHashtag(post=post, hashtag_id=hashtag_id) for hashtag_id in added])
+    PostHashtag.objects.filter(post=post, hashtag_id__in=removed).delete()
+    bucket = bucket_start(post.created_at)
+    _add_to_trend(added, bucket, 1)
+    _add_to_trend(removed, bucket, -1)
+
+    usernames = extract_mentions(post.description)
+    mentioned = set(Account.objects.filter(username__in=usernames).values_list('id', flat=True))
+    current = set(Mention.objects.filter(post=post).values_list('user_id', flat=True))
+    Mention.objects.bulk_create([Mention(post=post, user_id=user_id) for user_id in mentioned - current])
+    Mention.objects.filter(post=post, user_id__in=current - mentioned).delete()
+
+
+def forget_post(post):
+    """Take a post that is about to be deleted out of the trend counts"""
+    hashtag_ids = PostHashtag.objects.filter(post=post).values_list('hashtag_id', flat=True)
+    _add_to_trend(list(hashtag_ids), bucket_start(post.created_at), -1)
+
+
+def forget_posts(posts):
+    """Take the posts of a queryset that are about to be hidden out of the trend counts"""
+    counts = Counter(
+        (hashtag_id, bucket_start(created_at))
+        for hashtag_id, created_at in PostHashtag.objects.filter(post__in=posts).values_list(
+            'hashtag_id', 'post__created_at'
+        ).iterator()
+    )
+    for (hashtag_id, bucket), count in counts.items():
+        _add_to_trend([hashtag_id], bucket, -count)
+
+
+def trending(hours=24, limit=20):
+    """Return (hashtag name, post count) pairs for the last ``hours`` hours"""
+    since = bucket_start(timezone.now() - timedelta(hours=hours))
+    return list(
+        HashtagTrend.objects.filter(bucket_start__gte=since)
+        .values('hashtag__name')
+        .annotate(total=Sum('count'))
+        .filter(total__gt=0)
+        .order_by('-total', 'hashtag__name')
+        .values_list('hashtag__name', 'total')[:limit]
+    )
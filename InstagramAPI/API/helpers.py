@@ -0,0 +1,100 @@
+import base64
+import json
+import re
+import unicodedata
+from datetime import datetime, timezone as dt_timezone
+
+from .models import Hashtag
+
+# Helpers of the App
+
+
+def query_param_list(request, name):
+    """
+    Return the comma-separated values of a query parameter as a list,
+    or None when the parameter is absent
+    """
+    if request is None or name not in request.query_params:
+        return None
+    values = []
+    for value in request.query_params.getlist(name):
+        values.extend(item.strip() for item in value.split(',') if item.strip())
+    return values
+
+
+def field_requested(request, name):
+    """Return whether ``?fields=`` keeps a field (see DynamicFieldsMixin)"""
+    fields = query_param_list(request, 'fields')
+    return fields is None or name in fields
+
+
+def field_embedded(request, name):
+    """Return whether a nested field is kept and embedded by ``?fields=`` and ``?expand=``"""
+    expand = query_param_list(request, 'expand')
+    return field_requested(request, name) and (expand is None or name in expand)
+
+
+def parse_id(value):
+    """
+    Return a string of ASCII digits as an integer id, or None for anything
+    else (str.isdigit() also accepts characters such as '²' that int() rejects)
+    """
+    value = value.strip()
+    return int(value) if value.isascii() and value.isdecimal() else None
+
+
+def query_param_int(request, name, default, minimum=1, maximum=None):
+    """
+    Return an integer query parameter clamped to [minimum, maximum],
+    or the default when it is absent or not an integer
+    """
+    try:
+        value = int(request.query_params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+    value = max(value, minimum)
+    return min(value, maximum) if maximum is not None else value
+
+
+def encode_cursor(position):
+    """Encode a JSON-serializable pagination position as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the position stored in a cursor, or None for a missing or invalid one"""
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+
+
+def time_bucket(moment, size):
+    """Return the start of the ``size`` seconds long UTC bucket containing ``moment``"""
+    timestamp = int(moment.timestamp()) // size * size
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+HASHTAG_MAX_LENGTH = Hashtag._meta.get_field('name').max_length
+HASHTAG_RE = re.compile(rf'(?<![\w&])#(\w{{1,{HASHTAG_MAX_LENGTH}}})')
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]{1,150})')
+
+
+def normalize_hashtag(name):
+    """
+    Return the form hashtags are stored and looked up in, cut to
+    HASHTAG_MAX_LENGTH since NFKC and casefolding can make a tag longer
+    """
+    return unicodedata.normalize('NFKC', name.lstrip('#')).casefold()[:HASHTAG_MAX_LENGTH]
+
+
+def extract_hashtags(text):
+    """Return the normalized hashtags of a text, in order of first use"""
+    return list(dict.fromkeys(normalize_hashtag(tag) for tag in HASHTAG_RE.findall(text or '')))
+
+
+def extract_mentions(text):
+    """Return the usernames mentioned in a text, in order of first use"""
+    return list(dict.fromkeys(name.rstrip('.') for name in MENTION_RE.findall(text or '')))
@@ -0,0 +1,191 @@
+"""
+Live like and comment counts over server-sent events.
+
+Like and comment signals publish the id of the changed post to a broker.
+Each ASGI process subscribes to the broker once and keeps a LiveCounts hub:
+changed ids are collected into a dirty set, and every INTERVAL_MS the hub
+counts the dirty posts that somebody watches in one query and hands the
+counts to their subscribers. A post liked a thousand times in an interval
+therefore costs one count and at most one event per subscriber.
+
+The default InProcessBroker only reaches subscribers of the process that
+handled the write; set LIVE_UPDATES['BROKER'] to a BaseBroker implementation
+backed by a shared bus (Redis pub/sub, PostgreSQL LISTEN/NOTIFY, ...) when
+running several processes.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .fastpath import count_subquery
+from .models import Comment, Likes, Post
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BROKER': 'InstagramAPI.API.live.InProcessBroker',
+    'INTERVAL_MS': 500,
+    'MAX_POSTS': 100,
+    'HEARTBEAT_SECONDS': 15,
+}
+
+
+def live_options():
+    return {**DEFAULTS, **getattr(settings, 'LIVE_UPDATES', {})}
+
+
+class BaseBroker:
+    """
+    Interface of the brokers carrying post change notifications between
+    the processes that write and the processes that stream
+    """
+
+    def publish(self, post_id):
+        """Announce that the counts of a post changed"""
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        """Call ``callback(post_id)`` for every announcement, from any thread"""
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Delivers announcements to the callbacks of the current process
+    """
+
+    def __init__(self):
+        self._callbacks = []
+
+    def publish(self, post_id):
+        for callback in list(self._callbacks):
+            callback(post_id)
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(live_options()['BROKER'])()
+    return _broker
+
+
+def post_counts(post_ids):
+    """Return the like and comment counts of the given posts keyed by post id"""
+    rows = (
+        Post.objects.filter(pk__in=post_ids)
+        .annotate(likes_count=count_subquery(Likes), comments_count=count_subquery(Comment))
+        .values_list('pk', 'likes_count', 'comments_count')
+    )
+    return {pk: {'likes_count': likes, 'comments_count': comments} for pk, likes, comments in rows}
+
+
+class Subscriber:
+    """
+    One SSE stream: the posts it watches and the counts not sent yet
+    """
+
+    def __init__(self, post_ids):
+        self.post_ids = set(post_ids)
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def push(self, counts):
+        self.pending.update(counts)
+        self.ready.set()
+
+    def take(self):
+        pending, self.pending = self.pending, {}
+        self.ready.clear()
+        return pending
+
+
+class LiveCounts:
+    """
+    Per-process hub between the broker and the SSE subscribers
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._task = None
+        self._listening = False
+
+    def changed(self, post_id):
+        """Broker callback, safe to call from any thread"""
+        if post_id not in self._subscribers:
+            return
+        with self._lock:
+            self._dirty.add(post_id)
+
+    def subscribe(self, post_ids):
+        """Register a subscriber; must be called from the event loop"""
+        if not self._listening:
+            get_broker().subscribe(self.changed)
+            self._listening = True
+        subscriber = Subscriber(post_ids)
+        for post_id in subscriber.post_ids:
+            self._subscribers[post_id].add(subscriber)
+        if self._task is None or self._task.done():
+            # Started outside the request's context so its queries do not run
+            # on the thread of the request that happened to start it
+            loop = asyncio.get_running_loop()
+            self._task = contextvars.Context().run(loop.create_task, self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        for post_id in subscriber.post_ids:
+            watchers = self._subscribers.get(post_id)
+            if watchers is not None:
+                watchers.discard(subscriber)
+                if not watchers:
+                    del self._subscribers[post_id]
+
+    @property
+    def subscriber_count(self):
+        return len({subscriber for watchers in self._subscribers.values() for subscriber in watchers})
+
+    async def flush(self):
+        """Send the current counts of the changed posts to their subscribers"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        watched = [post_id for post_id in dirty if post_id in self._subscribers]
+        if not watched:
+            return
+        counts = await sync_to_async(post_counts)(watched)
+        for post_id, post in counts.items():
+            for subscriber in self._subscribers.get(post_id, ()):
+                subscriber.push({post_id: post})
+
+    async def _run(self):
+        interval = live_options()['INTERVAL_MS'] / 1000
+        while self._subscribers:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Live count update failed')
+
+
+live_counts = LiveCounts()
+
+
+def post_changed(post_id):
+    """Announce a like or comment change once the current transaction commits"""
+    transaction.on_commit(lambda: get_broker().publish(post_id))
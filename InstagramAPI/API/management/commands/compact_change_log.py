@@ -0,0 +1,49 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, Max, Min, OuterRef
+from django.utils import timezone
+
+from ...changes import sync_options
+from ...models import Change
+
+
+class Command(BaseCommand):
+    help = "Delete superseded and expired entries of the delta sync change log"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Delete entries older than this many days (default DELTA_SYNC['RETENTION_DAYS']; "
+                 "never less, or clients miss changes)",
+        )
+        parser.add_argument('--batch-size', type=int, default=10000, help="Log positions scanned per delete")
+
+    def handle(self, *args, **options):
+        days = options['days'] or sync_options()['RETENTION_DAYS']
+        batch_size = max(options['batch_size'], 1)
+        cutoff = timezone.now() - timedelta(days=days)
+        expired = Change.objects.filter(created_at__lt=cutoff).aggregate(last=Max('pk'))['last']
+        bounds = Change.objects.aggregate(first=Min('pk'), last=Max('pk'))
+
+        removed = superseded = 0
+        if expired is not None:
+            for start in range(bounds['first'], expired + 1, batch_size):
+                removed += Change.objects.filter(
+                    pk__gte=start, pk__lt=start + batch_size, pk__lte=expired
+                ).delete()[0]
+
+        # An entry is superseded once a newer one exists for the same object:
+        # every token before the old entry is also before the new one
+        newer = Change.objects.filter(
+            kind=OuterRef('kind'), object_id=OuterRef('object_id'), author_id=OuterRef('author_id'),
+            pk__gt=OuterRef('pk'),
+        )
+        first = max(bounds['first'] or 0, (expired or 0) + 1)
+        for start in range(first, (bounds['last'] or 0) + 1, batch_size):
+            superseded += Change.objects.filter(
+                Exists(newer), pk__gte=start, pk__lt=start + batch_size
+            ).delete()[0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {removed} expired and {superseded} superseded change log entries'
+        ))
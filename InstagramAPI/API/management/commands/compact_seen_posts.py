@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ...models import Post, SeenPost
+from ...sketches import add_viewers, approximate
+
+
+class Command(BaseCommand):
+    help = "Fold the SeenPost rows of old posts into their HyperLogLog sketches and delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Compact posts older than this many days")
+        parser.add_argument('--batch-size', type=int, default=100, help="Posts compacted per transaction")
+
+    def handle(self, *args, **options):
+        if not approximate():
+            raise CommandError(
+                "Compacted views are only counted with SEEN_COUNT_MODE = 'approximate'"
+            )
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        post_ids = list(
+            Post.objects.filter(created_at__lt=cutoff, seen_by__isnull=False)
+            .distinct()
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        batch_size = max(options['batch_size'], 1)
+        folded = 0
+        for start in range(0, len(post_ids), batch_size):
+            with transaction.atomic():
+                for post_id in post_ids[start:start + batch_size]:
+                    rows = list(SeenPost.objects.filter(post_id=post_id).values_list('pk', 'user_id'))
+                    if not rows:
+                        continue
+                    pks, user_ids = zip(*rows)
+                    # The sketch already holds every viewer recorded since it
+                    # was created, so only the rows themselves are added
+                    add_viewers(post_id, user_ids, seed=False)
+                    SeenPost.objects.filter(post_id=post_id, pk__lte=max(pks)).delete()
+                    folded += len(rows)
+        self.stdout.write(self.style.SUCCESS(f'Folded {folded} views of {len(post_ids)} posts into sketches'))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...export import DEFAULT_CHUNK_SIZE, export_ndjson, export_zip
+from ...models import Account
+
+
+class Command(BaseCommand):
+    help = "Write an account's data as NDJSON, or as a zip with its images, without loading it into memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', '-o', default='-', help="File to write, - for standard output")
+        parser.add_argument('--media', action='store_true', help="Write a zip including the account's images")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows fetched per query")
+
+    def handle(self, *args, **options):
+        account = Account.objects.filter(username=options['username']).first()
+        if account is None:
+            raise CommandError(f"No account named {options['username']!r}")
+        export = export_zip if options['media'] else export_ndjson
+        chunks = export(account, max(options['chunk_size'], 1))
+
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if options['output'] != '-':
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} bytes to {options["output"]}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from ...cache import feed_cache, post_fragments
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss statistics of the feed page and post fragment caches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Reset the counters after printing them")
+
+    def handle(self, *args, **options):
+        for label, cache in [('pages', feed_cache), ('fragments', post_fragments)]:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for name, value in cache.stats().items():
+                if isinstance(value, float):
+                    value = f'{value:.2%}'
+                self.stdout.write(f'  {name}: {value}')
+            if options['reset']:
+                cache.reset_stats()
+        if options['reset']:
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...deletion import Reaper, pending_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove soft-deleted accounts and posts with their dependent rows and media "
+        "in bounded batches, once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows deleted per transaction")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+        parser.add_argument('--interval', type=float, default=10.0, help="Seconds between checks for new jobs")
+        parser.add_argument('--once', action='store_true', help="Run the pending jobs and exit")
+
+    def handle(self, *args, **options):
+        reaper = Reaper(max(options['batch_size'], 1), options['pause'])
+        finished = failed = 0
+        while True:
+            for job in pending_jobs():
+                start = time.monotonic()
+                try:
+                    reaper.run(job)
+                except Exception as exc:
+                    # Left pending; the next run resumes it
+                    job.error = repr(exc)
+                    job.save(update_fields=['error', 'updated_at'])
+                    self.stderr.write(f'Deletion of {job.kind} {job.object_id} failed: {exc!r}')
+                    failed += 1
+                    continue
+                finished += 1
+                if options['verbosity'] > 1:
+                    job.refresh_from_db()
+                    self.stdout.write(
+                        f'Deleted {job.kind} {job.object_id}: {job.rows_deleted} rows, '
+                        f'{job.files_deleted} files in {time.monotonic() - start:.1f} s'
+                    )
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Finished {finished} deletion job(s), {failed} failed'))
@@ -0,0 +1,51 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Replication stand-in for local testing: copy the primary SQLite database "
+        "into every DATABASE_REPLICAS file, once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between copies")
+        parser.add_argument('--once', action='store_true', help="Copy once and exit")
+
+    def handle(self, *args, **options):
+        databases = settings.DATABASES
+        if databases[DEFAULT_DB_ALIAS]['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("The replication stand-in only supports SQLite")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set DATABASE_REPLICA_PATHS")
+
+        while True:
+            start = time.monotonic()
+            self.replicate(databases[DEFAULT_DB_ALIAS]['NAME'], [
+                databases[alias]['NAME'] for alias in settings.DATABASE_REPLICAS
+            ])
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Replicated in {(time.monotonic() - start) * 1000:.1f} ms')
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Replicated to {len(settings.DATABASE_REPLICAS)} replica(s)'))
+
+    def replicate(self, primary, replicas):
+        source = sqlite3.connect(primary)
+        try:
+            for path in replicas:
+                target = sqlite3.connect(path, timeout=20)
+                try:
+                    # The online backup API copies a consistent snapshot, and
+                    # readers of the replica keep seeing the previous one until
+                    # the copy commits
+                    source.backup(target)
+                finally:
+                    target.close()
+        finally:
+            source.close()
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+
+from .authentication import SignedTokenAuthentication
+from .routers import begin_request, end_request, pin_user, pin_window, replicas
+
+# Middleware of the App
+
+PIN_COOKIE = 'db_primary'
+
+
+class ReplicaPinMiddleware:
+    """
+    Routes the reads of each request (see routers.py) and pins the user to the
+    primary after a write, by user id for authenticated users and with a short
+    lived cookie for everyone else
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        user_id = SignedTokenAuthentication.user_id(request)
+        if user_id is None and settings.SESSION_COOKIE_NAME in request.COOKIES:
+            # Loading the session costs a query, so only for session requests
+            user_id = request.session.get(SESSION_KEY)
+        begin_request(
+            primary=request.method not in ('GET', 'HEAD', 'OPTIONS') or PIN_COOKIE in request.COOKIES,
+            user_id=user_id,
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = end_request()
+
+        if wrote:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_user(user.pk)
+            response.set_cookie(PIN_COOKIE, '1', max_age=pin_window(), httponly=True, samesite='Lax')
+        return response
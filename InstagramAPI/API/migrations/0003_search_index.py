@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# FTS5 indexes used by API.search.SQLiteFTSBackend; other databases use the
+# unindexed fallback backend, so nothing is created for them.
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE API_post_fts USING fts5("
+    "description, user_id UNINDEXED, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE VIRTUAL TABLE API_account_fts USING fts5("
+    "username, first_name, last_name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "INSERT INTO API_post_fts (rowid, description, user_id) SELECT id, description, user_id FROM API_post",
+    "INSERT INTO API_account_fts (rowid, username, first_name, last_name, description) "
+    "SELECT id, username, first_name, last_name, description FROM API_account",
+]
+
+DROP_SQL = [
+    "DROP TABLE IF EXISTS API_post_fts",
+    "DROP TABLE IF EXISTS API_account_fts",
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0002_post_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(CREATE_SQL), run_sql(DROP_SQL)),
+    ]
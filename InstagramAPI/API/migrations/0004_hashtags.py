@@ -0,0 +1,94 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from InstagramAPI.API.helpers import extract_hashtags, extract_mentions
+
+
+def index_existing_posts(apps, schema_editor):
+    from InstagramAPI.API.hashtags import bucket_start
+
+    Post = apps.get_model('API', 'Post')
+    Account = apps.get_model('API', 'Account')
+    Hashtag = apps.get_model('API', 'Hashtag')
+    PostHashtag = apps.get_model('API', 'PostHashtag')
+    Mention = apps.get_model('API', 'Mention')
+    HashtagTrend = apps.get_model('API', 'HashtagTrend')
+
+    hashtag_ids = {}
+    trends = {}
+    for post in Post.objects.only('id', 'description', 'created_at').iterator(chunk_size=1000):
+        links = []
+        for name in extract_hashtags(post.description):
+            if name not in hashtag_ids:
+                hashtag_ids[name] = Hashtag.objects.get_or_create(name=name)[0].id
+            links.append(PostHashtag(post_id=post.id, hashtag_id=hashtag_ids[name]))
+            key = (hashtag_ids[name], bucket_start(post.created_at))
+            trends[key] = trends.get(key, 0) + 1
+        PostHashtag.objects.bulk_create(links)
+        usernames = extract_mentions(post.description)
+        if usernames:
+            Mention.objects.bulk_create(
+                Mention(post_id=post.id, user_id=user_id)
+                for user_id in Account.objects.filter(username__in=usernames).values_list('id', flat=True)
+            )
+    HashtagTrend.objects.bulk_create(
+        HashtagTrend(hashtag_id=hashtag_id, bucket_start=bucket, count=count)
+        for (hashtag_id, bucket), count in trends.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Name')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HashtagTrend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(verbose_name='Bucket start')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trends', to='API.hashtag', verbose_name='Hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket_start'], name='hashtag_trend_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hashtag', 'bucket_start'), name='unique_hashtag_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Mention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='API.post', verbose_name='Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'user'), name='unique_post_mention')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_hashtags', to='API.hashtag', verbose_name='Hashtag')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_hashtags', to='API.post', verbose_name='Post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hashtag', '-post'], name='post_hashtag_feed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('post', 'hashtag'), name='unique_post_hashtag')],
+            },
+        ),
+        migrations.RunPython(index_existing_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0004_hashtags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostViewSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('registers', models.BinaryField(verbose_name='Registers')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='view_sketch', to='API.post', verbose_name='Post')),
+            ],
+        ),
+    ]
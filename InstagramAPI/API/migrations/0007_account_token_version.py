@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0006_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented to revoke every API token issued to the account', verbose_name='Token version'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0007_account_token_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, verbose_name='Unread notifications'),
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('like', 'Like'), ('comment', 'Comment'), ('follow', 'Follow')], max_length=16, verbose_name='Verb')),
+                ('bucket_start', models.DateTimeField(verbose_name='Bucket start')),
+                ('actor_count', models.PositiveIntegerField(default=0, verbose_name='Actor count')),
+                ('updated_at', models.DateTimeField(verbose_name='Updated at')),
+                ('read', models.BooleanField(default=False, verbose_name='Read')),
+                ('last_actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Last actor')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='API.post', verbose_name='Post')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL, verbose_name='Recipient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recipient', '-updated_at', '-id'], name='notification_inbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('recipient', 'verb', 'post', 'bucket_start'), name='unique_post_notification'), models.UniqueConstraint(condition=models.Q(('post__isnull', True)), fields=('recipient', 'verb', 'bucket_start'), name='unique_account_notification')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0008_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('story', 'Story'), ('counts', 'Post counts'), ('follow', 'Follow')], max_length=16, verbose_name='Kind')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='Object id')),
+                ('author_id', models.PositiveBigIntegerField(help_text='Account owning the object; not a foreign key so entries outlive deleted accounts', verbose_name='Author id')),
+                ('deleted', models.BooleanField(default=False, verbose_name='Deleted')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Created at')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['author_id', 'id'], name='change_log_author_idx'), models.Index(fields=['kind', 'object_id'], name='change_log_object_idx')],
+            },
+        ),
+    ]
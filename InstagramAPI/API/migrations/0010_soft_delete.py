@@ -0,0 +1,55 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:04
+
+import InstagramAPI.API.models
+import django.contrib.auth.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0009_change_log'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='account',
+            managers=[
+                ('objects', InstagramAPI.API.models.AccountManager()),
+                ('all_objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Deleted at'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Deleted at'),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Deleted at'),
+        ),
+        migrations.CreateModel(
+            name='DeletionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('account', 'Account'), ('post', 'Post')], max_length=16, verbose_name='Kind')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='Object id')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finished at')),
+                ('step', models.CharField(blank=True, help_text='Dependent rows being deleted', max_length=32, verbose_name='Step')),
+                ('rows_deleted', models.PositiveBigIntegerField(default=0, verbose_name='Rows deleted')),
+                ('files_deleted', models.PositiveIntegerField(default=0, verbose_name='Files deleted')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['finished_at', 'id'], name='deletion_job_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:19
+
+from django.db import migrations, models
+
+
+def record_last_actors(apps, schema_editor):
+    # Earlier actors were not recorded; the latest one at least is not
+    # counted again. The sketch is built from the recent ids on first use.
+    Notification = apps.get_model('API', 'Notification')
+    rows = Notification.objects.filter(last_actor__isnull=False).values_list('id', 'last_actor_id')
+    batch = []
+    for pk, actor_id in rows.iterator(chunk_size=1000):
+        batch.append(Notification(pk=pk, recent_actor_ids=[actor_id]))
+        if len(batch) == 1000:
+            Notification.objects.bulk_update(batch, ['recent_actor_ids'])
+            batch = []
+    Notification.objects.bulk_update(batch, ['recent_actor_ids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0010_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='actor_sketch',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Actor sketch'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='recent_actor_ids',
+            field=models.JSONField(blank=True, default=list, verbose_name='Recent actor ids'),
+        ),
+        migrations.RunPython(record_last_actors, migrations.RunPython.noop),
+    ]
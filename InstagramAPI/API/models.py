@@ -1,9 +1,29 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import FileExtensionValidator
 from django.utils.translation import gettext_lazy as _
 
 # Models of the App
+class LiveManager(models.Manager):
+    """
+    Default manager leaving out soft-deleted rows (see deletion.py); the
+    ``all_objects`` manager still includes them
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class AccountManager(UserManager):
+    """
+    User manager leaving out soft-deleted accounts, which can therefore
+    neither log in nor be found by their session or token
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Comment(models.Model):
     """
     Comment details model
@@ -11,6 +31,7 @@ class Comment(models.Model):
     created_at = models.DateTimeField(
         _("Created at"),
         auto_now_add=True,
+        db_index=True,
     )
     text = models.CharField(
         _("Text"),
@@ -55,6 +76,7 @@ class Story(models.Model):
     created_at = models.DateTimeField(
         _("Created at"),
         auto_now_add=True,
+        db_index=True,
     )
     image = models.ImageField(
         _("Image"),
@@ -67,6 +89,14 @@ class Story(models.Model):
         on_delete=models.CASCADE,
         related_name="stories",
     )
+    deleted_at = models.DateTimeField(
+        _("Deleted at"),
+        null=True,
+        blank=True,
+    )
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
 
 class SeenPost(models.Model):
@@ -94,6 +124,7 @@ class Post(models.Model):
     created_at = models.DateTimeField(
         _("Created at"),
         auto_now_add=True,
+        db_index=True,
     )
     image = models.ImageField(
         _("Image"),
@@ -110,6 +141,14 @@ class Post(models.Model):
     description = models.TextField(
         _("Description"),
     )
+    deleted_at = models.DateTimeField(
+        _("Deleted at"),
+        null=True,
+        blank=True,
+    )
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
 
 class FollowerConnection(models.Model):
@@ -144,4 +183,347 @@ class Account(AbstractUser):
         _("Description"),
         blank=True,
     )
+    unread_notifications = models.PositiveIntegerField(
+        _("Unread notifications"),
+        default=0,
+    )
+    token_version = models.PositiveIntegerField(
+        _("Token version"),
+        default=0,
+        help_text=_("Incremented to revoke every API token issued to the account"),
+    )
+    deleted_at = models.DateTimeField(
+        _("Deleted at"),
+        null=True,
+        blank=True,
+    )
+
+    objects = AccountManager()
+    all_objects = UserManager()
+
+
+class Hashtag(models.Model):
+    """
+    Normalized hashtag model
+    """
+    name = models.CharField(
+        _("Name"),
+        max_length=100,
+        unique=True,
+    )
+
+
+class PostHashtag(models.Model):
+    """
+    Hashtags used in a post model
+    """
+    post = models.ForeignKey(
+        "Post",
+        verbose_name=_("Post"),
+        on_delete=models.CASCADE,
+        related_name="post_hashtags",
+    )
+    hashtag = models.ForeignKey(
+        "Hashtag",
+        verbose_name=_("Hashtag"),
+        on_delete=models.CASCADE,
+        related_name="post_hashtags",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "hashtag"], name="unique_post_hashtag"),
+        ]
+        indexes = [
+            # Hashtag feeds page through a tag's posts newest first
+            models.Index(fields=["hashtag", "-post"], name="post_hashtag_feed_idx"),
+        ]
+
+
+class Mention(models.Model):
+    """
+    Accounts mentioned in a post model
+    """
+    post = models.ForeignKey(
+        "Post",
+        verbose_name=_("Post"),
+        on_delete=models.CASCADE,
+        related_name="mentions",
+    )
+    user = models.ForeignKey(
+        "Account",
+        verbose_name=_("User"),
+        on_delete=models.CASCADE,
+        related_name="mentions",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["post", "user"], name="unique_post_mention"),
+        ]
+
+
+class HashtagTrend(models.Model):
+    """
+    Number of posts using a hashtag per time bucket model
+    """
+    hashtag = models.ForeignKey(
+        "Hashtag",
+        verbose_name=_("Hashtag"),
+        on_delete=models.CASCADE,
+        related_name="trends",
+    )
+    bucket_start = models.DateTimeField(
+        _("Bucket start"),
+    )
+    count = models.IntegerField(
+        _("Count"),
+        default=0,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["hashtag", "bucket_start"], name="unique_hashtag_bucket"),
+        ]
+        indexes = [
+            models.Index(fields=["bucket_start"], name="hashtag_trend_bucket_idx"),
+        ]
+
+
+class PostViewSketch(models.Model):
+    """
+    HyperLogLog sketch of the users who have seen a post model
+    """
+    post = models.OneToOneField(
+        "Post",
+        verbose_name=_("Post"),
+        on_delete=models.CASCADE,
+        related_name="view_sketch",
+    )
+    registers = models.BinaryField(
+        _("Registers"),
+    )
+    updated_at = models.DateTimeField(
+        _("Updated at"),
+        auto_now=True,
+    )
+
+
+class Notification(models.Model):
+    """
+    Activity notification model, aggregating the events of one verb on one
+    post (or the follows) of a recipient within a time bucket
+    """
+    LIKE = "like"
+    COMMENT = "comment"
+    FOLLOW = "follow"
+    VERB_CHOICES = [
+        (LIKE, _("Like")),
+        (COMMENT, _("Comment")),
+        (FOLLOW, _("Follow")),
+    ]
+
+    recipient = models.ForeignKey(
+        "Account",
+        verbose_name=_("Recipient"),
+        on_delete=models.CASCADE,
+        related_name="notifications",
+    )
+    verb = models.CharField(
+        _("Verb"),
+        max_length=16,
+        choices=VERB_CHOICES,
+    )
+    post = models.ForeignKey(
+        "Post",
+        verbose_name=_("Post"),
+        on_delete=models.CASCADE,
+        related_name="notifications",
+        null=True,
+        blank=True,
+    )
+    bucket_start = models.DateTimeField(
+        _("Bucket start"),
+    )
+    last_actor = models.ForeignKey(
+        "Account",
+        verbose_name=_("Last actor"),
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    actor_count = models.PositiveIntegerField(
+        _("Actor count"),
+        default=0,
+    )
+    recent_actor_ids = models.JSONField(
+        _("Recent actor ids"),
+        default=list,
+        blank=True,
+    )
+    actor_sketch = models.BinaryField(
+        _("Actor sketch"),
+        null=True,
+        blank=True,
+    )
+    updated_at = models.DateTimeField(
+        _("Updated at"),
+    )
+    read = models.BooleanField(
+        _("Read"),
+        default=False,
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipient", "verb", "post", "bucket_start"],
+                name="unique_post_notification",
+            ),
+            models.UniqueConstraint(
+                fields=["recipient", "verb", "bucket_start"],
+                condition=models.Q(post__isnull=True),
+                name="unique_account_notification",
+            ),
+        ]
+        indexes = [
+            # Inboxes page through a recipient's notifications newest first
+            models.Index(fields=["recipient", "-updated_at", "-id"], name="notification_inbox_idx"),
+        ]
+
+    @property
+    def visible_last_actor(self):
+        """The last actor, unless its account was deleted and awaits the reaper"""
+        actor = self.last_actor
+        return actor if actor is not None and actor.deleted_at is None else None
+
+
+class Change(models.Model):
+    """
+    Append-only change log entry read by delta sync: a post or story that
+    was saved or deleted, the counts of a post, or a follow of the author
+    """
+    POST = "post"
+    STORY = "story"
+    COUNTS = "counts"
+    FOLLOW = "follow"
+    KIND_CHOICES = [
+        (POST, _("Post")),
+        (STORY, _("Story")),
+        (COUNTS, _("Post counts")),
+        (FOLLOW, _("Follow")),
+    ]
+
+    kind = models.CharField(
+        _("Kind"),
+        max_length=16,
+        choices=KIND_CHOICES,
+    )
+    object_id = models.PositiveBigIntegerField(
+        _("Object id"),
+    )
+    author_id = models.PositiveBigIntegerField(
+        _("Author id"),
+        help_text=_("Account owning the object; not a foreign key so entries outlive deleted accounts"),
+    )
+    deleted = models.BooleanField(
+        _("Deleted"),
+        default=False,
+    )
+    created_at = models.DateTimeField(
+        _("Created at"),
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Sync reads the entries of the followed accounts after a position
+            models.Index(fields=["author_id", "id"], name="change_log_author_idx"),
+            # Compaction looks for newer entries of the same object
+            models.Index(fields=["kind", "object_id"], name="change_log_object_idx"),
+        ]
+
+
+class DeletionJob(models.Model):
+    """
+    Background removal of a soft-deleted account or post and everything
+    depending on it, with its progress
+    """
+    ACCOUNT = "account"
+    POST = "post"
+    KIND_CHOICES = [
+        (ACCOUNT, _("Account")),
+        (POST, _("Post")),
+    ]
+
+    kind = models.CharField(
+        _("Kind"),
+        max_length=16,
+        choices=KIND_CHOICES,
+    )
+    object_id = models.PositiveBigIntegerField(
+        _("Object id"),
+    )
+    created_at = models.DateTimeField(
+        _("Created at"),
+        auto_now_add=True,
+    )
+    updated_at = models.DateTimeField(
+        _("Updated at"),
+        auto_now=True,
+    )
+    finished_at = models.DateTimeField(
+        _("Finished at"),
+        null=True,
+        blank=True,
+    )
+    step = models.CharField(
+        _("Step"),
+        max_length=32,
+        blank=True,
+        help_text=_("Dependent rows being deleted"),
+    )
+    rows_deleted = models.PositiveBigIntegerField(
+        _("Rows deleted"),
+        default=0,
+    )
+    files_deleted = models.PositiveIntegerField(
+        _("Files deleted"),
+        default=0,
+    )
+    error = models.TextField(
+        _("Error"),
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["finished_at", "id"], name="deletion_job_queue_idx"),
+        ]
+
+
+class RevokedToken(models.Model):
+    """
+    API token revoked on its own by logging out, kept until it would have
+    expired anyway
+    """
+    user = models.ForeignKey(
+        "Account",
+        verbose_name=_("User"),
+        on_delete=models.CASCADE,
+        related_name="revoked_tokens",
+    )
+    token_id = models.CharField(
+        _("Token id"),
+        max_length=32,
+    )
+    expires_at = models.DateTimeField(
+        _("Expires at"),
+    )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "token_id"], name="unique_revoked_token"),
+        ]
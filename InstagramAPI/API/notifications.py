@@ -0,0 +1,125 @@
+"""
+Activity notifications.
+
+Likes, comments and follows are folded into one Notification row per
+(recipient, verb, post, time bucket) - "alice and 240 others liked your
+post" - so a popular post updates a bounded number of rows instead of
+adding a row per event. A row keeps a bounded record of its actors: the
+ids of the last NOTIFICATION_RECENT_ACTORS of them and a small HyperLogLog
+sketch of all of them (see sketches.py), so an actor liking, unliking and
+liking again is counted once. ``actor_count`` is the sketch's estimate of
+the distinct actors, or the number of actors that changed the sketch when
+that is larger, so small counts stay exact in practice. An actor older than
+the recent ones coming back is shown as the last actor again, but only
+counted if it changes the sketch.
+
+``Account.unread_notifications`` counts the unread rows and is only touched
+when a row is created, becomes unread again, is read or is deleted: rows
+deleted with their post are taken off by a signal (see signals.py),
+querysets of them by the code deleting them with
+``forget_unread(unread_counts(queryset))``. Retracted likes and follows are
+not taken back out.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .helpers import time_bucket
+from .models import Notification
+from .sketches import HyperLogLog
+
+
+def bucket_size():
+    return getattr(settings, 'NOTIFICATION_BUCKET_SECONDS', 24 * 3600)
+
+
+def recent_actors():
+    return getattr(settings, 'NOTIFICATION_RECENT_ACTORS', 10)
+
+
+def actor_sketch(actor_ids=()):
+    """Return a new sketch of actor ids, smaller than the view sketches"""
+    sketch = HyperLogLog(precision=getattr(settings, 'NOTIFICATION_HLL_PRECISION', 8))
+    sketch.update(actor_ids)
+    return sketch
+
+
+def _add_unread(recipient_id, delta):
+    get_user_model().objects.filter(pk=recipient_id).update(
+        unread_notifications=Greatest(F('unread_notifications') + delta, 0)
+    )
+
+
+def notify(recipient_id, verb, actor_id, post_id=None):
+    """Record that ``actor_id`` did ``verb`` to the recipient or their post"""
+    if recipient_id == actor_id:
+        return
+    now = timezone.now()
+    key = {
+        'recipient_id': recipient_id,
+        'verb': verb,
+        'post_id': post_id,
+        'bucket_start': time_bucket(now, bucket_size()),
+    }
+    with transaction.atomic():
+        notification, created = Notification.objects.get_or_create(**key, defaults={
+            'actor_count': 1,
+            'recent_actor_ids': [actor_id],
+            'actor_sketch': actor_sketch([actor_id]).to_bytes(),
+            'last_actor_id': actor_id,
+            'updated_at': now,
+        })
+        if created:
+            _add_unread(recipient_id, 1)
+            return
+        notification = Notification.objects.select_for_update().get(pk=notification.pk)
+        if actor_id in notification.recent_actor_ids:
+            # Counted already, e.g. a like taken back and given again
+            return
+        if notification.actor_sketch is None:
+            sketch = actor_sketch(notification.recent_actor_ids)
+        else:
+            sketch = HyperLogLog.from_bytes(notification.actor_sketch)
+        counted = notification.actor_count + sketch.add(actor_id)
+        recent = [actor_id, *notification.recent_actor_ids][:recent_actors()]
+        values = {
+            'actor_count': max(sketch.count(), counted),
+            'recent_actor_ids': recent,
+            'actor_sketch': sketch.to_bytes(),
+            'last_actor_id': actor_id,
+            'updated_at': now,
+        }
+        notifications = Notification.objects.filter(pk=notification.pk)
+        if notifications.filter(read=True).update(read=False, **values):
+            _add_unread(recipient_id, 1)
+        else:
+            notifications.update(**values)
+
+
+def mark_read(recipient, notification_ids=None):
+    """Mark the given notifications of a recipient, or all of them, as read"""
+    with transaction.atomic():
+        notifications = Notification.objects.filter(recipient=recipient, read=False)
+        if notification_ids is not None:
+            notifications = notifications.filter(pk__in=notification_ids)
+        marked = notifications.update(read=True)
+        if marked:
+            _add_unread(recipient.pk, -marked)
+    return marked
+
+
+def unread_counts(notifications):
+    """Return the number of unread notifications of a queryset per recipient"""
+    return dict(notifications.filter(read=False).order_by().values_list('recipient_id').annotate(Count('pk')))
+
+
+def forget_unread(counts):
+    """
+    Take deleted notifications off the unread counters, given as
+    {recipient id: number of unread notifications deleted}
+    """
+    for recipient_id, count in counts.items():
+        _add_unread(recipient_id, -count)
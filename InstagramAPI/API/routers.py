@@ -0,0 +1,128 @@
+"""
+Read/write splitting across the primary database and its read replicas.
+
+Writes always go to ``default``. Reads go to a random alias of
+DATABASE_REPLICAS, except:
+
+- outside of a request (management commands, background jobs) and inside
+  transactions, where a stale read could be written back;
+- during unsafe requests (POST, PUT, PATCH, DELETE) and once the request has
+  written anything;
+- for sessions, so a fresh login is never lost to replication lag;
+- for READ_YOUR_WRITES_SECONDS after a user's last write, so users see their
+  own new posts and likes (see ReplicaPinMiddleware);
+- inside ``primary_reads()``, and inside ``reads_as_of(*stamps)`` when one of
+  the stamps is more recent than READ_YOUR_WRITES_SECONDS: results stored in
+  the shared caches under the current stamps and generations are built from
+  a replica only once the changes behind them have had time to reach it.
+"""
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Apps whose reads always go to the primary
+PRIMARY_APPS = {'sessions'}
+
+_state = Local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_window():
+    return getattr(settings, 'READ_YOUR_WRITES_SECONDS', 5)
+
+
+def _pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+def pin_user(user_id):
+    """Send the user's reads to the primary for the next READ_YOUR_WRITES_SECONDS"""
+    cache.set(_pin_key(user_id), 1, timeout=pin_window())
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(_pin_key(user_id)) is not None
+
+
+def begin_request(primary=False, user_id=None):
+    """Start routing the reads of a request, on the primary if ``primary`` is set"""
+    _state.active = True
+    _state.primary = primary or is_pinned(user_id)
+    _state.wrote = False
+
+
+def end_request():
+    """Stop routing the current request and return whether it wrote"""
+    wrote = getattr(_state, 'wrote', False)
+    _state.active = _state.primary = _state.wrote = False
+    return wrote
+
+
+@contextmanager
+def primary_reads():
+    """Send the reads made inside to the primary"""
+    primary = getattr(_state, 'primary', False)
+    _state.primary = True
+    try:
+        yield
+    finally:
+        _state.primary = primary or getattr(_state, 'wrote', False)
+
+
+@contextmanager
+def reads_as_of(*stamps):
+    """
+    Send the reads made inside to the primary when one of the time_ns() stamps
+    is more recent than READ_YOUR_WRITES_SECONDS, the replication lag the
+    replicas are expected to stay within
+    """
+    settled = time.time_ns() - pin_window() * 1_000_000_000
+    if all(stamp <= settled for stamp in stamps):
+        yield
+    else:
+        with primary_reads():
+            yield
+
+
+def mark_write():
+    """Record that the current request wrote and send its remaining reads to the primary"""
+    if getattr(_state, 'active', False):
+        _state.wrote = _state.primary = True
+
+
+class ReplicaRouter:
+    """
+    Database router sending reads to DATABASE_REPLICAS and writes to default
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if (
+            not aliases
+            or not getattr(_state, 'active', False)
+            or _state.primary
+            or model._meta.app_label in PRIMARY_APPS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        mark_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        return db not in replicas()
@@ -0,0 +1,188 @@
+"""
+Full-text search over post descriptions and accounts.
+
+The default backend keeps SQLite FTS5 inverted indexes (created by migration
+0003) in sync from model signals and ranks matches with bm25. Other databases
+fall back to a plain ``icontains`` backend; a different implementation can be
+plugged in with the SEARCH_BACKEND setting.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .helpers import decode_cursor, encode_cursor
+from .models import Account, Post
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+POST_INDEX = 'API_post_fts'
+ACCOUNT_INDEX = 'API_account_fts'
+ACCOUNT_FIELDS = ['username', 'first_name', 'last_name', 'description']
+
+
+class BaseSearchBackend:
+    """
+    Interface of the search backends.
+
+    Searches return ``(hits, next_cursor)`` where hits are (post id, author id)
+    pairs for posts and account ids for accounts, best match first.
+    """
+
+    def index_post(self, post):
+        raise NotImplementedError
+
+    def remove_post(self, post_id):
+        raise NotImplementedError
+
+    def index_account(self, account):
+        raise NotImplementedError
+
+    def remove_account(self, account_id):
+        raise NotImplementedError
+
+    def search_posts(self, query, cursor=None, limit=20):
+        raise NotImplementedError
+
+    def search_accounts(self, query, cursor=None, limit=20):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Reindex every post and account"""
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    FTS5 indexes keyed by rowid = object id, with prefix indexes for 2 and 3
+    character prefixes. Every query term is matched as a prefix and results
+    are paginated by (bm25 rank, id).
+    """
+
+    @staticmethod
+    def match_expression(query):
+        terms = TOKEN_RE.findall(query)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def _execute(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def index_post(self, post):
+        self.remove_post(post.pk)
+        self._execute(
+            f'INSERT INTO {POST_INDEX} (rowid, description, user_id) VALUES (%s, %s, %s)',
+            [post.pk, post.description, post.user_id],
+        )
+
+    def remove_post(self, post_id):
+        self._execute(f'DELETE FROM {POST_INDEX} WHERE rowid = %s', [post_id])
+
+    def index_account(self, account):
+        self.remove_account(account.pk)
+        columns = ', '.join(ACCOUNT_FIELDS)
+        placeholders = ', '.join(['%s'] * len(ACCOUNT_FIELDS))
+        self._execute(
+            f'INSERT INTO {ACCOUNT_INDEX} (rowid, {columns}) VALUES (%s, {placeholders})',
+            [account.pk, *(getattr(account, field) for field in ACCOUNT_FIELDS)],
+        )
+
+    def remove_account(self, account_id):
+        self._execute(f'DELETE FROM {ACCOUNT_INDEX} WHERE rowid = %s', [account_id])
+
+    def _search(self, table, columns, query, cursor, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return [], None
+        sql = f'SELECT rowid, rank{columns} FROM {table} WHERE {table} MATCH %s'
+        params = [expression]
+        position = decode_cursor(cursor)
+        if isinstance(position, list) and len(position) == 2:
+            sql += ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+            params += [position[0], position[0], position[1]]
+        sql += ' ORDER BY rank, rowid LIMIT %s'
+        rows = self._execute(sql, params + [limit + 1])
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][1], rows[-1][0]])
+        return rows, next_cursor
+
+    def search_posts(self, query, cursor=None, limit=20):
+        rows, next_cursor = self._search(POST_INDEX, ', user_id', query, cursor, limit)
+        return [(row[0], row[2]) for row in rows], next_cursor
+
+    def search_accounts(self, query, cursor=None, limit=20):
+        rows, next_cursor = self._search(ACCOUNT_INDEX, '', query, cursor, limit)
+        return [row[0] for row in rows], next_cursor
+
+    def rebuild(self):
+        self._execute(f'DELETE FROM {POST_INDEX}')
+        self._execute(
+            f'INSERT INTO {POST_INDEX} (rowid, description, user_id) '
+            f'SELECT id, description, user_id FROM {Post._meta.db_table} WHERE deleted_at IS NULL'
+        )
+        columns = ', '.join(ACCOUNT_FIELDS)
+        self._execute(f'DELETE FROM {ACCOUNT_INDEX}')
+        self._execute(
+            f'INSERT INTO {ACCOUNT_INDEX} (rowid, {columns}) '
+            f'SELECT id, {columns} FROM {Account._meta.db_table} WHERE deleted_at IS NULL'
+        )
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Unindexed fallback: substring matching on every term, newest first
+    """
+
+    def index_post(self, post):
+        pass
+
+    def remove_post(self, post_id):
+        pass
+
+    def index_account(self, account):
+        pass
+
+    def remove_account(self, account_id):
+        pass
+
+    def _search(self, queryset, lookups, query, cursor, limit):
+        terms = TOKEN_RE.findall(query)
+        if not terms:
+            return [], None
+        for term in terms:
+            condition = Q()
+            for lookup in lookups:
+                condition |= Q(**{f'{lookup}__icontains': term})
+            queryset = queryset.filter(condition)
+        position = decode_cursor(cursor)
+        if isinstance(position, int):
+            queryset = queryset.filter(pk__lt=position)
+        objects = list(queryset.order_by('-pk')[:limit + 1])
+        next_cursor = None
+        if len(objects) > limit:
+            objects = objects[:limit]
+            next_cursor = encode_cursor(objects[-1].pk)
+        return objects, next_cursor
+
+    def search_posts(self, query, cursor=None, limit=20):
+        posts, next_cursor = self._search(Post.objects.only('id', 'user'), ['description'], query, cursor, limit)
+        return [(post.pk, post.user_id) for post in posts], next_cursor
+
+    def search_accounts(self, query, cursor=None, limit=20):
+        accounts, next_cursor = self._search(Account.objects.only('id'), ACCOUNT_FIELDS, query, cursor, limit)
+        return [account.pk for account in accounts], next_cursor
+
+
+def get_search_backend():
+    """Return the configured search backend, FTS5 on SQLite by default"""
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    return DatabaseSearchBackend()
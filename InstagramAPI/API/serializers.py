@@ -1,14 +1,57 @@
-from rest_framework import serializers
-from django.contrib.auth import authenticate, get_user_model
+import hashlib
+
+from rest_framework import permissions, serializers
+from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from .models import *
+from .cache import post_fragments
+from .fastpath import compile_serializer
+from .hashing import check_credentials, hash_password
+from .helpers import query_param_list
+from .routers import reads_as_of
+from .sketches import approximate, seen_count, seen_counts
 
 # Serializers of the App
 Account = get_user_model()
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """
+    Serializer mixin for sparse fieldsets on read requests.
+
+    ``?fields=a,b`` limits the returned fields and ``?expand=user`` lists the
+    nested serializers to embed, the others being rendered as their primary
+    key. Dropped fields are removed before serialization, so their method
+    fields and nested lookups are never run. Only the top-level serializer of
+    a response follows the query parameters.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS or not self._is_top_level():
+            return fields
+
+        requested = query_param_list(request, 'fields')
+        if requested is not None:
+            for name in list(fields):
+                if name not in requested:
+                    fields.pop(name)
+
+        expand = query_param_list(request, 'expand')
+        if expand is not None:
+            for name, field in list(fields.items()):
+                if isinstance(field, serializers.BaseSerializer) and name not in expand:
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True, source=field.source)
+        return fields
+
+    def _is_top_level(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+
+class AccountSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for the user account model"""
     
     class Meta:
@@ -17,7 +60,14 @@ class AccountSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class FollowerConnectionSerializer(serializers.ModelSerializer):
+class PublicAccountSerializer(AccountSerializer):
+    """Serializer for accounts as shown to other users, without the email"""
+
+    class Meta(AccountSerializer.Meta):
+        fields = ['id', 'username', 'first_name', 'last_name', 'profile_picture', 'description']
+
+
+class FollowerConnectionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for follower connections"""
     
     class Meta:
@@ -26,7 +76,7 @@ class FollowerConnectionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class UserBriefSerializer(serializers.ModelSerializer):
+class UserBriefSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Minimal serializer for user information in nested contexts"""
     
     class Meta:
@@ -34,7 +84,108 @@ class UserBriefSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'profile_picture']
 
 
-class PostSerializer(serializers.ModelSerializer):
+class CompiledListSerializer(serializers.ListSerializer):
+    """
+    List serializer that uses the values()-based fast path when it is enabled
+    (see fastpath.py) and serializes field by field otherwise
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        compiled = compile_serializer(self.child)
+        if compiled is None:
+            return super().to_representation(iterable)
+        if isinstance(iterable, models.QuerySet):
+            return compiled.serialize(iterable)
+        return compiled.serialize_pks([obj.pk for obj in iterable])
+
+
+class PostListSerializer(serializers.ListSerializer):
+    """
+    List serializer for posts that reuses cached viewer-independent fragments
+    and resolves is_liked for the whole list with a single query
+    """
+    viewer_fields = ['is_liked']
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        if isinstance(iterable, models.QuerySet) and iterable._result_cache is None:
+            return self.render(list(iterable.values_list('pk', 'user_id')))
+        posts = {post.pk: post for post in iterable}
+        return self.render([(post.pk, post.user_id) for post in posts.values()], posts)
+
+    def render(self, refs, instances=None):
+        """
+        Render posts given as (post id, author id) pairs, loading only the
+        posts missing from the fragment cache
+        """
+        post_ids = [post_id for post_id, _ in refs]
+        field_names = [field.field_name for field in self.child._readable_fields]
+        liked = None
+        if 'is_liked' in field_names:
+            self.context['liked_post_ids'] = liked = self.child.liked_post_ids(post_ids)
+
+        name = self.fragment_name()
+        fragments = {}
+        if post_fragments.enabled:
+            stamps = post_fragments.stamps(refs)
+            versions = post_fragments.versions(refs, stamps)
+            fragments = post_fragments.get_many(name, versions)
+        missing = [post_id for post_id in post_ids if post_id not in fragments]
+        if missing:
+            if post_fragments.enabled:
+                # Stored under the current stamps, so rendered from the primary
+                # while a replica may lag behind them
+                with reads_as_of(*(stamp for post_id in missing for stamp in stamps[post_id])):
+                    rendered = self.load(missing, instances)
+                post_fragments.set_many(name, versions, rendered)
+            else:
+                rendered = self.load(missing, instances)
+            fragments.update(rendered)
+
+        results = []
+        for post_id in post_ids:
+            fragment = fragments.get(post_id)
+            if fragment is None:
+                # Deleted since its id was cached
+                continue
+            if liked is not None:
+                fragment = {
+                    field: post_id in liked if field == 'is_liked' else fragment[field]
+                    for field in field_names
+                }
+            results.append(fragment)
+        return results
+
+    def fragment_name(self):
+        """Identify the child serializer and its field layout in fragment keys"""
+        layout = ','.join(f'{field.field_name}:{type(field).__name__}' for field in self.child._readable_fields)
+        return f'{type(self.child).__name__}:{hashlib.md5(layout.encode()).hexdigest()[:12]}'
+
+    def load(self, post_ids, instances=None):
+        """Render the viewer-independent part of the given posts keyed by id"""
+        compiled = compile_serializer(self.child, exclude=self.viewer_fields)
+        if compiled is not None:
+            return compiled.serialize_map(post_ids)
+
+        if instances is None:
+            queryset = self.child.Meta.model.objects.all()
+            if isinstance(self.child.fields.get('user'), serializers.BaseSerializer):
+                queryset = queryset.select_related('user')
+            instances = queryset.in_bulk(post_ids)
+        if approximate() and 'seen_count' in self.child.fields:
+            self.context['seen_counts'] = seen_counts(post_ids)
+        rendered = {}
+        for post_id in post_ids:
+            if post_id in instances:
+                data = self.child.to_representation(instances[post_id])
+                rendered[post_id] = {
+                    field: value for field, value in data.items() if field not in self.viewer_fields
+                }
+        return rendered
+
+
+class PostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for posts"""
     likes_count = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
@@ -56,34 +207,47 @@ class PostSerializer(serializers.ModelSerializer):
             'is_liked'
         ]
         read_only_fields = ['id', 'created_at', 'user', 'likes_count', 'comments_count', 'seen_count', 'is_liked']
+        list_serializer_class = PostListSerializer
     
+    # The counts may be annotated on the posts (see PostViewSet.get_queryset)
     def get_likes_count(self, obj):
+        if hasattr(obj, 'likes_count'):
+            return obj.likes_count
         return obj.likes.count()
     
     def get_comments_count(self, obj):
+        if hasattr(obj, 'comments_count'):
+            return obj.comments_count
         return obj.comments.count()
     
     def get_seen_count(self, obj):
+        if approximate():
+            seen_counts = self.context.get('seen_counts')
+            if seen_counts is not None and obj.pk in seen_counts:
+                return seen_counts[obj.pk]
+            return seen_count(obj.pk)
+        if hasattr(obj, 'seen_count'):
+            return obj.seen_count
         return obj.seen_by.count()
     
     def get_is_liked(self, obj):
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is not None:
+            return obj.pk in liked_post_ids
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
         return False
 
-
-class PostDetailSerializer(PostSerializer):
-    """Detailed serializer for posts with comments and likes"""
-    comments = serializers.SerializerMethodField()
-    
-    class Meta(PostSerializer.Meta):
-        fields = PostSerializer.Meta.fields + ['comments']
-    
-    def get_comments(self, obj):
-        from .serializers import CommentSerializer  # Import here to avoid circular import
-        comments = obj.comments.all().order_by('-created_at')
-        return CommentSerializer(comments, many=True, context=self.context).data
+    def liked_post_ids(self, post_ids):
+        """Return which of the given posts the requesting user has liked"""
+        request = self.context.get('request')
+        if not (request and request.user.is_authenticated):
+            return set()
+        return set(
+            Likes.objects.filter(user=request.user, post_id__in=post_ids)
+            .values_list('post_id', flat=True)
+        )
 
 
 class PostDetailSerializer(PostSerializer):
@@ -95,10 +259,13 @@ class PostDetailSerializer(PostSerializer):
     
     def get_comments(self, obj):
         comments = obj.comments.all().order_by('-created_at')
-        return CommentSerializer(comments, many=True).data
+        serializer = CommentSerializer(comments, many=True, context=self.context)
+        # Nested under the post, so ?fields= and ?expand= are left to the post
+        serializer.bind('comments', self)
+        return serializer.data
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for comments"""
     user = serializers.StringRelatedField()
     
@@ -106,13 +273,14 @@ class CommentSerializer(serializers.ModelSerializer):
         model = Comment
         fields = ['id', 'created_at', 'text', 'user', 'post']
         read_only_fields = ['id', 'created_at', 'user']
+        list_serializer_class = CompiledListSerializer
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
 
-class LikesSerializer(serializers.ModelSerializer):
+class LikesSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for likes"""
     
     class Meta:
@@ -125,21 +293,22 @@ class LikesSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class StorySerializer(serializers.ModelSerializer):
+class StorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for stories"""
-    user = AccountSerializer(read_only=True)
+    user = PublicAccountSerializer(read_only=True)
     
     class Meta:
         model = Story
         fields = ['id', 'created_at', 'image', 'user']
         read_only_fields = ['id', 'created_at', 'user']
+        list_serializer_class = CompiledListSerializer
     
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
 
-class SeenPostSerializer(serializers.ModelSerializer):
+class SeenPostSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for seen posts"""
     
     class Meta:
@@ -164,11 +333,46 @@ class AccountDetailSerializer(AccountSerializer):
     def get_posts_count(self, obj):
         return Post.objects.filter(user=obj).count()
     
+    # The follows of deleted accounts wait for the reaper (see deletion.py)
     def get_followers_count(self, obj):
-        return obj.followers.count()
+        return obj.followers.filter(follower__deleted_at__isnull=True).count()
     
     def get_following_count(self, obj):
-        return obj.following.count()
+        return obj.following.filter(following__deleted_at__isnull=True).count()
+
+
+class HashtagSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Serializer for hashtags"""
+
+    class Meta:
+        model = Hashtag
+        fields = ['id', 'name']
+        read_only_fields = ['id', 'name']
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    """Serializer for activity notifications"""
+    last_actor = UserBriefSerializer(read_only=True, source='visible_last_actor')
+    message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'verb', 'post', 'last_actor', 'actor_count', 'message', 'updated_at', 'read']
+        read_only_fields = fields
+
+    MESSAGES = {
+        Notification.LIKE: _("liked your post"),
+        Notification.COMMENT: _("commented on your post"),
+        Notification.FOLLOW: _("started following you"),
+    }
+
+    def get_message(self, obj):
+        actor = obj.visible_last_actor.username if obj.visible_last_actor else _("Someone")
+        others = obj.actor_count - 1
+        if others > 0:
+            actor = _("%(actor)s and %(count)d others") % {'actor': actor, 'count': others}
+        return f'{actor} {self.MESSAGES[obj.verb]}'
+
 
 class UserRegisterSerializer(serializers.ModelSerializer):
     """Serializer for user registration"""
@@ -193,8 +397,11 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         return value
     
     def validate_username(self, value):
-        """Validate username is unique"""
-        if Account.objects.filter(username=value).exists():
+        """
+        Validate username is unique, among deleted accounts too: their rows
+        keep the username until they are reaped
+        """
+        if Account.all_objects.filter(username=value).exists():
             raise ValidationError(_("A user with this username already exists."))
         return value
     
@@ -203,14 +410,15 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         # Remove password_confirm as it's not needed for creating the user
         validated_data.pop('password_confirm')
         
-        # Create the user with create_user to properly handle password hashing
-        user = Account.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password'],
+        # Same as create_user, with the password hashed on the hashing pool
+        user = Account(
+            username=Account.normalize_username(validated_data['username']),
+            email=Account.objects.normalize_email(validated_data['email']),
+            password=hash_password(validated_data['password']),
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', '')
         )
+        user.save()
         
         return user
 
@@ -235,7 +443,7 @@ class UserLoginSerializer(serializers.Serializer):
         username = validated_data.get('username')
         password = validated_data.get('password')
         
-        user = authenticate(username=username, password=password)
+        user = check_credentials(username, password)
         
         if not user:
             raise ValidationError(_("Invalid credentials. Please try again."))
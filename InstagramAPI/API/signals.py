@@ -0,0 +1,194 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import hashtags, notifications
+from .authentication import principals, revoke_tokens
+from .cache import feed_cache, post_fragments
+from .changes import log_change
+from .deletion import reaping
+from .live import post_changed
+from .models import Account, Change, Comment, FollowerConnection, Likes, Notification, Post, Story
+from .search import ACCOUNT_FIELDS, get_search_backend
+
+# Signal handlers of the App
+
+# Account fields rendered inside post fragments, comments and stories
+FRAGMENT_ACCOUNT_FIELDS = {'username', 'first_name', 'last_name', 'profile_picture', 'description'}
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    """A post changes its author's profile and every follower's feed"""
+    post_fragments.bump_posts([instance.pk])
+    feed_cache.invalidate_authors([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Likes)
+def invalidate_liked_post(sender, instance, **kwargs):
+    """A like changes the post's counts and the liker's liked posts"""
+    post_fragments.bump_posts([instance.post_id])
+    feed_cache.invalidate_users([instance.user_id])
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_commented_post(sender, instance, **kwargs):
+    """A comment changes the post's counts"""
+    post_fragments.bump_posts([instance.post_id])
+
+
+@receiver([post_save, post_delete], sender=FollowerConnection)
+def invalidate_follower_feed(sender, instance, **kwargs):
+    """Following or unfollowing changes the follower's feed"""
+    feed_cache.invalidate_users([instance.follower_id])
+
+
+@receiver(post_save, sender=Account)
+def invalidate_author_fragments(sender, instance, update_fields=None, **kwargs):
+    """Renaming an account or changing its picture changes all of its posts, comments and stories"""
+    if update_fields is None or FRAGMENT_ACCOUNT_FIELDS.intersection(update_fields):
+        post_fragments.bump_accounts([instance.pk])
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    """Keep the search index in sync with post descriptions"""
+    get_search_backend().index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    """Remove deleted posts from the search index"""
+    get_search_backend().remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Account)
+def index_account(sender, instance, update_fields=None, **kwargs):
+    """Keep the search index in sync with the searchable account fields"""
+    if update_fields is None or set(ACCOUNT_FIELDS).intersection(update_fields):
+        get_search_backend().index_account(instance)
+
+
+@receiver(post_delete, sender=Account)
+def unindex_account(sender, instance, **kwargs):
+    """Remove deleted accounts from the search index"""
+    get_search_backend().remove_account(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def sync_post_hashtags(sender, instance, **kwargs):
+    """Parse hashtags and mentions out of the post description"""
+    hashtags.sync_post(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def forget_post_hashtags(sender, instance, **kwargs):
+    """Take deleted posts out of the hashtag trends, unless they left them when hidden"""
+    if instance.deleted_at is None:
+        hashtags.forget_post(instance)
+
+
+@receiver([post_save, post_delete], sender=Account)
+def forget_principal(sender, instance, **kwargs):
+    """Drop the cached copy of a changed account used by token authentication"""
+    principals.forget(instance.pk)
+
+
+@receiver(post_save, sender=Account)
+def revoke_tokens_on_password_change(sender, instance, created, **kwargs):
+    """
+    A new password logs the account out of every device, so a stolen token
+    does not outlive a password reset. ``_password`` holds the new raw
+    password until AbstractBaseUser.save() returns, and is cleared before
+    the save of a mere hash upgrade on login.
+    """
+    if not created and instance._password is not None:
+        revoke_tokens(instance)
+        instance.refresh_from_db(fields=['token_version'])
+
+
+@receiver(post_save, sender=Likes)
+def notify_like(sender, instance, created, **kwargs):
+    """Tell the author their post was liked"""
+    if created:
+        notifications.notify(instance.post.user_id, Notification.LIKE, instance.user_id, instance.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def notify_comment(sender, instance, created, **kwargs):
+    """Tell the author their post was commented on"""
+    if created:
+        notifications.notify(instance.post.user_id, Notification.COMMENT, instance.user_id, instance.post_id)
+
+
+@receiver(post_save, sender=FollowerConnection)
+def notify_follow(sender, instance, created, **kwargs):
+    """Tell an account it has a new follower"""
+    if created:
+        notifications.notify(instance.following_id, Notification.FOLLOW, instance.follower_id)
+
+
+@receiver(post_delete, sender=Notification)
+def forget_unread_notification(sender, instance, origin=None, **kwargs):
+    """
+    Take an unread notification deleted with its post off the recipient's
+    counter. Querysets of notifications are taken off in bulk by whoever
+    deletes them, and a deleted recipient has no counter left.
+    """
+    if instance.read or getattr(origin, 'model', None) is Notification or _deleted_with(origin, Account):
+        return
+    notifications.forget_unread({instance.recipient_id: 1})
+
+
+@receiver([post_save, post_delete], sender=Likes)
+@receiver([post_save, post_delete], sender=Comment)
+def publish_post_counts(sender, instance, **kwargs):
+    """Push the new counts to the live count streams"""
+    post_changed(instance.post_id)
+
+
+def _deleted_with(origin, model):
+    """Whether a deletion cascades from deleting instances of ``model``"""
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Story)
+def log_saved_content(sender, instance, **kwargs):
+    """Record new and edited posts and stories for delta sync"""
+    kind = Change.POST if sender is Post else Change.STORY
+    log_change(kind, instance.pk, instance.user_id)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Story)
+def log_deleted_content(sender, instance, **kwargs):
+    """Record deleted posts and stories for delta sync"""
+    if reaping.get():
+        # Logged when they were hidden
+        return
+    kind = Change.POST if sender is Post else Change.STORY
+    log_change(kind, instance.pk, instance.user_id, deleted=True)
+
+
+@receiver([post_save, post_delete], sender=Likes)
+@receiver([post_save, post_delete], sender=Comment)
+def log_post_counts(sender, instance, origin=None, **kwargs):
+    """Record like and comment count changes for delta sync"""
+    if _deleted_with(origin, Post) or reaping.get():
+        # The post's own deletion is logged, the reaper only removes hidden rows
+        return
+    if sender.post.is_cached(instance):
+        author_id = instance.post.user_id
+    else:
+        author_id = Post.objects.filter(pk=instance.post_id).values_list('user_id', flat=True).first()
+    if author_id is not None:
+        log_change(Change.COUNTS, instance.post_id, author_id)
+
+
+@receiver([post_save, post_delete], sender=FollowerConnection)
+def log_follow(sender, instance, **kwargs):
+    """A follow or unfollow resets the follower's delta sync"""
+    if reaping.get():
+        # The follows of a deleted account: its posts are logged as deleted
+        return
+    log_change(Change.FOLLOW, instance.following_id, instance.follower_id)
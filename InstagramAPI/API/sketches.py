@@ -0,0 +1,150 @@
+"""
+Approximate unique viewer counts.
+
+With SEEN_COUNT_MODE = 'approximate' every post keeps a HyperLogLog sketch of
+the ids of the users who have seen it (PostViewSketch). A sketch is a fixed
+2 ** HLL_PRECISION bytes however many viewers the post has, adding a viewer
+twice does not change it and two sketches merge by taking the larger register,
+so old SeenPost rows can be folded into the sketch and deleted
+(compact_seen_posts) without double counting the users who see the post again.
+
+Posts without a sketch are counted exactly from their SeenPost rows; the
+sketch is seeded from those rows the first time it is needed.
+"""
+import hashlib
+import math
+import zlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+
+from .models import PostViewSketch, SeenPost
+
+
+def approximate():
+    return getattr(settings, 'SEEN_COUNT_MODE', 'exact') == 'approximate'
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality estimator over 64-bit blake2b hashes
+    """
+
+    def __init__(self, precision=None, registers=None):
+        self.precision = precision or getattr(settings, 'HLL_PRECISION', 11)
+        if not 4 <= self.precision <= 16:
+            raise ValueError('HyperLogLog precision must be between 4 and 16')
+        self.size = 1 << self.precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError('HyperLogLog registers do not match the precision')
+
+    def add(self, value):
+        """Add a value, returning whether the sketch changed"""
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values):
+        """Add several values, returning whether the sketch changed"""
+        changed = False
+        for value in values:
+            changed |= self.add(value)
+        return changed
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge HyperLogLog sketches of different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimate the number of distinct values added"""
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if zeros and estimate <= 2.5 * size:
+            # Linear counting is more accurate for small cardinalities
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def to_bytes(self):
+        return zlib.compress(bytes([self.precision]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(bytes(data))
+        return cls(precision=data[0], registers=data[1:])
+
+
+def _seed(post_id):
+    """Return a new sketch of the post's SeenPost rows"""
+    sketch = HyperLogLog()
+    sketch.update(SeenPost.objects.filter(post_id=post_id).values_list('user_id', flat=True).iterator())
+    return sketch
+
+
+def add_viewers(post_id, user_ids, seed=True):
+    """
+    Add viewers to the sketch of a post, creating it (seeded from the post's
+    SeenPost rows when ``seed`` is set) if needed. A concurrent update may be
+    lost; the viewer's SeenPost row puts it back when it is compacted.
+    """
+    with transaction.atomic():
+        row = PostViewSketch.objects.select_for_update().filter(post_id=post_id).first()
+        if row is None:
+            sketch = _seed(post_id) if seed else HyperLogLog()
+            sketch.update(user_ids)
+            try:
+                with transaction.atomic():
+                    PostViewSketch.objects.create(post_id=post_id, registers=sketch.to_bytes())
+                return
+            except IntegrityError:
+                # Created concurrently
+                row = PostViewSketch.objects.select_for_update().get(post_id=post_id)
+        sketch = HyperLogLog.from_bytes(row.registers)
+        if sketch.update(user_ids):
+            row.registers = sketch.to_bytes()
+            row.save(update_fields=['registers', 'updated_at'])
+
+
+def record_view(post, user):
+    """Record that a user has seen a post"""
+    seen, created = SeenPost.objects.get_or_create(user=user, post=post)
+    if created and approximate():
+        add_viewers(post.pk, [user.pk])
+    return seen
+
+
+def seen_counts(post_ids):
+    """
+    Return the unique viewer count of each post: the sketch estimate for
+    posts that have one, the exact SeenPost count for the others
+    """
+    post_ids = list(post_ids)
+    counts = {
+        post_id: HyperLogLog.from_bytes(registers).count()
+        for post_id, registers in PostViewSketch.objects.filter(post_id__in=post_ids).values_list('post_id', 'registers')
+    }
+    missing = [post_id for post_id in post_ids if post_id not in counts]
+    if missing:
+        counts.update(
+            SeenPost.objects.filter(post_id__in=missing)
+            .order_by()
+            .values_list('post_id')
+            .annotate(total=Count('pk'))
+        )
+    return {post_id: counts.get(post_id, 0) for post_id in post_ids}
+
+
+def seen_count(post_id):
+    return seen_counts([post_id])[post_id]
@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unicodedata
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from . import db, hashing
+from .authentication import issue_token, principals, revoke_tokens, user_for_token
+from .cache import LRUCache, feed_cache, post_fragments
+from .changes import make_token
+from .db import WriterBusy, WriterQueue, write
+from .deletion import Reaper, delete_account, delete_post
+from .export import export_ndjson
+from .hashing import HashingBusy, HashingPool
+from .helpers import encode_cursor, extract_hashtags, extract_mentions
+from .live import LiveCounts, get_broker
+from .models import *
+from .middleware import PIN_COOKIE
+from .notifications import notify
+from .ranking import rank
+from .search import get_search_backend
+from .serializers import AccountDetailSerializer
+from .sketches import HyperLogLog, record_view, seen_counts
+from .throttling import LoginThrottle, TokenBucket
+
+
+class APITestBase(APITestCase):
+    """Clears the caches, which outlive the rolled back test transactions"""
+
+    def setUp(self):
+        caches['default'].clear()
+        post_fragments.local.clear()
+        principals.local.clear()
+
+    def account(self, username, **fields):
+        return Account.objects.create_user(username, email=f'{username}@example.com', password='secret', **fields)
+
+    def client_for(self, account):
+        client = self.client_class()
+        client.force_authenticate(account)
+        return client
+
+    def committed(self):
+        """Run the on-commit callbacks of the writes made inside, as their commit would"""
+        return self.captureOnCommitCallbacks(execute=True)
+
+
+class AccountPrivacyTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        self.client = self.client_for(self.alice)
+
+    def test_email_only_on_own_account(self):
+        self.assertEqual(self.client.get(f'/api/accounts/{self.alice.pk}/').json()['email'], 'alice@example.com')
+        self.assertNotIn('email', self.client.get(f'/api/accounts/{self.bob.pk}/').json())
+
+    def test_no_account_list_and_search_hides_emails(self):
+        self.assertEqual(self.client.get('/api/accounts/').status_code, 404)
+        results = self.client.get('/api/accounts/search/', {'q': 'bob'}).json()['results']
+        self.assertEqual([account['username'] for account in results], ['bob'])
+        self.assertNotIn('email', results[0])
+
+    def test_bulk_hides_emails(self):
+        response = self.client.get('/api/accounts/bulk/', {'ids': f'{self.bob.pk},{self.alice.pk},0'}).json()
+        self.assertEqual([account['username'] for account in response['results']], ['bob', 'alice'])
+        self.assertFalse(any('email' in account for account in response['results']))
+        self.assertEqual(response['missing'], [0])
+
+
+class BulkTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.client = self.client_for(self.alice)
+        self.posts = [Post.objects.create(user=self.alice, description=f'Post {i}', image='') for i in range(10)]
+        for post in self.posts:
+            Likes.objects.create(user=self.alice, post=post)
+            Comment.objects.create(user=self.alice, post=post, text='Nice!')
+
+    def queries(self, url, ids):
+        caches['default'].clear()
+        post_fragments.local.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), len(ids))
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_ids(self):
+        post_ids = [post.pk for post in self.posts]
+        self.assertEqual(self.queries('/api/posts/bulk/', post_ids[:1]), self.queries('/api/posts/bulk/', post_ids))
+        stories = [Story.objects.create(user=self.alice, image='').pk for _ in range(5)]
+        self.assertEqual(self.queries('/api/stories/bulk/', stories[:1]), self.queries('/api/stories/bulk/', stories))
+
+    def test_rejects_ids_that_are_not_ascii_digits(self):
+        for ids in ('\u00b2', '1,x', '', '-1', ','.join(['1'] * 101)):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.get('/api/posts/bulk/', {'ids': ids}).status_code, 400)
+
+
+class SparseFieldsetTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.client = self.client_for(self.alice)
+        self.post = Post.objects.create(user=self.alice, description='Post', image='')
+        Likes.objects.create(user=self.alice, post=self.post)
+        Comment.objects.create(user=self.alice, post=self.post, text='Nice!')
+        Story.objects.create(user=self.alice, image='')
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), ' '.join(query['sql'] for query in queries)
+
+    def test_unrequested_post_fields_are_not_queried(self):
+        data, sql = self.get('/api/posts/bulk/', ids=self.post.pk, fields='id')
+        self.assertEqual(data['results'], [{'id': self.post.pk}])
+        for table in ('API_account', 'API_likes', 'API_comment', 'API_seenpost'):
+            self.assertNotIn(table, sql)
+
+        data, sql = self.get('/api/posts/bulk/', ids=self.post.pk, fields='id,user', expand='user')
+        self.assertEqual(data['results'][0]['user']['username'], 'alice')
+        self.assertIn('"API_account"."username"', sql)
+        self.assertNotIn('API_likes', sql)
+
+    def test_unexpanded_users_are_not_joined(self):
+        data, sql = self.get('/api/posts/bulk/', ids=self.post.pk, expand='')
+        self.assertEqual(data['results'][0]['user'], self.alice.pk)
+        self.assertEqual(data['results'][0]['likes_count'], 1)
+        self.assertNotIn('"API_account"."username"', sql)
+
+        for params in ({'fields': 'id'}, {'expand': ''}):
+            data, sql = self.get('/api/stories/', **params)
+            self.assertNotIn('"API_account"."username"', sql)
+        data, sql = self.get('/api/stories/')
+        self.assertEqual(data[0]['user']['username'], 'alice')
+        self.assertIn('"API_account"."username"', sql)
+
+
+class SearchTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.client = self.client_for(self.alice)
+        self.search = get_search_backend()
+
+    def post(self, description):
+        return Post.objects.create(user=self.alice, description=description, image='')
+
+    def post_ids(self, query, **kwargs):
+        hits, cursor = self.search.search_posts(query, **kwargs)
+        return [post_id for post_id, _ in hits], cursor
+
+    def test_terms_match_as_prefixes(self):
+        post = self.post('Sunsets over the harbour')
+        self.post('Morning coffee')
+        self.assertEqual(self.post_ids('sun')[0], [post.pk])
+        self.assertEqual(self.post_ids('sun harb')[0], [post.pk])
+        self.assertEqual(self.post_ids('sun coffee')[0], [])
+        self.assertEqual(self.search.search_accounts('ali')[0], [self.alice.pk])
+
+    def test_best_match_first(self):
+        weak = self.post('A long walk through the old town, the market and, at the end, the beach')
+        strong = self.post('Beach beach beach')
+        self.assertEqual(self.post_ids('beach')[0], [strong.pk, weak.pk])
+
+    def test_cursor_pagination(self):
+        posts = {self.post(f'sunset number {i}').pk for i in range(5)}
+        data = self.client.get('/api/posts/search/', {'q': 'sunset', 'limit': 2}).json()
+        seen, pages = [post['id'] for post in data['results']], 1
+        while data['next'] is not None and pages < 5:
+            data = self.client.get(data['next']).json()
+            seen += [post['id'] for post in data['results']]
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(seen), len(posts))
+        self.assertEqual(set(seen), posts)
+        self.assertEqual(self.client.get('/api/posts/search/').status_code, 400)
+
+    def test_edits_and_deletions_are_reindexed(self):
+        post = self.post('Sunset')
+        post.description = 'Sunrise'
+        post.save()
+        self.assertEqual(self.post_ids('sunset')[0], [])
+        self.assertEqual(self.post_ids('sunrise')[0], [post.pk])
+
+        self.alice.username = 'alicia'
+        self.alice.save()
+        self.assertEqual(self.search.search_accounts('alice')[0], [])
+        self.assertEqual(self.search.search_accounts('alicia')[0], [self.alice.pk])
+
+        bob = self.account('bob')
+        self.assertEqual(self.client.get('/api/accounts/search/', {'q': 'bob'}).json()['results'][0]['id'], bob.pk)
+        delete_account(bob)
+        self.assertEqual(self.client.get('/api/accounts/search/', {'q': 'bob'}).json()['results'], [])
+        self.assertEqual(self.search.search_accounts('bob')[0], [])
+
+
+class AdminTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(Account.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+
+    def posts(self, user, count):
+        return [Post.objects.create(user=user, description=f'{user.username} post {i}', image='') for i in range(count)]
+
+    def changelist(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/API/post/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for post in self.posts(self.alice, 3):
+            Likes.objects.create(user=self.bob, post=post)
+        _, few = self.changelist()
+        for post in self.posts(self.bob, 30):
+            Comment.objects.create(user=self.alice, post=post, text='Nice!')
+        _, many = self.changelist()
+        self.assertEqual(few, many)
+
+    def test_username_filter(self):
+        self.posts(self.alice, 2)
+        bob_posts = self.posts(self.bob, 2)
+        response, _ = self.changelist({'user': 'bob'})
+        self.assertEqual([post.pk for post in response.context['cl'].result_list], [post.pk for post in bob_posts[::-1]])
+        self.assertNotContains(response, 'alice post')
+
+    def test_inlines_show_the_newest_rows_only(self):
+        post = self.posts(self.alice, 1)[0]
+        for i in range(25):
+            Comment.objects.create(user=self.bob, post=post, text=f'comment {i:02}')
+        response = self.client.get(f'/admin/API/post/{post.pk}/change/')
+        self.assertContains(response, 'comment 24')
+        self.assertContains(response, 'comment 05')
+        self.assertNotContains(response, 'comment 04')
+
+
+class TokenRevocationTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+
+    def test_revocation_survives_stale_login(self):
+        stale = Account.objects.get(pk=self.alice.pk)
+        token = issue_token(self.alice)
+        revoke_tokens(self.alice)
+        update_last_login(None, stale)
+        self.assertIsNone(user_for_token(token))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').status_code, 401)
+
+    def test_saved_token_version_is_written(self):
+        token = issue_token(self.alice)
+        account = Account.objects.get(pk=self.alice.pk)
+        account.token_version += 1
+        account.save()
+        self.assertIsNone(user_for_token(token))
+
+    def login(self):
+        client = self.client_class()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {issue_token(Account.objects.get(pk=self.alice.pk))}')
+        return client
+
+    def test_logout_revokes_only_the_presented_token(self):
+        phone, laptop = self.login(), self.login()
+        self.assertEqual(phone.post('/api/logout').status_code, 200)
+        self.assertEqual(phone.get('/api/notifications/unread_count/').status_code, 401)
+        self.assertEqual(laptop.get('/api/notifications/unread_count/').status_code, 200)
+
+    def test_logout_everywhere_revokes_every_token(self):
+        phone, laptop = self.login(), self.login()
+        self.assertEqual(laptop.post('/api/logout/all').status_code, 200)
+        self.assertEqual(phone.get('/api/notifications/unread_count/').status_code, 401)
+        self.assertEqual(laptop.get('/api/notifications/unread_count/').status_code, 401)
+        self.assertEqual(self.login().get('/api/notifications/unread_count/').status_code, 200)
+
+    def test_password_change_revokes_every_token(self):
+        phone = self.login()
+        self.assertEqual(phone.get('/api/notifications/unread_count/').status_code, 200)
+        account = Account.objects.get(pk=self.alice.pk)
+        account.set_password('new secret')
+        account.save()
+        self.assertEqual(phone.get('/api/notifications/unread_count/').status_code, 401)
+        self.assertIsNotNone(user_for_token(issue_token(account)))
+
+        renamed = self.login()
+        account.first_name = 'Al'
+        account.save()
+        self.assertEqual(renamed.get('/api/notifications/unread_count/').status_code, 200)
+
+    def test_expired_and_forged_tokens_are_refused(self):
+        token = issue_token(self.alice)
+        with override_settings(TOKEN_AUTH={'MAX_AGE': -1}):
+            self.assertIsNone(user_for_token(token))
+        self.assertIsNone(user_for_token(token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')))
+        self.client.credentials(HTTP_AUTHORIZATION='Token forged')
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').status_code, 401)
+
+    def test_deletion_survives_stale_login(self):
+        stale = Account.objects.get(pk=self.alice.pk)
+        token = issue_token(self.alice)
+        delete_account(self.alice)
+        update_last_login(None, stale)
+        self.assertFalse(Account.objects.filter(pk=self.alice.pk).exists())
+        self.assertIsNone(user_for_token(token))
+
+
+class NotificationCounterTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        self.post = Post.objects.create(user=self.alice, description='Hello', image='posts/a.jpg')
+
+    def unread(self):
+        return Account.objects.get(pk=self.alice.pk).unread_notifications
+
+    def test_counter_survives_stale_login(self):
+        stale = Account.objects.get(pk=self.alice.pk)
+        notify(self.alice.pk, Notification.LIKE, self.bob.pk, self.post.pk)
+        update_last_login(None, stale)
+        self.assertEqual(self.unread(), 1)
+
+    def test_saved_counter_is_written(self):
+        account = Account.objects.get(pk=self.alice.pk)
+        account.unread_notifications = 3
+        account.save()
+        self.assertEqual(self.unread(), 3)
+
+    def test_comment_needs_an_object_body(self):
+        client = self.client_for(self.bob)
+        url = f'/api/posts/{self.post.pk}/comment/'
+        for body in (['Nice!'], 'Nice!', 1):
+            self.assertEqual(client.post(url, body, format='json').status_code, 400)
+        self.assertEqual(self.unread(), 0)
+        with self.committed():
+            self.assertEqual(client.post(url, {'text': 'Nice!'}, format='json').status_code, 201)
+        self.assertEqual(self.unread(), 1)
+
+    def test_reaped_post_takes_its_notifications_off_the_counter(self):
+        Likes.objects.create(user=self.bob, post=self.post)
+        Comment.objects.create(user=self.bob, post=self.post, text='Nice!')
+        other = Post.objects.create(user=self.alice, description='Other', image='posts/b.jpg')
+        Likes.objects.create(user=self.bob, post=other)
+        self.assertEqual(self.unread(), 3)
+        delete_post(self.post)
+        Reaper(batch_size=1).run(DeletionJob.objects.get(object_id=self.post.pk))
+        self.assertEqual(self.unread(), 1)
+        response = self.client_for(self.alice).post('/api/notifications/read/').json()
+        self.assertEqual(response, {'marked': 1, 'unread_count': 0})
+
+    def test_cascade_takes_notifications_off_the_counter(self):
+        Likes.objects.create(user=self.bob, post=self.post)
+        self.client_for(self.alice).post('/api/notifications/read/')
+        Comment.objects.create(user=self.bob, post=self.post, text='Nice!')
+        self.assertEqual(self.unread(), 1)
+        Post.all_objects.get(pk=self.post.pk).delete()
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.unread(), 0)
+
+    def test_actors_are_counted_once(self):
+        carol = self.account('carol')
+        for _ in range(3):
+            for actor in (self.bob, carol):
+                Likes.objects.filter(user=actor, post=self.post).delete()
+                Likes.objects.create(user=actor, post=self.post)
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(self.unread(), 1)
+
+    def test_inbox_pages_and_rejects_bad_cursors(self):
+        for i in range(3):
+            notify(self.alice.pk, Notification.FOLLOW, self.account(f'fan{i}').pk)
+            notify(self.alice.pk, Notification.LIKE, self.bob.pk, Post.objects.create(
+                user=self.alice, description=f'Post {i}', image='posts/a.jpg'
+            ).pk)
+        client = self.client_for(self.alice)
+        first = client.get('/api/notifications/', {'limit': 2}).json()
+        second = client.get(first['next']).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 4)
+        self.assertIsNone(second['next'])
+        self.assertEqual(second['unread_count'], 4)
+
+        now = timezone.now().isoformat()
+        for cursor in (encode_cursor(['x', 1]), encode_cursor([now, 'x']), encode_cursor([now]), '!!!'):
+            self.assertEqual(client.get('/api/notifications/', {'cursor': cursor}).status_code, 400)
+
+    @override_settings(NOTIFICATION_RECENT_ACTORS=5)
+    def test_actors_are_kept_bounded(self):
+        fans = [self.account(f'fan{i}') for i in range(40)]
+        for fan in fans:
+            Likes.objects.create(user=fan, post=self.post)
+        notification = Notification.objects.get()
+        self.assertEqual(notification.recent_actor_ids, [fan.pk for fan in fans[:-6:-1]])
+        self.assertAlmostEqual(notification.actor_count, 40, delta=4)
+        self.assertEqual(notification.last_actor_id, fans[-1].pk)
+        Likes.objects.filter(user=fans[-1]).delete()
+        Likes.objects.create(user=fans[-1], post=self.post)
+        self.assertEqual(Notification.objects.get().actor_count, notification.actor_count)
+
+    def test_new_actor_makes_a_read_notification_unread(self):
+        Likes.objects.create(user=self.bob, post=self.post)
+        self.client_for(self.alice).post('/api/notifications/read/')
+        Likes.objects.filter(user=self.bob).delete()
+        Likes.objects.create(user=self.bob, post=self.post)
+        self.assertEqual(self.unread(), 0)
+        Likes.objects.create(user=self.account('carol'), post=self.post)
+        self.assertEqual(self.unread(), 1)
+        self.assertEqual(Notification.objects.get().actor_count, 2)
+
+
+class ConditionalGetTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        self.client = self.client_for(self.alice)
+
+    def assertRevalidates(self, url, change):
+        """A response is revalidated until ``change`` runs, and then sent again"""
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.committed():
+            change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def rename(self, account, name):
+        account = Account.objects.get(pk=account.pk)
+        account.first_name = name
+        account.username = name.lower()
+        account.save()
+
+    def test_story_list_changes_with_author(self):
+        Story.objects.create(user=self.bob, image='stories/a.jpg')
+        response = self.assertRevalidates('/api/stories/', lambda: self.rename(self.bob, 'Robert'))
+        self.assertEqual(response.json()[0]['user']['first_name'], 'Robert')
+
+    def test_feed_changes_with_posts_likes_and_author(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        self.assertRevalidates('/api/posts/my_feed/', lambda: Post.objects.create(
+            user=self.bob, description='Again', image='posts/b.jpg'
+        ))
+        self.assertRevalidates('/api/posts/my_feed/', lambda: Likes.objects.create(user=self.bob, post=post))
+        response = self.assertRevalidates('/api/posts/my_feed/', lambda: self.rename(self.bob, 'Robert'))
+        self.assertEqual({item['user']['username'] for item in response.json()}, {'robert'})
+
+    def test_feed_ignores_if_modified_since(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        response = self.client.get('/api/posts/my_feed/')
+        self.assertNotIn('Last-Modified', response)
+        with self.committed():
+            Likes.objects.create(user=self.bob, post=post)
+        response = self.client.get('/api/posts/my_feed/', HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['likes_count'], 1)
+
+    @override_settings(FEED_CACHE={'ENABLED': False})
+    def test_uncached_feed_changes_with_posts_likes_and_author(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        self.assertRevalidates('/api/posts/my_feed/', lambda: Likes.objects.create(user=self.bob, post=post))
+        self.assertRevalidates('/api/posts/my_feed/', lambda: Post.objects.create(
+            user=self.bob, description='Again', image='posts/b.jpg'
+        ))
+        response = self.assertRevalidates('/api/posts/my_feed/', lambda: self.rename(self.bob, 'Robert'))
+        self.assertEqual({item['user']['username'] for item in response.json()}, {'robert'})
+
+    def test_post_detail_changes_with_author(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        response = self.assertRevalidates(f'/api/posts/{post.pk}/', lambda: self.rename(self.bob, 'Robert'))
+        self.assertEqual(response.json()['user']['username'], 'robert')
+
+    def test_post_detail_changes_with_commenter(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        carol = self.account('carol')
+        Comment.objects.create(user=carol, post=post, text='Nice!')
+        response = self.assertRevalidates(f'/api/posts/{post.pk}/', lambda: self.rename(carol, 'Caroline'))
+        self.assertEqual(response.json()['comments'][0]['user'], 'caroline')
+        self.assertNotIn('Last-Modified', response)
+
+    def test_post_detail_changes_with_views(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        response = self.assertRevalidates(
+            f'/api/posts/{post.pk}/', lambda: SeenPost.objects.create(user=self.alice, post=post)
+        )
+        self.assertEqual(response.json()['seen_count'], 1)
+
+    def test_post_detail_validates_only_the_requested_fields(self):
+        post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        Comment.objects.create(user=self.bob, post=post, text='First!')
+        url = f'/api/posts/{post.pk}/?fields=id,description'
+        etag = self.client.get(url)['ETag']
+        # Only the post itself is read to answer 304
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.committed():
+            SeenPost.objects.create(user=self.alice, post=post)
+            self.rename(self.bob, 'Robert')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertRevalidates(f'/api/posts/{post.pk}/?fields=id,seen_count', lambda: SeenPost.objects.create(
+            user=self.bob, post=post
+        ))
+        response = self.assertRevalidates(
+            f'/api/posts/{post.pk}/?fields=id,comments', lambda: self.rename(self.bob, 'Bobby')
+        )
+        self.assertEqual(response.json()['comments'][0]['user'], 'bobby')
+
+
+class SoftDeletionTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        self.client = self.client_for(self.alice)
+        self.posts = [
+            Post.objects.create(user=self.bob, description=f'#sunset number {i}', image='posts/a.jpg')
+            for i in range(3)
+        ]
+
+    def trending(self):
+        return self.client.get('/api/hashtags/trending/').json()
+
+    def test_hidden_posts_leave_hashtag_feeds_and_trends(self):
+        delete_post(self.posts[2])
+        response = self.client.get('/api/hashtags/sunset/posts/', {'limit': 2}).json()
+        self.assertEqual([post['id'] for post in response['results']], [self.posts[1].pk, self.posts[0].pk])
+        self.assertEqual(self.trending(), [{'name': 'sunset', 'count': 2}])
+
+        Reaper().run(DeletionJob.objects.get(object_id=self.posts[2].pk))
+        self.assertEqual(self.trending(), [{'name': 'sunset', 'count': 2}])
+        delete_account(self.bob)
+        self.assertEqual(self.trending(), [])
+        self.assertEqual(self.client.get('/api/hashtags/sunset/posts/').json()['results'], [])
+        Reaper().run(DeletionJob.objects.get(object_id=self.bob.pk))
+        self.assertEqual(sum(HashtagTrend.objects.values_list('count', flat=True)), 0)
+
+    def test_hidden_accounts_keep_their_username_until_reaped(self):
+        delete_account(self.bob)
+        data = {'username': 'bob', 'email': 'new@example.com', 'password': 'secret', 'password_confirm': 'secret'}
+        self.assertEqual(self.client_class().post('/api/register', data).status_code, 400)
+        Reaper().run(DeletionJob.objects.get(object_id=self.bob.pk))
+        self.assertEqual(self.client_class().post('/api/register', data).status_code, 201)
+
+    def test_comments_on_hidden_posts_leave_my_comments(self):
+        for post in self.posts:
+            Comment.objects.create(user=self.alice, post=post, text='Nice!')
+        delete_post(self.posts[0])
+        comments = self.client.get('/api/posts/my_comments/').json()
+        self.assertEqual(sorted(comment['post'] for comment in comments), [self.posts[1].pk, self.posts[2].pk])
+
+    def test_rebuilt_search_index_leaves_hidden_rows_out(self):
+        delete_post(self.posts[0])
+        search = get_search_backend()
+        search.rebuild()
+        hits, _ = search.search_posts('sunset')
+        self.assertEqual(sorted(post_id for post_id, _ in hits), [self.posts[1].pk, self.posts[2].pk])
+        delete_account(self.bob)
+        search.rebuild()
+        self.assertEqual(search.search_posts('sunset'), ([], None))
+        self.assertEqual(search.search_accounts('bob'), ([], None))
+        self.assertEqual(search.search_accounts('alice')[0], [self.alice.pk])
+
+    def test_deletion_logs_counts_once_per_post(self):
+        carol = self.account('carol')
+        for post in self.posts:
+            Likes.objects.create(user=carol, post=post)
+            for _ in range(3):
+                Comment.objects.create(user=carol, post=post, text='Nice!')
+        last = Change.objects.latest('pk').pk
+        delete_account(carol)
+        Reaper().run(DeletionJob.objects.get(object_id=carol.pk))
+        counts = Change.objects.filter(pk__gt=last, kind=Change.COUNTS).values_list('object_id', flat=True)
+        self.assertEqual(sorted(counts), sorted(post.pk for post in self.posts))
+        self.assertFalse(Comment.objects.exists())
+
+    def test_hidden_accounts_leave_comments_likes_follows_and_notifications(self):
+        carol = self.account('carol')
+        post = self.posts[0]
+        Comment.objects.create(user=carol, post=post, text='carol secret')
+        Likes.objects.create(user=carol, post=post)
+        SeenPost.objects.create(user=carol, post=post)
+        FollowerConnection.objects.create(follower=carol, following=self.alice)
+        alice_post = Post.objects.create(user=self.alice, description='Mine', image='posts/b.jpg')
+        Likes.objects.create(user=carol, post=alice_post)
+        with self.committed():
+            delete_account(carol)
+
+        detail = self.client.get(f'/api/posts/{post.pk}/').json()
+        self.assertEqual(detail['comments'], [])
+        self.assertEqual((detail['comments_count'], detail['likes_count'], detail['seen_count']), (0, 0, 0))
+        self.assertEqual(self.client.get('/api/posts/bulk/', {'ids': post.pk}).json()['results'][0]['likes_count'], 0)
+        self.assertEqual(AccountDetailSerializer(self.alice).data['followers_count'], 0)
+        self.assertFalse(SeenPost.objects.filter(user=carol).exists())
+        notification = self.client.get('/api/notifications/').json()['results'][0]
+        self.assertIsNone(notification['last_actor'])
+        self.assertEqual(notification['message'], 'Someone liked your post')
+
+
+class FeedCacheTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        self.client = self.client_for(self.alice)
+        self.post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+
+    def feed(self):
+        return {post['id']: post for post in self.client.get('/api/posts/my_feed/').json()}
+
+    def test_new_post_reaches_followers_without_a_fan_out(self):
+        self.assertEqual(list(self.feed()), [self.post.pk])
+        with self.committed(), CaptureQueriesContext(connection) as queries:
+            post = Post.objects.create(user=self.bob, description='Again', image='posts/b.jpg')
+        self.assertFalse(any(FollowerConnection._meta.db_table in query['sql'] for query in queries))
+        self.assertEqual(set(self.feed()), {self.post.pk, post.pk})
+        with self.committed():
+            delete_post(post)
+        self.assertEqual(list(self.feed()), [self.post.pk])
+
+    def test_likes_comments_and_accounts_reach_cached_pages(self):
+        self.assertEqual(self.feed()[self.post.pk]['likes_count'], 0)
+        self.assertEqual(self.client.get('/api/posts/my_likes/').json(), [])
+
+        with self.committed():
+            self.client.post(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(self.feed()[self.post.pk]['likes_count'], 1)
+        self.assertEqual([post['id'] for post in self.client.get('/api/posts/my_likes/').json()], [self.post.pk])
+
+        with self.committed():
+            Comment.objects.create(user=self.alice, post=self.post, text='Nice!')
+        self.assertEqual(self.feed()[self.post.pk]['comments_count'], 1)
+
+        self.bob.username = 'robert'
+        with self.committed():
+            self.bob.save()
+        self.assertEqual(self.feed()[self.post.pk]['user']['username'], 'robert')
+
+    def test_reads_before_the_commit_leave_no_stale_fragment(self):
+        refs = [(self.post.pk, self.bob.pk)]
+        self.assertEqual(self.feed()[self.post.pk]['likes_count'], 0)
+        before = post_fragments.versions(refs)
+        with self.committed():
+            Likes.objects.create(user=self.alice, post=self.post)
+            # A concurrent reader still sees the old rows, and caches them
+            # under the stamps it finds until the like commits
+            self.assertEqual(post_fragments.versions(refs), before)
+            generation = feed_cache.generation(self.alice.pk)
+        self.assertNotEqual(post_fragments.versions(refs), before)
+        self.assertNotEqual(feed_cache.generation(self.alice.pk), generation)
+        self.assertEqual(self.feed()[self.post.pk]['likes_count'], 1)
+
+    def test_follows_reach_cached_pages(self):
+        carol = self.account('carol')
+        post = Post.objects.create(user=carol, description='Hi', image='posts/c.jpg')
+        self.assertEqual(list(self.feed()), [self.post.pk])
+        with self.committed():
+            FollowerConnection.objects.create(follower=self.alice, following=carol)
+        self.assertEqual(set(self.feed()), {self.post.pk, post.pk})
+        with self.committed():
+            FollowerConnection.objects.filter(follower=self.alice, following=self.bob).delete()
+        self.assertEqual(list(self.feed()), [post.pk])
+
+
+class PostFragmentCacheTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        self.post = Post.objects.create(user=self.bob, description='Hello', image='posts/a.jpg')
+        Likes.objects.create(user=self.alice, post=self.post)
+
+    def bulk(self, account):
+        response = self.client_for(account).get('/api/posts/bulk/', {'ids': self.post.pk})
+        return response.json()['results'][0]
+
+    def test_lru_evicts_the_least_recently_used_entry(self):
+        lru = LRUCache(maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c'), len(lru)), (1, 3, 2))
+
+    def test_lru_entries_expire(self):
+        lru = LRUCache(timeout=30)
+        with mock.patch('time.monotonic', return_value=1000):
+            lru.set('default', 1)
+            lru.set('short', 2, timeout=5)
+            lru.set('long', 3, timeout=60)
+        with mock.patch('time.monotonic', return_value=1010):
+            self.assertEqual((lru.get('default'), lru.get('short'), lru.get('long')), (1, None, 3))
+        with mock.patch('time.monotonic', return_value=1031):
+            self.assertEqual((lru.get('default'), lru.get('long')), (None, 3))
+        self.assertEqual(len(lru), 1)
+
+    def test_one_fragment_serves_viewers_with_different_likes(self):
+        post_fragments.reset_stats()
+        self.assertFalse(self.bulk(self.bob)['is_liked'])
+        fragment = self.bulk(self.alice)
+        self.assertTrue(fragment['is_liked'])
+        self.assertEqual(fragment['likes_count'], 1)
+        # The second viewer's is_liked is laid over the first viewer's fragment
+        stats = post_fragments.stats()
+        self.assertEqual((stats['misses'], stats['local_hits'], stats['shared_hits']), (1, 1, 0))
+
+    def test_shared_tier_refills_the_local_one(self):
+        post_fragments.reset_stats()
+        self.bulk(self.bob)
+        post_fragments.local.clear()
+        self.assertTrue(self.bulk(self.alice)['is_liked'])
+        self.assertEqual(len(post_fragments.local), 1)
+        self.assertEqual(post_fragments.stats()['shared_hits'], 1)
+
+    def test_bumped_stamp_skips_the_old_fragment_in_both_tiers(self):
+        self.bulk(self.bob)
+        with self.committed():
+            Likes.objects.create(user=self.bob, post=self.post)
+        post_fragments.reset_stats()
+        fragment = self.bulk(self.bob)
+        self.assertEqual((fragment['likes_count'], fragment['is_liked']), (2, True))
+        self.assertEqual(post_fragments.stats()['misses'], 1)
+
+
+class RankedFeedTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        self.client = self.client_for(self.alice)
+
+    def page(self, next_url=None):
+        if next_url is None:
+            response = self.client.get('/api/posts/feed/', {'ranked': 1, 'limit': 5})
+        else:
+            response = self.client.get(next_url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rank_by_engagement_then_age(self):
+        now = timezone.now()
+        rows = [
+            (1, 10, now - timedelta(hours=1), 0, 0),
+            (2, 10, now - timedelta(hours=2), 5, 0),
+            (3, 11, now - timedelta(hours=1), 0, 0),
+            (4, 12, now - timedelta(hours=48), 5, 0),
+        ]
+        self.assertEqual([post_id for post_id, _ in rank(rows, {}, now)], [2, 3, 1, 4])
+        self.assertEqual([post_id for post_id, _ in rank(rows, {11: 3}, now)], [3, 2, 1, 4])
+
+    def test_liked_post_ranks_first(self):
+        posts = [Post.objects.create(user=self.bob, description=f'Post {i}', image='posts/a.jpg') for i in range(3)]
+        for i in range(3):
+            Likes.objects.create(user=self.account(f'fan{i}'), post=posts[0])
+        ids = [post['id'] for post in self.page()['results']]
+        self.assertEqual(ids, [posts[0].pk, posts[2].pk, posts[1].pk])
+
+    def test_pages_keep_their_ranking_while_the_feed_changes(self):
+        posts = [Post.objects.create(user=self.bob, description=f'Post {i}', image='posts/a.jpg') for i in range(20)]
+        first = self.page()
+        self.assertEqual([post['id'] for post in first['results']], [post.pk for post in posts[:-6:-1]])
+
+        with self.committed():
+            self.client.post(f'/api/posts/{posts[-5].pk}/like/')
+        second = self.page(first['next'])
+        self.assertEqual([post['id'] for post in second['results']], [post.pk for post in posts[-6:-11:-1]])
+        self.assertEqual(
+            [post['id'] for post in self.page()['results']][0], posts[-5].pk,
+            'a new first page is ranked afresh'
+        )
+
+
+class FastPathTests(APITestBase):
+    """The compiled serializers must render exactly what the DRF serializers do"""
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice', first_name='Alice')
+        self.bob = self.account('bob', profile_picture='profile_pictures/bob.png', description='Café ☕')
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        self.posts = [
+            Post.objects.create(user=self.bob, description=f'Post {i} #sunset ✨', image=f'posts/{i}.jpg')
+            for i in range(3)
+        ]
+        Likes.objects.create(user=self.alice, post=self.posts[0])
+        Comment.objects.create(user=self.alice, post=self.posts[0], text='Nice!')
+        Comment.objects.create(user=self.bob, post=self.posts[1], text='Thanks 🙏')
+        SeenPost.objects.create(user=self.alice, post=self.posts[2])
+        Story.objects.create(user=self.bob, image='stories/a.jpg')
+        Story.objects.create(user=self.alice, image='stories/b.jpg')
+
+    def render(self, fast, url, params=None):
+        caches['default'].clear()
+        post_fragments.local.clear()
+        with override_settings(API_FAST_SERIALIZATION=fast):
+            response = self.client_for(self.alice).get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_fast_path_matches_drf(self):
+        ids = ','.join(str(post.pk) for post in self.posts)
+        requests = [
+            ('/api/posts/my_feed/', None),
+            ('/api/posts/my_feed/', {'fields': 'id,user,likes_count', 'expand': ''}),
+            ('/api/posts/bulk/', {'ids': ids}),
+            ('/api/posts/my_comments/', None),
+            ('/api/stories/', None),
+            ('/api/stories/', {'fields': 'id,user', 'expand': 'user'}),
+            (f'/api/posts/{self.posts[0].pk}/', None),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url, params=params):
+                self.assertEqual(self.render(True, url, params), self.render(False, url, params))
+
+
+@override_settings(LIVE_UPDATES={'INTERVAL_MS': 50})
+class LiveCountsTests(APITestBase):
+    interval = 0.05
+
+    def setUp(self):
+        super().setUp()
+        alice = self.account('alice')
+        self.posts = [Post.objects.create(user=alice, description=f'Post {i}', image='') for i in range(2)]
+        for i in range(2):
+            Likes.objects.create(user=self.account(f'fan{i}'), post=self.posts[0])
+        self.hub = LiveCounts()
+
+    def counts(self, post, likes):
+        return {post.pk: {'likes_count': likes, 'comments_count': 0}}
+
+    async def event(self, subscriber):
+        await asyncio.wait_for(subscriber.ready.wait(), 1)
+        return subscriber.take()
+
+    async def close(self, *subscribers):
+        for subscriber in subscribers:
+            self.hub.unsubscribe(subscriber)
+        await asyncio.wait_for(self.hub._task, 1)
+
+    async def test_changes_within_an_interval_make_one_event(self):
+        subscriber = self.hub.subscribe([self.posts[0].pk])
+        for _ in range(5):
+            get_broker().publish(self.posts[0].pk)
+        self.assertEqual(await self.event(subscriber), self.counts(self.posts[0], 2))
+        await asyncio.sleep(self.interval * 3)
+        self.assertFalse(subscriber.ready.is_set())
+        await self.close(subscriber)
+
+    async def test_events_are_an_interval_apart(self):
+        subscriber = self.hub.subscribe([self.posts[0].pk])
+        self.hub.changed(self.posts[0].pk)
+        await self.event(subscriber)
+        sent = time.monotonic()
+        self.hub.changed(self.posts[0].pk)
+        await self.event(subscriber)
+        self.assertGreaterEqual(time.monotonic() - sent, self.interval * 0.8)
+        await self.close(subscriber)
+
+    async def test_unsubscribed_streams_are_forgotten(self):
+        first = self.hub.subscribe([post.pk for post in self.posts])
+        second = self.hub.subscribe([self.posts[0].pk])
+        self.assertEqual(self.hub.subscriber_count, 2)
+        self.hub.unsubscribe(first)
+        self.hub.changed(self.posts[1].pk)
+        self.hub.changed(self.posts[0].pk)
+        self.assertEqual(await self.event(second), self.counts(self.posts[0], 2))
+        self.assertFalse(first.ready.is_set())
+        await self.close(second)
+        self.assertEqual(self.hub.subscriber_count, 0)
+        self.assertTrue(self.hub._task.done(), 'the hub stops once nobody listens')
+
+    async def test_fan_out_to_many_subscribers(self):
+        watchers = [self.hub.subscribe([self.posts[0].pk]) for _ in range(500)]
+        others = [self.hub.subscribe([self.posts[1].pk]) for _ in range(10)]
+        self.hub.changed(self.posts[0].pk)
+        events = await asyncio.gather(*(self.event(subscriber) for subscriber in watchers))
+        self.assertEqual(events, [self.counts(self.posts[0], 2)] * len(watchers))
+        self.assertFalse(any(subscriber.ready.is_set() for subscriber in others))
+        await self.close(*watchers, *others)
+
+
+class HashtagTests(APITestBase):
+
+    def test_hashtags_are_normalized_and_deduplicated(self):
+        text = '#Django #DJANGO #\uff46\uff55\uff4c\uff4c #\ufb01ne #Stra\u00dfe &#39; a#b #_ok'
+        self.assertEqual(extract_hashtags(text), ['django', 'full', 'fine', 'strasse', '_ok'])
+        self.assertEqual(extract_hashtags(None), [])
+
+    def test_normalized_hashtags_fit_the_name_column(self):
+        # NFKC turns this one character into 18
+        tag = '\ufdfa' * 60
+        self.assertEqual(len(unicodedata.normalize('NFKC', tag)), 1080)
+        names = extract_hashtags(f'#{tag} #{"x" * 150}')
+        self.assertEqual([len(name) for name in names], [100, 100])
+        post = Post.objects.create(user=self.account('alice'), description=f'#{tag}', image='')
+        self.assertEqual(list(post.post_hashtags.values_list('hashtag__name', flat=True)), names[:1])
+        self.assertEqual(self.client_for(post.user).get(f'/api/hashtags/{tag}/').status_code, 200)
+
+    def test_mentions_drop_trailing_dots_and_email_addresses(self):
+        text = 'Hi @alice. and @bob_1, @alice again; mail me at carol@example.com @d.e+f-g'
+        self.assertEqual(extract_mentions(text), ['alice', 'bob_1', 'd.e+f-g'])
+
+    def test_editing_a_post_writes_only_the_difference(self):
+        alice, bob, carol = self.account('alice'), self.account('bob'), self.account('carol')
+        post = Post.objects.create(user=alice, description='#sun #sea with @bob', image='')
+        kept = PostHashtag.objects.get(post=post, hashtag__name='sea').pk
+
+        post.description = '#sea #sand with @carol and @nobody'
+        post.save()
+        self.assertEqual(set(post.post_hashtags.values_list('hashtag__name', flat=True)), {'sea', 'sand'})
+        self.assertEqual(PostHashtag.objects.get(post=post, hashtag__name='sea').pk, kept)
+        self.assertEqual(list(Mention.objects.filter(post=post).values_list('user_id', flat=True)), [carol.pk])
+        trends = dict(HashtagTrend.objects.values_list('hashtag__name', 'count'))
+        self.assertEqual(trends, {'sun': 0, 'sea': 1, 'sand': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        for table in ('API_posthashtag', 'API_mention', 'API_hashtagtrend'):
+            self.assertFalse([sql for sql in writes if table in sql])
+        self.assertNotIn(bob.pk, Mention.objects.values_list('user_id', flat=True))
+
+
+class SyncTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        self.client = self.client_for(self.alice)
+
+    def sync(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        return self.client.get('/api/sync', params).json()
+
+    def test_resume_from_token(self):
+        start = self.sync()
+        self.assertTrue(start['reset'])
+        posts = [Post.objects.create(user=self.bob, description=f'Post {i}', image='posts/a.jpg') for i in range(3)]
+
+        first = self.sync(start['since'], limit=2)
+        self.assertFalse(first['reset'])
+        self.assertTrue(first['has_more'])
+        self.assertEqual([post['id'] for post in first['posts']], [posts[0].pk, posts[1].pk])
+        second = self.sync(first['since'], limit=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual([post['id'] for post in second['posts']], [posts[2].pk])
+
+        Likes.objects.create(user=self.bob, post=posts[0])
+        delete_post(posts[1])
+        third = self.sync(second['since'])
+        self.assertEqual(third['counts'], {str(posts[0].pk): {'likes_count': 1, 'comments_count': 0}})
+        self.assertEqual(third['deleted'], {'posts': [posts[1].pk], 'stories': []})
+        self.assertEqual(self.sync(third['since'])['posts'], [])
+
+    def test_reset(self):
+        since = self.sync()['since']
+        FollowerConnection.objects.create(follower=self.alice, following=self.account('carol'))
+        response = self.sync(since)
+        self.assertTrue(response['reset'])
+        self.assertFalse(self.sync(response['since'])['reset'])
+
+        expired = make_token(0, timezone.now() - timedelta(days=31))
+        self.assertTrue(self.sync(expired)['reset'])
+        self.assertTrue(self.sync('garbage')['reset'])
+
+    def test_deleting_a_followed_account_does_not_reset_its_followers(self):
+        posts = [Post.objects.create(user=self.bob, description=f'Post {i}', image='') for i in range(2)]
+        Story.objects.create(user=self.bob, image='')
+        since = self.sync()['since']
+        delete_account(self.bob)
+        response = self.sync(since)
+        self.assertFalse(response['reset'])
+        self.assertEqual(sorted(response['deleted']['posts']), [post.pk for post in posts])
+
+        self.assertEqual(AccountDetailSerializer(self.alice).data['following_count'], 0)
+        Reaper().run(DeletionJob.objects.get(object_id=self.bob.pk))
+        self.assertFalse(FollowerConnection.objects.exists())
+        response = self.sync(response['since'])
+        self.assertFalse(response['reset'])
+        self.assertEqual(response['deleted'], {'posts': [], 'stories': []})
+
+
+class ReaperTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        posts = [Post.objects.create(user=self.bob, description=f'Post {i}', image='') for i in range(4)]
+        for post in posts:
+            Likes.objects.create(user=self.alice, post=post)
+            Comment.objects.create(user=self.alice, post=post, text='Nice!')
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        Story.objects.create(user=self.bob, image='')
+        delete_account(self.bob)
+        self.job = DeletionJob.objects.get(object_id=self.bob.pk)
+
+    def test_interrupted_job_resumes(self):
+        class Interrupted(Exception):
+            pass
+
+        class FlakyReaper(Reaper):
+            batches = 0
+
+            def _delete_batch(self, *args):
+                self.batches += 1
+                if self.batches == 4:
+                    raise Interrupted
+                return super()._delete_batch(*args)
+
+        with self.assertRaises(Interrupted):
+            FlakyReaper(batch_size=2).run(self.job)
+        job = DeletionJob.objects.get(pk=self.job.pk)
+        self.assertIsNone(job.finished_at)
+        self.assertTrue(Likes.objects.exists())
+
+        Reaper(batch_size=2).run(job)
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_at)
+        self.assertFalse(Account.all_objects.filter(pk=self.bob.pk).exists())
+        for model in (Post.all_objects, Story.all_objects, Likes.objects, Comment.objects, FollowerConnection.objects):
+            self.assertFalse(model.exists())
+        self.assertEqual(job.step, '')
+        self.assertTrue(Account.objects.filter(pk=self.alice.pk).exists())
+
+
+class ExportTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.bob = self.account('bob')
+        self.carol = self.account('carol')
+        self.mine = Post.objects.create(user=self.alice, description='Mine', image='posts/mine.jpg')
+        gone = Post.objects.create(user=self.alice, description='Gone', image='')
+        theirs = Post.objects.create(user=self.bob, description='Theirs', image='posts/theirs.jpg')
+        Comment.objects.create(user=self.alice, post=theirs, text='Nice!')
+        Comment.objects.create(user=self.bob, post=self.mine, text='Thanks')
+        Likes.objects.create(user=self.alice, post=theirs)
+        Likes.objects.create(user=self.bob, post=self.mine)
+        FollowerConnection.objects.create(follower=self.alice, following=self.bob)
+        FollowerConnection.objects.create(follower=self.bob, following=self.alice)
+        FollowerConnection.objects.create(follower=self.carol, following=self.alice)
+        FollowerConnection.objects.create(follower=self.bob, following=self.carol)
+        delete_post(gone)
+        delete_account(self.carol)
+
+    def export(self, query=''):
+        response = self.client_for(self.alice).get(f'/api/accounts/me/export/{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-store', response['Cache-Control'])
+        return response, b''.join(response.streaming_content)
+
+    def records(self, data):
+        records = {}
+        for line in data.decode().splitlines():
+            record = json.loads(line)
+            records.setdefault(record.pop('type'), []).append(record)
+        return records
+
+    def test_ndjson_holds_only_the_users_live_rows(self):
+        response, data = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="alice.ndjson"')
+        records = self.records(data)
+        self.assertEqual([row['username'] for row in records['account']], ['alice'])
+        self.assertEqual([row['description'] for row in records['post']], ['Mine'])
+        self.assertEqual([row['text'] for row in records['comment']], ['Nice!'])
+        self.assertEqual(len(records['like']), 1)
+        self.assertEqual([row['username'] for row in records['following']], ['bob'])
+        self.assertEqual([row['username'] for row in records['follower']], ['bob'])
+        self.assertNotIn('story', records)
+        self.assertNotIn(b'Theirs', data)
+        self.assertNotIn(b'Thanks', data)
+        self.assertEqual(b''.join(export_ndjson(self.alice, chunk_size=1)), data)
+
+    def test_zip_holds_the_ndjson_and_the_users_images(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        os.makedirs(os.path.join(media, 'posts'))
+        for name in ('mine.jpg', 'theirs.jpg'):
+            with open(os.path.join(media, 'posts', name), 'wb') as image:
+                image.write(name.encode())
+        with override_settings(MEDIA_ROOT=media):
+            response, data = self.export('?media=1')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ['data.ndjson', 'media/posts/mine.jpg'])
+            self.assertEqual(archive.read('media/posts/mine.jpg'), b'mine.jpg')
+            self.assertEqual(archive.read('data.ndjson'), self.export()[1])
+
+
+class HyperLogLogTests(APITestBase):
+
+    def sketch(self, values):
+        sketch = HyperLogLog(precision=11)
+        sketch.update(values)
+        return sketch
+
+    def test_estimates_stay_within_the_error_bound(self):
+        # The standard error is 1.04 / sqrt(2 ** 11), about 2.3%; allow three
+        for size in (10, 100, 1000, 10000, 50000):
+            estimate = self.sketch(range(size)).count()
+            self.assertLessEqual(abs(estimate - size), max(1, 0.07 * size), size)
+
+    def test_adding_a_value_again_changes_nothing(self):
+        sketch = self.sketch(range(500))
+        registers = bytes(sketch.registers)
+        self.assertFalse(sketch.update(range(500)))
+        self.assertEqual(bytes(sketch.registers), registers)
+
+    def test_merge_equals_the_sketch_of_the_union(self):
+        merged = self.sketch(range(6000)).merge(self.sketch(range(4000, 10000)))
+        self.assertEqual(merged.registers, self.sketch(range(10000)).registers)
+        self.assertEqual(HyperLogLog.from_bytes(merged.to_bytes()).registers, merged.registers)
+        with self.assertRaises(ValueError):
+            merged.merge(HyperLogLog(precision=10))
+
+
+@override_settings(SEEN_COUNT_MODE='approximate')
+class CompactSeenPostsTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        self.viewers = [self.account(f'viewer{i}') for i in range(3)]
+        self.old = Post.objects.create(user=self.alice, description='Old', image='')
+        self.new = Post.objects.create(user=self.alice, description='New', image='')
+        Post.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(days=40))
+        for viewer in self.viewers:
+            SeenPost.objects.create(user=viewer, post=self.old)
+            SeenPost.objects.create(user=viewer, post=self.new)
+
+    def compact(self):
+        call_command('compact_seen_posts', '--days', '30', stdout=io.StringIO())
+
+    def test_old_rows_are_folded_into_the_sketch(self):
+        self.compact()
+        self.assertFalse(SeenPost.objects.filter(post=self.old).exists())
+        self.assertEqual(SeenPost.objects.filter(post=self.new).count(), 3)
+        self.assertTrue(PostViewSketch.objects.filter(post=self.old).exists())
+        self.assertFalse(PostViewSketch.objects.filter(post=self.new).exists())
+        self.assertEqual(seen_counts([self.old.pk, self.new.pk]), {self.old.pk: 3, self.new.pk: 3})
+
+    def test_views_after_compaction_are_not_counted_twice(self):
+        self.compact()
+        record_view(self.old, self.viewers[0])
+        self.assertEqual(seen_counts([self.old.pk])[self.old.pk], 3)
+        record_view(self.old, self.alice)
+        self.assertEqual(seen_counts([self.old.pk])[self.old.pk], 4)
+
+        self.compact()
+        self.assertFalse(SeenPost.objects.filter(post=self.old).exists())
+        self.assertEqual(seen_counts([self.old.pk])[self.old.pk], 4)
+
+    @override_settings(SEEN_COUNT_MODE='exact')
+    def test_exact_mode_refuses_to_compact(self):
+        with self.assertRaises(CommandError):
+            self.compact()
+        self.assertEqual(SeenPost.objects.count(), 6)
+
+
+@override_settings(LOGIN_THROTTLE={'IP_BURST': 4, 'USERNAME_BURST': 2, 'USERNAME_RATE': 0.1})
+class LoginThrottleTests(APITestBase):
+
+    def setUp(self):
+        super().setUp()
+        self.alice = self.account('alice')
+        # The buckets are built from the settings on first use
+        LoginThrottle.buckets = None
+        self.addCleanup(setattr, LoginThrottle, 'buckets', None)
+        # Pool threads would not see the test transaction
+        patcher = mock.patch.object(hashing, '_pool', HashingPool(workers=0, max_pending=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, username='alice', password='secret'):
+        return self.client.post('/api/login', {'username': username, 'password': password})
+
+    def test_bucket_refills_at_its_rate(self):
+        bucket = TokenBucket(burst=2, rate=0.5)
+        self.assertEqual(bucket.consume('ip', now=0), 0)
+        self.assertEqual(bucket.consume('ip', now=0), 0)
+        self.assertEqual(bucket.consume('ip', now=0), 2)
+        self.assertEqual(bucket.consume('ip', now=1), 1)
+        self.assertEqual(bucket.consume('ip', now=2), 0)
+        self.assertEqual(bucket.consume('ip', now=100), 0)
+        self.assertEqual(bucket.consume('ip', now=100), 0)
+        self.assertEqual(bucket.consume('ip', now=100), 2)
+        self.assertEqual(bucket.consume('other ip', now=100), 0)
+
+    def test_username_is_throttled_with_retry_after(self):
+        self.assertEqual(self.login(password='wrong').status_code, 401)
+        self.assertEqual(self.login(username='ALICE', password='wrong').status_code, 401)
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')
+        self.assertEqual(self.login(username='bob').status_code, 401)
+        self.assertEqual(self.login(username='carol').status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE={'ENABLED': False})
+    def test_disabled_throttle_lets_every_login_through(self):
+        for _ in range(5):
+            self.assertEqual(self.login().status_code, 200)
+
+
+class HashingPoolTests(APITestBase):
+
+    def test_saturated_pool_answers_503(self):
+        pool = HashingPool(workers=1, max_pending=0, timeout=5)
+        release = threading.Event()
+        busy = threading.Thread(target=pool.run, args=(release.wait,))
+        busy.start()
+        self.addCleanup(busy.join)
+        self.addCleanup(release.set)
+        while pool._slots._value:
+            time.sleep(0.001)
+
+        with mock.patch.object(hashing, '_pool', pool):
+            response = self.client.post('/api/login', {'username': 'alice', 'password': 'secret'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.data['detail'].code, 'hashing_busy')
+
+        release.set()
+        busy.join()
+        self.assertEqual(pool.run(sum, [1, 2]), 3)
+
+    def test_slow_hash_times_out_with_503(self):
+        pool = HashingPool(workers=1, max_pending=0, timeout=0.01)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with self.assertRaises(HashingBusy):
+            pool.run(release.wait)
+
+    def test_pool_without_workers_runs_inline(self):
+        pool = HashingPool(workers=0, max_pending=0)
+        self.assertEqual(pool.run(threading.get_ident), threading.get_ident())
+
+
+class SQLiteWriteTests(APITransactionTestCase):
+    """
+    Runs outside a test transaction: the writer thread only sees committed
+    rows and would wait for the lock of an open transaction
+    """
+
+    def setUp(self):
+        self.alice = Account.objects.create_user('alice', password='secret')
+        self.post = Post.objects.create(user=self.alice, description='Hello', image='posts/a.jpg')
+
+    def tearDown(self):
+        # Takes them out of the search index too, which the flush leaves alone
+        Account.all_objects.all().delete()
+
+    def test_new_connections_apply_the_pragmas(self):
+        # The in-memory test database cannot use WAL, so open a file like the real one
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        fresh = connections['default'].__class__({**connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')})
+        self.addCleanup(fresh.close)
+        with fresh.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        # synchronous NORMAL is 1; busy_timeout is the timeout option in ms
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 20000})
+
+    def test_writes_take_the_lock_up_front(self):
+        with CaptureQueriesContext(connection) as queries:
+            write(Likes.objects.create, user=self.alice, post=self.post)
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_writer_queue_runs_jobs_in_order(self):
+        writer = WriterQueue()
+        done = []
+        futures = [writer.submit(done.append, i) for i in range(20)]
+        for future in futures:
+            future.result(timeout=5)
+        self.assertEqual(done, list(range(20)))
+        self.assertEqual(writer.submit(threading.current_thread).result(timeout=5).name, 'db-writer')
+
+    def test_full_queue_answers_503(self):
+        writer = WriterQueue(maxsize=1, put_timeout=0.01)
+        running, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+        writer.submit(lambda: running.set() or release.wait(5))
+        running.wait(5)
+        writer.submit(len, [])
+        with self.assertRaises(WriterBusy):
+            writer.submit(len, [])
+
+        client = self.client_class()
+        client.force_authenticate(self.alice)
+        with mock.patch.object(db, 'writer_queue', writer), override_settings(DATABASE_WRITER_QUEUE=True):
+            response = client.post(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['detail'].code, 'writer_busy')
+        # The blocked job holds the write lock
+        release.set()
+        writer._queue.join()
+        self.assertFalse(Likes.objects.exists())
+
+    @override_settings(DATABASE_WRITER_QUEUE=True)
+    def test_write_runs_inline_inside_a_transaction(self):
+        writer = WriterQueue()
+        with mock.patch.object(db, 'writer_queue', writer):
+            self.assertEqual(write(threading.get_ident), writer.submit(threading.get_ident).result(timeout=5))
+            with transaction.atomic():
+                self.assertEqual(write(threading.get_ident), threading.get_ident())
+
+    def test_writer_closes_old_connections_around_each_job(self):
+        writer = WriterQueue()
+        with mock.patch.object(db, 'close_old_connections') as close_old_connections:
+            writer.submit(len, []).result(timeout=5)
+            writer.submit(len, []).result(timeout=5)
+            writer._queue.join()
+        self.assertEqual(close_old_connections.call_count, 4)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    """
+    Reads against a second alias mirroring the test database, like a replica
+    on a second SQLite file would. The rows are committed so that the
+    replica's connection sees them.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added once the test databases exist, as the runner would set up a
+        # DATABASE_REPLICA_PATHS replica with TEST = {'MIRROR': 'default'}
+        connections.settings['replica'] = {
+            **connections['default'].settings_dict,
+            'TEST': {**connections['default'].settings_dict['TEST'], 'MIRROR': 'default'},
+        }
+        cls.databases = {'default', 'replica'}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['default'].clear()
+        post_fragments.local.clear()
+        self.alice = Account.objects.create_user('alice', password='secret')
+        self.bob = Account.objects.create_user('bob', password='secret')
+        FollowerConnection.objects.create(follower=self.bob, following=self.alice)
+        self.post = Post.objects.create(user=self.alice, description='Hello', image='posts/a.jpg')
+
+    def tearDown(self):
+        # Takes them out of the search index too, which the flush leaves alone
+        Account.all_objects.all().delete()
+
+    def login(self, account):
+        client = self.client_class()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {issue_token(account)}')
+        return client
+
+    def get(self, client, url):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(client.get(url).status_code, 200)
+        return primary, replica
+
+    def test_reads_go_to_the_replica(self):
+        Story.objects.create(user=self.alice, image='stories/a.jpg')
+        primary, replica = self.get(self.login(self.bob), '/api/stories/')
+        self.assertTrue(any(Story._meta.db_table in query['sql'] for query in replica))
+        self.assertFalse(any(Story._meta.db_table in query['sql'] for query in primary))
+
+    def test_writer_is_pinned_to_the_primary(self):
+        phone, laptop, bob = self.login(self.alice), self.login(self.alice), self.login(self.bob)
+        response = phone.post(f'/api/posts/{self.post.pk}/like/')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        for client in (phone, laptop):
+            with self.subTest(client=client):
+                primary, replica = self.get(client, '/api/stories/')
+                self.assertEqual(len(replica), 0)
+                self.assertTrue(primary)
+        self.assertTrue(self.get(bob, '/api/stories/')[1])
+
+    def test_recently_changed_pages_and_fragments_are_read_from_the_primary(self):
+        primary, replica = self.get(self.login(self.bob), '/api/posts/my_feed/')
+        self.assertTrue(any(Post._meta.db_table in query['sql'] for query in primary))
+        self.assertFalse(any(Post._meta.db_table in query['sql'] for query in replica))
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=0)
+    def test_settled_pages_and_fragments_are_read_from_the_replica(self):
+        primary, replica = self.get(self.login(self.bob), '/api/posts/my_feed/')
+        self.assertTrue(any(Post._meta.db_table in query['sql'] for query in replica))
+        self.assertFalse(any(Post._meta.db_table in query['sql'] for query in primary))
+
+    def test_token_requests_leave_the_session_alone(self):
+        client = self.login(self.bob)
+        client.cookies[settings.SESSION_COOKIE_NAME] = 'left-over'
+        primary, replica = self.get(client, '/api/stories/')
+        for query in [*primary, *replica]:
+            self.assertNotIn('django_session', query['sql'])
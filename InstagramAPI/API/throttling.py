@@ -0,0 +1,109 @@
+"""
+In-memory token-bucket throttles for the login and registration endpoints.
+
+Each client IP, and for logins each username, gets a bucket of BURST tokens
+refilled at RATE tokens per second; a request spends one token and is
+rejected with 429 when its bucket is empty. Buckets live in the process, so
+with several workers the effective limit is multiplied by their number.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+
+class TokenBucket:
+    """
+    Thread-safe token buckets by key, keeping at most ``maxsize`` keys
+    """
+
+    def __init__(self, burst, rate, maxsize=100000):
+        self.burst = burst
+        self.rate = rate
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, now=None):
+        """
+        Take a token from the key's bucket. Return 0 when one was available,
+        otherwise the seconds until there will be one.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'IP_BURST': 20,
+    'IP_RATE': 0.5,
+    'USERNAME_BURST': 5,
+    'USERNAME_RATE': 0.05,
+}
+
+
+def throttle_options():
+    return {**DEFAULTS, **getattr(settings, 'LOGIN_THROTTLE', {})}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Base class of the throttles below; ``buckets`` are shared by every
+    instance of a throttle class
+    """
+    scopes = []
+    buckets = None
+
+    @classmethod
+    def get_buckets(cls):
+        if cls.buckets is None:
+            options = throttle_options()
+            cls.buckets = {
+                scope: TokenBucket(options[f'{scope}_BURST'], options[f'{scope}_RATE'])
+                for scope in cls.scopes
+            }
+        return cls.buckets
+
+    def get_key(self, scope, request):
+        if scope == 'IP':
+            return self.get_ident(request)
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        return str(username).lower() if username else None
+
+    def allow_request(self, request, view):
+        self.delay = 0.0
+        if not throttle_options()['ENABLED']:
+            return True
+        for scope, buckets in self.get_buckets().items():
+            key = self.get_key(scope, request)
+            if key is not None:
+                self.delay = max(self.delay, buckets.consume(key))
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scopes = ['IP', 'USERNAME']
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    scopes = ['IP']
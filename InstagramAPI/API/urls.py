@@ -1,17 +1,26 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
+    AccountViewSet,
+    HashtagViewSet,
+    NotificationViewSet,
     PostViewSet,
     StoryViewSet,
+    SyncView,
     UserRegister, 
     UserLogin, 
     UserLogout,
+    UserLogoutEverywhere,
+    live_post_counts,
 )
 
 # Create router for ViewSets
 router = DefaultRouter()
 router.register(r'posts', PostViewSet, basename='post')
 router.register(r'stories', StoryViewSet, basename='story')
+router.register(r'accounts', AccountViewSet, basename='account')
+router.register(r'hashtags', HashtagViewSet, basename='hashtag')
+router.register(r'notifications', NotificationViewSet, basename='notification')
 
 # Define URL patterns
 urlpatterns = [
@@ -22,6 +31,13 @@ urlpatterns = [
     path('register', UserRegister.as_view(), name='user-register'),
     path('login', UserLogin.as_view(), name='user-login'),
     path('logout', UserLogout.as_view(), name='user-logout'),
+    path('logout/all', UserLogoutEverywhere.as_view(), name='user-logout-everywhere'),
+
+    # Delta sync
+    path('sync', SyncView.as_view(), name='sync'),
+
+    # Server-sent events
+    path('live/posts', live_post_counts, name='live-post-counts'),
     
     # Add other URL patterns as needed
     # path('stories/', StoryList.as_view(), name='story-list'),
@@ -1,19 +1,116 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import login, logout
 from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
 from rest_framework.views import APIView
-from rest_framework import permissions, status, viewsets
+from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.response import Response
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.utils.urls import replace_query_param
 
 from .serializers import *
 from .models import *
 from .helpers import *
+from .authentication import SignedTokenAuthentication, issue_token, revoke_token, revoke_tokens, user_for_token
+from .cache import feed_cache, post_fragments
+from .changes import changes_since, sync_options
+from .db import write
+from .deletion import delete_account, delete_post
+from .export import async_chunks, export_ndjson, export_zip
+from .fastpath import count_subquery
+from .search import get_search_backend
+from .hashtags import trending
+from .ranking import ranked_feed
+from .live import live_counts, live_options, post_counts
+from .notifications import mark_read
+from .sketches import approximate, record_view
+from .throttling import LoginThrottle, RegisterThrottle
 
 # Views of the App
-class StoryViewSet(viewsets.ModelViewSet):
+def _toggle_like(user, post):
+    like, created = Likes.objects.get_or_create(user=user, post=post)
+    if not created:
+        like.delete()
+
+
+def _search_response(request, search, render, max_limit=50):
+    """
+    Run a ranked search for ``?q=`` and return a cursor-paginated response
+    of ``{"next": ..., "results": [...]}``
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({"error": "q query parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+    limit = query_param_int(request, 'limit', 20, maximum=max_limit)
+    hits, cursor = search(query, cursor=request.query_params.get('cursor'), limit=limit)
+    next_url = None
+    if cursor is not None:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+    return Response({'next': next_url, 'results': render(hits)})
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for viewsets. Validators are computed before rendering,
+    so a matching If-None-Match is answered with 304 Not Modified without
+    serializing anything. Last-Modified is not sent: its one-second
+    resolution cannot tell apart changes made within the same second.
+    """
+
+    def conditional_response(self, validators, render):
+        request = self.request
+        parts = [request.user.pk, request.get_full_path(), request.accepted_renderer.media_type, *validators]
+        etag = quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class MultiGetMixin:
+    """
+    ``bulk`` action for viewsets: ``?ids=3,1,2`` returns up to
+    ``max_bulk_ids`` objects in the requested order, serialized as a list
+    (a constant number of queries), along with the ids that were not found
+    """
+    max_bulk_ids = 100
+
+    @action(detail=False, methods=['get'])
+    def bulk(self, request):
+        values = [parse_id(value) for value in query_param_list(request, 'ids') or []]
+        if not values or None in values or len(values) > self.max_bulk_ids:
+            return Response(
+                {"error": f"ids must list between 1 and {self.max_bulk_ids} ids"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ids = list(dict.fromkeys(values))
+        objects = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        found = [objects[pk] for pk in ids if pk in objects]
+        return Response({
+            'results': self.get_serializer(found, many=True).data,
+            'missing': [pk for pk in ids if pk not in objects],
+        })
+
+
+class StoryViewSet(MultiGetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing stories
     """
@@ -39,12 +136,44 @@ class StoryViewSet(viewsets.ModelViewSet):
             ).order_by('-created_at')
         
         return queryset
+
+    def list(self, request, *args, **kwargs):
+        return self._story_list_response(self.get_queryset())
+
+    def filter_queryset(self, queryset):
+        """
+        Join the story authors only when they are embedded in the response
+        (see ?fields= and ?expand= on the serializers)
+        """
+        queryset = super().filter_queryset(queryset)
+        if field_embedded(self.request, 'user'):
+            queryset = queryset.select_related('user')
+        return queryset
     
     def perform_create(self, serializer):
         """
         Assign the current user when creating a story
         """
         serializer.save(user=self.request.user)
+
+    def _story_list_response(self, queryset):
+        """
+        Stories are never edited, so their count and newest id identify a
+        list, and the stamps of their authors the accounts embedded in it;
+        Last-Modified is not sent since deletions cannot be dated.
+        """
+        summary = queryset.order_by().aggregate(count=Count('id'), last=Max('id'))
+        author_ids = queryset.order_by().values_list('user_id', flat=True).distinct()
+        authors = post_fragments.account_stamps(author_ids)
+
+        def render():
+            stories = self.filter_queryset(queryset)
+            page = self.paginate_queryset(stories)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+            return Response(self.get_serializer(stories, many=True).data)
+
+        return self.conditional_response([summary['count'], summary['last'], sorted(authors.items())], render)
     
     @action(detail=False, methods=['get'])
     def my_stories(self, request):
@@ -57,8 +186,7 @@ class StoryViewSet(viewsets.ModelViewSet):
             created_at__gt=twenty_four_hours_ago
         ).order_by('-created_at')
         
-        serializer = self.get_serializer(stories, many=True)
-        return Response(serializer.data)
+        return self._story_list_response(stories)
     
     @action(detail=False, methods=['get'])
     def user_stories(self, request):
@@ -78,11 +206,10 @@ class StoryViewSet(viewsets.ModelViewSet):
             created_at__gt=twenty_four_hours_ago
         ).order_by('-created_at')
         
-        serializer = self.get_serializer(stories, many=True)
-        return Response(serializer.data)
+        return self._story_list_response(stories)
 
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(MultiGetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows posts to be viewed or edited.
     """
@@ -90,37 +217,105 @@ class PostViewSet(viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'bulk':
+            # Count in the same query instead of once per post, and only
+            # what ?fields= and ?expand= keep
+            request = self.request
+            if field_embedded(request, 'user'):
+                queryset = queryset.select_related('user')
+            counts = {'likes_count': Likes, 'comments_count': Comment}
+            if not approximate():
+                counts['seen_count'] = SeenPost
+            queryset = queryset.annotate(**{
+                name: count_subquery(model) for name, model in counts.items() if field_requested(request, name)
+            })
+        return queryset
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        """Hide the post now; reap_deleted removes it and its dependent rows"""
+        delete_post(instance)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Post detail with an ETag taken from the post's fragment stamps (bumped
+        by post, like and comment changes), and as far as ?fields= and
+        ?expand= keep them, the stamps of its author and commenters and its
+        newest view, checked before the post is serialized. Views cannot be
+        dated, so Last-Modified is not sent.
+        """
+        post = self.get_object()
+        post_stamp, author_stamp = post_fragments.stamps([(post.pk, post.user_id)])[post.pk]
+        validators = [post_stamp]
+        if field_embedded(request, 'user'):
+            validators.append(('user', author_stamp))
+        if field_requested(request, 'comments'):
+            commenter_ids = post.comments.order_by().values_list('user_id', flat=True).distinct()
+            validators.append(('comments', sorted(post_fragments.account_stamps(commenter_ids).items())))
+        if field_requested(request, 'seen_count'):
+            validators.append(('seen_count', post.seen_by.aggregate(last=Max('id'))['last']))
+        return self.conditional_response(validators, lambda: Response(self.get_serializer(post).data))
+
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
         post = self.get_object()
-        like, created = Likes.objects.get_or_create(user=request.user, post=post)
-        if not created:
-            like.delete()
+        write(_toggle_like, request.user, post)
         return Response(status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
     def comment(self, request, pk=None):
         post = self.get_object()
-        serializer = CommentSerializer(data=request.data)
+        if not isinstance(request.data, dict):
+            return Response({"error": "Expected an object with the comment text"}, status=status.HTTP_400_BAD_REQUEST)
+        # The post comes from the URL, not the body
+        serializer = CommentSerializer(
+            data={'text': request.data.get('text'), 'post': post.pk},
+            context=self.get_serializer_context(),
+        )
         if serializer.is_valid():
-            serializer.save(user=request.user, post=post)
+            write(serializer.save, user=request.user, post=post)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['get'])
     def seen(self, request, pk=None):
         post = self.get_object()
-        seen, created = SeenPost.objects.get_or_create(user=request.user, post=post)
+        write(record_view, post, request.user)
         return Response(status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
     def feed(self, request):
+        if request.query_params.get('ranked') in ('1', 'true'):
+            return self._ranked_response()
         posts = Post.objects.filter(user__followers__follower=request.user)
         return self._paginated_response(posts)
 
+    def _ranked_response(self):
+        """
+        Ranked feed (see ranking.py), paginated by a cursor of the ranking
+        snapshot and an offset into it, so later pages come from the same
+        ranking as the first one
+        """
+        request = self.request
+        limit = query_param_int(request, 'limit', 20, maximum=50)
+        snapshot, offset = None, 0
+        cursor = decode_cursor(request.query_params.get('cursor'))
+        if (isinstance(cursor, list) and len(cursor) == 2
+                and all(type(value) is int and value >= 0 for value in cursor)):
+            snapshot, offset = cursor
+        snapshot, refs = ranked_feed(request.user, snapshot)
+
+        page = refs[offset:offset + limit]
+        next_url = None
+        if offset + limit < len(refs):
+            cursor = encode_cursor([snapshot, offset + limit])
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+        return Response({'next': next_url, 'results': self.get_serializer(many=True).render(page)})
+
     @action(detail=False, methods=['get'])
     def my_posts(self, request):
         posts = Post.objects.filter(user=request.user)
@@ -132,14 +327,26 @@ class PostViewSet(viewsets.ModelViewSet):
         posts = Post.objects.filter(user__in=following_users)
         return self._paginated_response(posts)
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over post descriptions, best match first
+        """
+        return _search_response(
+            request,
+            get_search_backend().search_posts,
+            lambda refs: self.get_serializer(many=True).render(refs),
+        )
+
     @action(detail=False, methods=['get'])
     def my_comments(self, request):
-        comments = Comment.objects.filter(user=request.user)
+        comments = Comment.objects.filter(user=request.user, post__deleted_at__isnull=True)
+        context = self.get_serializer_context()
         page = self.paginate_queryset(comments)
         if page is not None:
-            serializer = CommentSerializer(page, many=True)
+            serializer = CommentSerializer(page, many=True, context=context)
             return self.get_paginated_response(serializer.data)
-        serializer = CommentSerializer(comments, many=True)
+        serializer = CommentSerializer(comments, many=True, context=context)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
@@ -149,13 +356,51 @@ class PostViewSet(viewsets.ModelViewSet):
         
     def _paginated_response(self, queryset):
         """Helper method to handle pagination for post responses"""
+        if feed_cache.enabled:
+            return self._cached_response(queryset)
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
-        
+        posts = list(queryset) if page is None else page
+        envelope = None if page is None else self.get_paginated_response(None).data
+        stamps = post_fragments.stamps([(post.pk, post.user_id) for post in posts])
+
+        def render():
+            serializer = self.get_serializer(posts, many=True)
+            if page is not None:
+                return self.get_paginated_response(serializer.data)
+            return Response(serializer.data)
+
+        # The page's post ids (in order) and their stamps validate the response
+        return self.conditional_response([[post.pk for post in posts], envelope, sorted(stamps.items())], render)
+
+    def _cached_response(self, queryset):
+        """
+        Serve a post list from the feed cache: the page's post ids are cached
+        per user and the posts themselves are rendered from shared fragments.
+        """
+        def build():
+            page = self.paginate_queryset(queryset)
+            if page is None:
+                return {'refs': list(queryset.values_list('pk', 'user_id')), 'envelope': None}
+            return {
+                'refs': [(post.pk, post.user_id) for post in page],
+                'envelope': self.get_paginated_response(None).data,
+            }
+
+        def render():
+            results = self.get_serializer(many=True).render(page['refs'])
+            if page['envelope'] is None:
+                return Response(results)
+            data = page['envelope'].copy()
+            data['results'] = results
+            return Response(data)
+
+        # The page generation changes with the list, the post stamps with the
+        # posts in it, so both validate the response without rendering it
+        generation = feed_cache.generation(self.request.user.pk)
+        page = feed_cache.get_page(self.request.user.pk, self.action, self.request, build, generation)
+        stamps = post_fragments.stamps(page['refs'])
+        return self.conditional_response([generation, page['envelope'], sorted(stamps.items())], render)
+
     def get_serializer_class(self):
         """Return appropriate serializer class based on action"""
         if self.action == 'retrieve':
@@ -163,11 +408,279 @@ class PostViewSet(viewsets.ModelViewSet):
         return super().get_serializer_class()
 
 
+class HashtagViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for hashtags, their post feeds and trends
+    """
+    queryset = Hashtag.objects.all()
+    serializer_class = HashtagSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_field = 'name'
+    lookup_value_regex = '[^/]+'
+
+    def get_object(self):
+        self.kwargs[self.lookup_field] = normalize_hashtag(self.kwargs[self.lookup_field])
+        return super().get_object()
+
+    @action(detail=True, methods=['get'])
+    def posts(self, request, name=None):
+        """
+        Return the posts using a hashtag, newest first, with cursor pagination
+        """
+        hashtag = self.get_object()
+        limit = query_param_int(request, 'limit', 20, maximum=50)
+
+        rows = PostHashtag.objects.filter(hashtag=hashtag, post__deleted_at__isnull=True)
+        cursor = decode_cursor(request.query_params.get('cursor'))
+        if isinstance(cursor, int):
+            rows = rows.filter(post_id__lt=cursor)
+        refs = list(rows.order_by('-post_id').values_list('post_id', 'post__user_id')[:limit + 1])
+
+        next_url = None
+        if len(refs) > limit:
+            refs = refs[:limit]
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', encode_cursor(refs[-1][0]))
+        results = PostSerializer(many=True, context=self.get_serializer_context()).render(refs)
+        return Response({'next': next_url, 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        """
+        Return the most used hashtags of the last ``hours`` hours (default 24)
+        """
+        hours = query_param_int(request, 'hours', 24, maximum=24 * 7)
+        limit = query_param_int(request, 'limit', 20, maximum=100)
+        return Response([{'name': name, 'count': count} for name, count in trending(hours, limit)])
+
+
+class AccountViewSet(MultiGetMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    API endpoint for looking up and searching accounts. There is no list of
+    every account: clients find them with search or fetch them by id.
+    """
+    queryset = Account.objects.all()
+    serializer_class = PublicAccountSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Return an account, with its email only when it is the current user's
+        """
+        account = self.get_object()
+        if account.pk == request.user.pk:
+            serializer = AccountSerializer(account, context=self.get_serializer_context())
+        else:
+            serializer = self.get_serializer(account)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over usernames, names and descriptions
+        """
+        def render(account_ids):
+            accounts = Account.objects.in_bulk(account_ids)
+            ordered = [accounts[pk] for pk in account_ids if pk in accounts]
+            return self.get_serializer(ordered, many=True).data
+
+        return _search_response(request, get_search_backend().search_accounts, render)
+
+    @action(detail=False, methods=['delete'])
+    def me(self, request):
+        """
+        Delete the current user's account: it is hidden and logged out at
+        once, and removed with everything it owns by reap_deleted
+        """
+        delete_account(request.user)
+        if request.session.session_key:
+            logout(request)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['get'], url_path='me/export')
+    def export(self, request):
+        """
+        Stream the current user's data as NDJSON, or with ``?media=1`` as a
+        zip of the NDJSON and their images (see export.py)
+        """
+        if request.query_params.get('media') in ('1', 'true'):
+            chunks, content_type, extension = export_zip(request.user), 'application/zip', 'zip'
+        else:
+            chunks, content_type, extension = export_ndjson(request.user), 'application/x-ndjson', 'ndjson'
+        if isinstance(request._request, ASGIRequest):
+            chunks = async_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}.{extension}"'
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+
+class NotificationViewSet(viewsets.GenericViewSet):
+    """
+    API endpoint for the current user's activity inbox
+    """
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user).select_related('last_actor')
+
+    def list(self, request):
+        """
+        Return the notifications, most recently active first, with cursor
+        pagination, and the unread counter
+        """
+        limit = query_param_int(request, 'limit', 20, maximum=50)
+        notifications = self.get_queryset()
+        if request.query_params.get('cursor'):
+            position = self._cursor_position(decode_cursor(request.query_params['cursor']))
+            if position is None:
+                return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+            updated_at, pk = position
+            notifications = notifications.filter(
+                models.Q(updated_at__lt=updated_at) | models.Q(updated_at=updated_at, pk__lt=pk)
+            )
+        notifications = list(notifications.order_by('-updated_at', '-pk')[:limit + 1])
+
+        next_url = None
+        if len(notifications) > limit:
+            notifications = notifications[:limit]
+            last = notifications[-1]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', encode_cursor([last.updated_at.isoformat(), last.pk])
+            )
+        return Response({
+            'unread_count': self._unread_count(),
+            'next': next_url,
+            'results': self.get_serializer(notifications, many=True).data,
+        })
+
+    def _cursor_position(self, cursor):
+        """Return the (updated_at, pk) stored in a list cursor, or None when it is not one"""
+        if not isinstance(cursor, list) or len(cursor) != 2 or type(cursor[1]) is not int:
+            return None
+        try:
+            updated_at = datetime.fromisoformat(cursor[0])
+        except (TypeError, ValueError):
+            return None
+        if timezone.is_naive(updated_at):
+            return None
+        return updated_at, cursor[1]
+
+    def _unread_count(self):
+        return Account.objects.filter(pk=self.request.user.pk).values_list('unread_notifications', flat=True).first()
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread_count': self._unread_count()})
+
+    @action(detail=False, methods=['post'])
+    def read(self, request):
+        """
+        Mark the notifications listed in ``ids``, or all of them, as read
+        """
+        ids = request.data.get('ids') if hasattr(request.data, 'get') else None
+        if ids is not None and not (isinstance(ids, list) and all(isinstance(pk, int) for pk in ids)):
+            return Response({"error": "ids must be a list of notification ids"}, status=status.HTTP_400_BAD_REQUEST)
+        marked = write(mark_read, request.user, ids)
+        return Response({'marked': marked, 'unread_count': self._unread_count()})
+
+
+class SyncView(APIView):
+    """
+    API endpoint for incremental refresh: the posts, stories, deletions and
+    count changes relevant to the current user after a ``since`` token
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """
+        Without ``since``, or with ``reset`` in the response, the client
+        refetches its lists and syncs from the returned ``since`` token.
+        ``has_more`` asks for another sync right away.
+        """
+        page_size = sync_options()['PAGE_SIZE']
+        limit = query_param_int(request, 'limit', page_size, maximum=page_size)
+        result = changes_since(request.user, request.query_params.get('since'), limit)
+        context = {'request': request, 'view': self}
+        stories = Story.objects.filter(pk__in=result.stories).select_related('user').order_by('-created_at')
+        return Response({
+            'since': result.token,
+            'reset': result.reset,
+            'has_more': result.has_more,
+            'posts': PostSerializer(many=True, context=context).render(result.posts),
+            'stories': StorySerializer(stories, many=True, context=context).data,
+            'counts': post_counts(result.counts),
+            'deleted': {'posts': result.deleted_posts, 'stories': result.deleted_stories},
+        })
+
+
+async def live_post_counts(request):
+    """
+    Server-sent events stream of the like and comment counts of the posts in
+    ``?posts=`` (comma-separated ids): a ``counts`` event with the current
+    counts, then one with the changed counts at most every INTERVAL_MS (see
+    live.py). EventSource cannot set headers, so the API token may also be
+    passed as ``?token=``. Needs an ASGI server (see asgi.py).
+    """
+    options = live_options()
+    token = request.GET.get('token')
+    if token is None:
+        try:
+            token = SignedTokenAuthentication.get_token(request)
+        except AuthenticationFailed:
+            token = None
+    if token is not None:
+        user = await sync_to_async(user_for_token)(token)
+    else:
+        user = await request.auser()
+    if user is None or not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    post_ids = set()
+    for value in (request.GET.get('posts') or '').split(','):
+        post_id = parse_id(value)
+        if post_id is not None:
+            post_ids.add(post_id)
+    if not post_ids or len(post_ids) > options['MAX_POSTS']:
+        return JsonResponse(
+            {'error': f"posts must list between 1 and {options['MAX_POSTS']} post ids"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    def event(counts):
+        return f'event: counts\ndata: {json.dumps(counts)}\n\n'
+
+    interval = options['INTERVAL_MS'] / 1000
+
+    async def stream():
+        subscriber = live_counts.subscribe(post_ids)
+        try:
+            yield event(await sync_to_async(post_counts)(post_ids))
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), options['HEARTBEAT_SECONDS'])
+                except asyncio.TimeoutError:
+                    # Comment line keeping proxies from closing an idle stream
+                    yield ': keep-alive\n\n'
+                    continue
+                yield event(subscriber.take())
+                # A stream that fell behind catches up with one event, not a burst
+                await asyncio.sleep(interval)
+        finally:
+            live_counts.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class UserRegister(APIView):
     """
     API endpoint for user registration
     """
     permission_classes = [permissions.AllowAny,]
+    throttle_classes = [RegisterThrottle]
 
     def post(self, request):
         serializer = UserRegisterSerializer(data=request.data)
@@ -192,17 +705,20 @@ class UserLogin(APIView):
     """
     permission_classes = [permissions.AllowAny]
     authentication_classes = [SessionAuthentication]
+    throttle_classes = [LoginThrottle]
 
     def post(self, request):
         serializer = UserLoginSerializer(data=request.data)
         try:
             serializer.is_valid(raise_exception=True)
             user = serializer.check_user(serializer.validated_data)
-            login(request, user)
+            if settings.API_AUTH_MODE != 'token':
+                login(request, user)
             return Response({
                 'message': 'Login successful',
                 'user_id': user.id,
                 'username': user.username,
+                'token': issue_token(user),
             }, status=status.HTTP_200_OK)
         except ValidationError as e:
             return Response({
@@ -213,12 +729,30 @@ class UserLogin(APIView):
 
 class UserLogout(APIView):
     """
-    API endpoint for user logout
+    API endpoint for user logout, revoking the token the request was
+    authenticated with and leaving the user's other devices logged in
     """
     permission_classes = [permissions.AllowAny,]
 
     def post(self, request):
+        if isinstance(request.successful_authenticator, SignedTokenAuthentication):
+            revoke_token(request.auth)
         logout(request)
         return Response({
             'message': 'Logout successful'
         }, status=status.HTTP_200_OK)
+
+
+class UserLogoutEverywhere(APIView):
+    """
+    API endpoint for logging out of every device: all of the user's tokens
+    are revoked
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        revoke_tokens(request.user)
+        logout(request)
+        return Response({
+            'message': 'Logged out everywhere'
+        }, status=status.HTTP_200_OK)
@@ -2,6 +2,9 @@
 ASGI config for InstagramAPI project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (``uvicorn InstagramAPI.asgi:application``) to
+use the server-sent events endpoint (/api/live/posts), which holds a
+connection open per subscriber without tying up a worker thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'InstagramAPI.API.middleware.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'InstagramAPI.urls'
@@ -76,13 +77,138 @@ WSGI_APPLICATION = 'InstagramAPI.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Pragmas run on every new SQLite connection. WAL lets readers proceed while
+# a write is in progress, synchronous=NORMAL is durable against application
+# crashes in WAL mode, and a negative cache_size is in KiB.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # Take the write lock when a transaction starts, so writers wait
+            # up to timeout seconds for each other instead of failing with
+            # "database is locked" when upgrading a read lock
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# Read replicas: DATABASE_REPLICA_PATHS is a comma-separated list of SQLite
+# files added as replica1, replica2, ... and used for reads by
+# API/routers.py. Locally, `python manage.py replicate_sqlite` keeps them in
+# sync with the primary. Users read from the primary for
+# READ_YOUR_WRITES_SECONDS after they write.
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_PATHS', '').split(',')), 1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['InstagramAPI.API.routers.ReplicaRouter']
+READ_YOUR_WRITES_SECONDS = 5
+
+# Run like, comment and seen writes on a single writer thread (see API/db.py)
+# instead of having request threads contend for the SQLite write lock.
+DATABASE_WRITER_QUEUE = os.environ.get('DATABASE_WRITER_QUEUE') == '1'
+DATABASE_WRITER_QUEUE_SIZE = 1000
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# LocMem is per process; point CACHE_BACKEND/CACHE_LOCATION at a file-based or
+# shared backend when running several workers so invalidation reaches all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'instagram-api'),
+    }
+}
+
+# Feed and profile post-list page cache (see API/cache.py)
+FEED_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'PAGE_TIMEOUT': 300,
+    'LOCK_TIMEOUT': 10,
+    'LOCK_WAIT': 2.0,
+}
+
+# Viewer-independent post fragments: an in-process LRU tier of LOCAL_MAXSIZE
+# entries in front of the shared cache. seen_count inside a fragment may lag
+# by up to TIMEOUT seconds since views do not invalidate fragments.
+POST_FRAGMENT_CACHE = {
+    'ENABLED': True,
+    'ALIAS': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAXSIZE': 1024,
+    'LOCAL_TIMEOUT': 30,
+}
+
+# Ranked feed (see API/ranking.py): candidates are the newest CANDIDATES
+# unseen posts of followed accounts from the last WINDOW_DAYS days.
+RANKED_FEED = {
+    'CANDIDATES': 10000,
+    'WINDOW_DAYS': 7,
+    'HALF_LIFE_HOURS': 24,
+    'WEIGHTS': {'likes': 1.0, 'comments': 2.0, 'affinity': 1.5},
+    'TIMEOUT': 300,
+}
+
+# Unique viewer counts: 'exact' counts SeenPost rows, 'approximate' answers
+# from per-post HyperLogLog sketches of HLL_PRECISION bits (2 ** precision
+# one-byte registers, ~1.04 / sqrt(2 ** precision) standard error) and lets
+# compact_seen_posts fold old SeenPost rows into them (see API/sketches.py).
+SEEN_COUNT_MODE = os.environ.get('SEEN_COUNT_MODE', 'exact')
+HLL_PRECISION = 11
+
+
+# Delta sync (see API/changes.py). Run compact_change_log daily; sync tokens
+# older than RETENTION_DAYS get a reset.
+DELTA_SYNC = {
+    'RETENTION_DAYS': 30,
+    'PAGE_SIZE': 500,
+}
+
+# Server-sent events with live like and comment counts (see API/live.py).
+# Subscribers get at most one event per INTERVAL_MS; BROKER must be shared
+# between processes when running more than one.
+LIVE_UPDATES = {
+    'BROKER': 'InstagramAPI.API.live.InProcessBroker',
+    'INTERVAL_MS': 500,
+    'MAX_POSTS': 100,
+    'HEARTBEAT_SECONDS': 15,
+}
+
+# Password hashing for login and registration runs on WORKERS threads with
+# at most MAX_PENDING calls waiting; further logins get a 503 (see
+# API/hashing.py). LOGIN_THROTTLE token buckets allow BURST requests per IP
+# (and per username for logins), refilled at RATE per second.
+PASSWORD_HASHING = {
+    'WORKERS': 4,
+    'MAX_PENDING': 32,
+    'TIMEOUT': 30,
+}
+LOGIN_THROTTLE = {
+    'ENABLED': True,
+    'IP_BURST': 20,
+    'IP_RATE': 0.5,
+    'USERNAME_BURST': 5,
+    'USERNAME_RATE': 0.05,
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -131,3 +257,35 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+# Opt-in fast paths for list responses: API_FAST_JSON renders with orjson when
+# it is installed, API_FAST_SERIALIZATION serializes post, comment and story
+# lists from values() rows (see API/fastpath.py). Both produce the same bytes.
+API_FAST_JSON = os.environ.get('API_FAST_JSON') == '1'
+API_FAST_SERIALIZATION = os.environ.get('API_FAST_SERIALIZATION') == '1'
+
+# Signed API tokens (see API/authentication.py), valid for MAX_AGE seconds.
+# Authenticated accounts are cached per process for PRINCIPAL_CACHE_TIMEOUT
+# seconds, which bounds how long a revoked token keeps working elsewhere.
+# With API_AUTH_MODE = 'token', UserLogin only issues a token and no session.
+API_AUTH_MODE = os.environ.get('API_AUTH_MODE', 'session')
+TOKEN_AUTH = {
+    'MAX_AGE': 30 * 24 * 3600,
+    'PRINCIPAL_CACHE_TIMEOUT': 30,
+    'PRINCIPAL_CACHE_SIZE': 10000,
+}
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'InstagramAPI.API.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'InstagramAPI.API.renderers.FastJSONRenderer' if API_FAST_JSON else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
@@ -0,0 +1,37 @@
+"""
+Shared setup for the benchmark scripts: configures Django and creates a
+throwaway test database so benchmarks never touch db.sqlite3.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'InstagramAPI.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+
+def create_test_database():
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def timeit(func, repeat=5):
+    """Return the best wall time of ``repeat`` calls and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(name, baseline, candidate):
+    print(f'{name:<28} {baseline * 1000:9.2f} ms {candidate * 1000:9.2f} ms {baseline / candidate:7.2f}x')
@@ -0,0 +1,86 @@
+"""
+Benchmark of deleting a heavy account: the synchronous cascade of
+Account.delete() against soft deletion (the request) followed by the
+batched reaper. Reports the request time and the longest single
+transaction, which is how long SQLite stays locked for other writers.
+
+    python benchmarks/bench_account_deletion.py [--posts 1000] [--batch-size 500]
+"""
+import argparse
+import random
+import time
+
+from _setup import create_test_database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--followers', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.conf import settings
+
+    settings.DEBUG = False
+    from InstagramAPI.API.deletion import Reaper, delete_account
+    from InstagramAPI.API.models import Account, Comment, DeletionJob, FollowerConnection, Likes, Post
+
+    random.seed(0)
+    others = Account.objects.bulk_create(Account(username=f'other{i}', password='!') for i in range(args.followers))
+
+    def heavy_account(name):
+        account = Account.objects.create_user(name, password='x')
+        posts = Post.objects.bulk_create(
+            Post(user=account, description=f'post {i}', image='') for i in range(args.posts)
+        )
+        Likes.objects.bulk_create(
+            Likes(user=random.choice(others), post=random.choice(posts)) for _ in range(args.likes)
+        )
+        Comment.objects.bulk_create(
+            Comment(user=random.choice(others), post=random.choice(posts), text='Nice!') for _ in range(args.comments)
+        )
+        FollowerConnection.objects.bulk_create(FollowerConnection(follower=other, following=account) for other in others)
+        return account
+
+    class TimedReaper(Reaper):
+        longest = 0.0
+        batches = 0
+
+        def _delete_batch(self, *batch):
+            start = time.perf_counter()
+            deleted = super()._delete_batch(*batch)
+            self.longest = max(self.longest, time.perf_counter() - start)
+            self.batches += 1
+            return deleted
+
+    account = heavy_account('cascade')
+    start = time.perf_counter()
+    Account.objects.get(pk=account.pk).delete()
+    cascade = time.perf_counter() - start
+
+    account = heavy_account('reaped')
+    start = time.perf_counter()
+    delete_account(account)
+    request = time.perf_counter() - start
+    reaper = TimedReaper(args.batch_size)
+    start = time.perf_counter()
+    reaper.run(DeletionJob.objects.get(object_id=account.pk))
+    total = time.perf_counter() - start
+    if Account.all_objects.filter(pk=account.pk).exists() or Likes.objects.exists():
+        raise SystemExit('The reaper left rows behind')
+
+    print(f'{args.posts} posts, {args.likes} likes, {args.comments} comments, {args.followers} followers')
+    print(f'{"":<28} {"cascade":>12} {"soft + reap":>12}')
+    print(f'{"request":<28} {cascade * 1000:9.1f} ms {request * 1000:9.1f} ms')
+    print(f'{"longest transaction":<28} {cascade * 1000:9.1f} ms {reaper.longest * 1000:9.1f} ms')
+    print(f'{"total work":<28} {cascade * 1000:9.1f} ms {(request + total) * 1000:9.1f} ms'
+          f'  ({reaper.batches} batches)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of per-request authentication overhead: a trivial authenticated
+API view behind the session and authentication middleware, called with a
+session cookie, with a signed token on a cold principal cache and with a
+signed token on a warm one. Reports time and queries per request.
+
+    python benchmarks/bench_auth.py [--requests 2000]
+"""
+import argparse
+
+from _setup import create_test_database, report, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.conf import settings
+
+    # Query logging under DEBUG would dominate the timings
+    settings.DEBUG = False
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.middleware import AuthenticationMiddleware
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.contrib.sessions.middleware import SessionMiddleware
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework import permissions
+    from rest_framework.authentication import SessionAuthentication
+    from rest_framework.response import Response
+    from rest_framework.test import APIRequestFactory
+    from rest_framework.views import APIView
+
+    from InstagramAPI.API.authentication import SignedTokenAuthentication, issue_token, principals
+    from InstagramAPI.API.models import Account
+
+    class WhoAmI(APIView):
+        permission_classes = [permissions.IsAuthenticated]
+
+        def get(self, request):
+            return Response({'id': request.user.pk})
+
+    user = Account.objects.create_user('bench', password='x')
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    token = issue_token(user)
+
+    def handler(authentication_class):
+        view = WhoAmI.as_view(authentication_classes=[authentication_class])
+        return SessionMiddleware(AuthenticationMiddleware(view))
+
+    factory = APIRequestFactory()
+    session_handler = handler(SessionAuthentication)
+    token_handler = handler(SignedTokenAuthentication)
+
+    def session_request():
+        request = factory.get('/whoami')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session.session_key
+        return session_handler(request)
+
+    def token_request(cold):
+        if cold:
+            principals.forget(user.pk)
+        return token_handler(factory.get('/whoami', HTTP_AUTHORIZATION=f'Token {token}'))
+
+    cases = [
+        ('token, cold cache', lambda: token_request(True)),
+        ('token, warm cache', lambda: token_request(False)),
+    ]
+
+    def per_request(call):
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        if response.status_code != 200:
+            raise SystemExit(f'Request failed with {response.status_code}')
+        seconds, _ = timeit(lambda: [call() for _ in range(args.requests)], args.repeat)
+        return seconds / args.requests, len(queries)
+
+    baseline, baseline_queries = per_request(session_request)
+    print(f'{"per request":<28} {"session":>12} {"token":>12} {"speedup":>8}')
+    for name, call in cases:
+        candidate, candidate_queries = per_request(call)
+        report(name, baseline, candidate)
+        print(f'{"  queries":<28} {baseline_queries:12d} {candidate_queries:12d}')
+
+
+if __name__ == '__main__':
+    main()
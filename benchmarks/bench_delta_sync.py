@@ -0,0 +1,78 @@
+"""
+Benchmark of an app-resume refresh: refetching the followed feed and story
+list against one delta sync after a few changes (new posts, likes and
+comments on followed posts, a deleted post). Reports time and response bytes.
+
+    python benchmarks/bench_delta_sync.py [--posts 1000] [--changes 20]
+"""
+import argparse
+import random
+
+from _setup import create_test_database, report, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--changes', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.conf import settings
+
+    settings.DEBUG = False
+    from rest_framework.test import APIClient
+
+    from InstagramAPI.API.models import Account, Comment, FollowerConnection, Likes, Post, Story
+
+    random.seed(0)
+    viewer = Account.objects.create_user('viewer', password='x')
+    authors = [Account.objects.create_user(f'author{i}', password='x') for i in range(args.accounts)]
+    for author in authors:
+        FollowerConnection.objects.create(follower=viewer, following=author)
+    posts = [
+        Post.objects.create(user=random.choice(authors), image=f'posts/{i}.jpg', description=f'post {i}')
+        for i in range(args.posts)
+    ]
+    for i in range(args.accounts):
+        Story.objects.create(user=authors[i], image=f'stories/{i}.jpg')
+
+    client = APIClient()
+    client.force_authenticate(viewer)
+    since = client.get('/api/sync').json()['since']
+
+    for i in range(args.changes):
+        choice = i % 4
+        if choice == 0:
+            Post.objects.create(user=random.choice(authors), image='posts/new.jpg', description=f'new {i}')
+        elif choice == 1:
+            Likes.objects.create(user=random.choice(authors), post=random.choice(posts))
+        elif choice == 2:
+            Comment.objects.create(user=random.choice(authors), post=random.choice(posts), text='Nice!')
+        else:
+            posts.pop(random.randrange(len(posts))).delete()
+
+    def full_refresh():
+        feed = client.get('/api/posts/my_feed/')
+        stories = client.get('/api/stories/')
+        return len(feed.content) + len(stories.content)
+
+    def delta_sync():
+        response = client.get('/api/sync', {'since': since})
+        if response.json()['reset']:
+            raise SystemExit('Sync unexpectedly asked for a reset')
+        return len(response.content)
+
+    baseline, baseline_bytes = timeit(full_refresh, args.repeat)
+    candidate, candidate_bytes = timeit(delta_sync, args.repeat)
+    print(f'{args.posts} posts, {args.changes} changes since the last sync')
+    print(f'{"per refresh":<28} {"refetch":>12} {"delta sync":>12} {"speedup":>8}')
+    report('time', baseline, candidate)
+    print(f'{"  response bytes":<28} {baseline_bytes:12d} {candidate_bytes:12d}')
+
+
+if __name__ == '__main__':
+    main()
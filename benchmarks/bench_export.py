@@ -0,0 +1,77 @@
+"""
+Benchmark of the data export: peak Python memory (tracemalloc) and time of
+building the whole export in memory with json.dumps, as the hand-written
+exports did, against the streaming NDJSON export, for a small and a ten
+times larger account.
+
+    python benchmarks/bench_export.py [--rows 5000]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from _setup import create_test_database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000, help="Likes and comments of the small account")
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.conf import settings
+
+    settings.DEBUG = False
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    from InstagramAPI.API.export import export_ndjson, export_sections
+    from InstagramAPI.API.models import Account, Comment, Likes, Post
+
+    random.seed(0)
+    others = Account.objects.bulk_create(Account(username=f'other{i}', password='!') for i in range(50))
+    posts = Post.objects.bulk_create(
+        Post(user=random.choice(others), description='x' * 200, image='posts/a.jpg') for _ in range(1000)
+    )
+
+    def account_with(rows, name):
+        account = Account.objects.create_user(name, password='x')
+        Post.objects.bulk_create(Post(user=account, description='y' * 200, image='posts/b.jpg') for _ in range(rows // 10))
+        Likes.objects.bulk_create(Likes(user=account, post=random.choice(posts)) for _ in range(rows))
+        Comment.objects.bulk_create(
+            Comment(user=account, post=random.choice(posts), text='z' * 100) for _ in range(rows)
+        )
+        return account
+
+    def in_memory(account):
+        data = {record_type: list(queryset) for record_type, queryset in export_sections(account)}
+        return len(json.dumps(data, cls=DjangoJSONEncoder).encode())
+
+    def streaming(account):
+        return sum(len(chunk) for chunk in export_ndjson(account))
+
+    def measure(func, account):
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = func(account)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return seconds, peak, size
+
+    print(f'{"account":<16} {"bytes":>10} {"in memory":>22} {"streaming":>22}')
+    for rows in (args.rows, args.rows * 10):
+        account = account_with(rows, f'user{rows}')
+        baseline = measure(in_memory, account)
+        candidate = measure(streaming, account)
+        print(
+            f'{str(rows * 2 + rows // 10) + " rows":<16} {candidate[2]:10d} '
+            f'{baseline[1] / 2 ** 20:7.1f} MiB {baseline[0] * 1000:8.0f} ms '
+            f'{candidate[1] / 2 ** 20:7.1f} MiB {candidate[0] * 1000:8.0f} ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark of the live count stream (/api/live/posts): opens many concurrent
+SSE subscribers against the ASGI application in one event loop while likes
+are written to the posts they watch, then reports the events delivered
+against one event per like and watcher, the delay between the latest like
+of a post and the event carrying it, the gaps between two events of one
+subscriber (at least INTERVAL_MS apart, give or take scheduling jitter),
+and whether every stream was unsubscribed on disconnect.
+
+    python benchmarks/bench_live_updates.py [--subscribers 1000] [--likes 2000]
+"""
+import argparse
+import asyncio
+import json
+import random
+import os
+import statistics
+import tempfile
+import time
+
+from _setup import create_test_database
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=50)
+    parser.add_argument('--posts-per-subscriber', type=int, default=10)
+    parser.add_argument('--likes', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    from django.db import connection
+
+    # Streams and writes run on different threads, which the shared-cache
+    # in-memory test database serves poorly
+    path = os.path.join(tempfile.mkdtemp(), 'bench_live.sqlite3')
+    connection.settings_dict['TEST']['NAME'] = path
+    create_test_database()
+
+    from django.conf import settings
+
+    settings.DEBUG = False
+    from asgiref.sync import sync_to_async
+    from django.core.asgi import get_asgi_application
+
+    from InstagramAPI.API.authentication import issue_token
+    from InstagramAPI.API.live import live_counts, live_options
+    from InstagramAPI.API.models import Account, Likes, Post
+
+    random.seed(0)
+    interval = live_options()['INTERVAL_MS'] / 1000
+    owner = Account.objects.create_user('owner', password='x')
+    posts = [Post.objects.create(user=owner, image='posts/a.png', description=f'post {i}') for i in range(args.posts)]
+    likers = Account.objects.bulk_create(Account(username=f'liker{i}', password='!') for i in range(args.likes))
+    token = issue_token(owner)
+    application = get_asgi_application()
+
+    # (post id, likes count) -> time the like producing that count committed
+    liked_at = {}
+    latencies = []
+    gaps = []
+    events = 0
+
+    async def subscriber(post_ids, disconnected):
+        nonlocal events
+        query = f'posts={",".join(map(str, post_ids))}&token={token}'
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': '/api/live/posts', 'raw_path': b'/api/live/posts',
+            'query_string': query.encode(), 'root_path': '', 'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        sent_request = False
+
+        async def receive():
+            nonlocal sent_request
+            if not sent_request:
+                sent_request = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        last = snapshot = None
+
+        async def send(message):
+            nonlocal events, last, snapshot
+            if message['type'] == 'http.response.start' and message['status'] != 200:
+                raise SystemExit(f'Stream failed with {message["status"]}')
+            if message['type'] != 'http.response.body' or not message.get('body', b'').startswith(b'event: counts'):
+                return
+            now = time.perf_counter()
+            data = json.loads(message['body'].split(b'data: ', 1)[1])
+            if snapshot is None:
+                snapshot = now
+            else:
+                events += 1
+                if last is not None:
+                    gaps.append(now - last)
+                last = now
+                for post_id, counts in data.items():
+                    committed = liked_at.get((int(post_id), counts['likes_count']))
+                    if committed is not None:
+                        latencies.append(now - committed)
+
+        await application(scope, receive, send)
+
+    def like(post_id, user):
+        Likes.objects.create(post_id=post_id, user=user)
+        liked_at[(post_id, Likes.objects.filter(post_id=post_id).count())] = time.perf_counter()
+
+    async def run():
+        disconnected = asyncio.Event()
+        watched = [random.sample([post.pk for post in posts], args.posts_per_subscriber)
+                   for _ in range(args.subscribers)]
+        tasks = [asyncio.create_task(subscriber(post_ids, disconnected)) for post_ids in watched]
+        while live_counts.subscriber_count < args.subscribers:
+            await asyncio.sleep(0.05)
+        print(f'{args.subscribers} subscribers connected')
+
+        # Likes land on a few hot posts, spread evenly over the run
+        hot = [post.pk for post in posts[:5]]
+        watchers = {post.pk: sum(post.pk in post_ids for post_ids in watched) for post in posts}
+        naive = 0
+        start = time.perf_counter()
+        for i, user in enumerate(likers):
+            post_id = random.choice(hot)
+            await sync_to_async(like)(post_id, user)
+            naive += watchers[post_id]
+            await asyncio.sleep(max(0, start + args.seconds * (i + 1) / args.likes - time.perf_counter()))
+        await asyncio.sleep(interval * 3)
+
+        disconnected.set()
+        await asyncio.gather(*tasks)
+        return naive
+
+    naive = asyncio.run(run())
+    print(f'{"likes written":<32} {args.likes:10d}')
+    print(f'{"events, one per like and watcher":<32} {naive:10d}')
+    print(f'{"events delivered":<32} {events:10d}  ({naive / max(events, 1):.1f}x fewer)')
+    if latencies:
+        latencies.sort()
+        print(f'{"last like to event, median":<32} {statistics.median(latencies) * 1000:10.1f} ms')
+        print(f'{"last like to event, p99":<32} {latencies[int(len(latencies) * 0.99)] * 1000:10.1f} ms')
+    if gaps:
+        print(f'{"gap between events, median":<32} {statistics.median(gaps) * 1000:10.1f} ms  (interval {interval * 1000:.0f} ms)')
+        print(f'{"gap between events, shortest":<32} {min(gaps) * 1000:10.1f} ms')
+    print(f'{"subscribers left":<32} {live_counts.subscriber_count:10d}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of API latency during a login storm. A pool of request workers
+(standing in for WSGI threads) serves a steady stream of cheap authenticated
+GETs while storm clients keep it flooded with logins for random usernames
+from a few IPs. Reports the latency of the GETs, queueing included, with no
+storm, with the storm and no protection, with the bounded hashing pool, and
+with the pool plus the login throttle.
+
+    python benchmarks/bench_login_storm.py [--workers 8] [--storm 32] [--seconds 5]
+"""
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _setup import create_test_database
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8, help="Request worker threads")
+    parser.add_argument('--storm', type=int, default=32, help="Concurrent login clients")
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--interval', type=float, default=0.02, help="Seconds between probe requests")
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.conf import settings
+    from rest_framework.test import APIClient
+
+    from InstagramAPI.API import hashing
+    from InstagramAPI.API.authentication import issue_token
+    from InstagramAPI.API.models import Account
+    from InstagramAPI.API.throttling import LoginThrottle
+
+    # Query logging under DEBUG and a warning per rejected login would
+    # dominate the timings
+    settings.DEBUG = False
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    probe_user = Account.objects.create_user('probe', password='x')
+    token = issue_token(probe_user)
+
+    scenarios = [
+        ('no storm', None, False),
+        ('storm, unprotected', hashing.HashingPool(0, 0), False),
+        ('storm, hashing pool', hashing.HashingPool(2, 2), False),
+        ('storm, pool + throttle', hashing.HashingPool(2, 2), True),
+    ]
+
+    print(f'{"probe GET latency":<28} {"p50":>9} {"p95":>9} {"max":>9} {"logins":>8} {"rejected":>9}')
+    for name, pool, throttled in scenarios:
+        hashing._pool = pool or hashing.HashingPool(0, 0)
+        settings.LOGIN_THROTTLE = {**settings.LOGIN_THROTTLE, 'ENABLED': throttled}
+        LoginThrottle.buckets = None
+
+        workers = ThreadPoolExecutor(args.workers)
+        deadline = time.monotonic() + args.seconds
+        logins = {'done': 0, 'rejected': 0}
+        lock = threading.Lock()
+
+        def login(rng):
+            response = APIClient(REMOTE_ADDR=f'10.0.0.{rng.randrange(4)}').post(
+                '/api/login', {'username': f'user{rng.randrange(10 ** 6)}', 'password': 'guess'}, format='json'
+            )
+            with lock:
+                logins['done'] += 1
+                logins['rejected'] += response.status_code in (429, 503)
+
+        def storm_client(seed):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                workers.submit(login, rng).result()
+
+        def probe():
+            response = APIClient().get('/api/hashtags/', HTTP_AUTHORIZATION=f'Token {token}')
+            assert response.status_code == 200, response.status_code
+
+        storm = [threading.Thread(target=storm_client, args=(seed,)) for seed in range(args.storm if pool else 0)]
+        for thread in storm:
+            thread.start()
+
+        latencies = []
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            future = workers.submit(probe)
+            future.add_done_callback(lambda _, start=start: latencies.append(time.perf_counter() - start))
+            time.sleep(args.interval)
+        for thread in storm:
+            thread.join()
+        workers.shutdown(wait=True)
+
+        print(f'{name:<28} {statistics.median(latencies) * 1000:7.1f}ms {percentile(latencies, 0.95) * 1000:7.1f}ms'
+              f' {max(latencies) * 1000:7.1f}ms {logins["done"]:8d} {logins["rejected"]:9d}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark of resolving a screen of posts: one /api/posts/{id}/ request per
+post against a single /api/posts/bulk/?ids= request. Reports time and
+queries, and fails if the shared fields differ.
+
+    python benchmarks/bench_multi_get.py [--ids 50]
+"""
+import argparse
+import random
+
+from _setup import create_test_database, report, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--ids', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.conf import settings
+
+    settings.DEBUG = False
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    from InstagramAPI.API.models import Account, Comment, Likes, Post
+
+    random.seed(0)
+    users = [Account.objects.create_user(f'user{i}', password='x') for i in range(50)]
+    posts = Post.objects.bulk_create(
+        Post(user=random.choice(users), description=f'post {i}', image=f'posts/{i}.jpg') for i in range(args.posts)
+    )
+    Likes.objects.bulk_create(Likes(user=random.choice(users), post=random.choice(posts)) for _ in range(args.posts * 5))
+    Comment.objects.bulk_create(
+        Comment(user=random.choice(users), post=random.choice(posts), text='Nice!') for _ in range(args.posts * 2)
+    )
+    client = APIClient()
+    client.force_authenticate(users[0])
+    ids = [post.pk for post in random.sample(posts, args.ids)]
+
+    def one_by_one():
+        return [client.get(f'/api/posts/{pk}/').json() for pk in ids]
+
+    def bulk():
+        return client.get('/api/posts/bulk/', {'ids': ','.join(map(str, ids))}).json()['results']
+
+    def queries(func):
+        with CaptureQueriesContext(connection) as captured:
+            result = func()
+        return result, len(captured)
+
+    details, detail_queries = queries(one_by_one)
+    results, bulk_queries = queries(bulk)
+    shared = set(results[0]) & set(details[0])
+    if [{key: post[key] for key in shared} for post in details] != [{key: post[key] for key in shared} for post in results]:
+        raise SystemExit('Bulk results differ from the detail responses')
+
+    baseline, _ = timeit(one_by_one, args.repeat)
+    candidate, _ = timeit(bulk, args.repeat)
+    print(f'{str(args.ids) + " posts":<28} {"one by one":>12} {"bulk":>12} {"speedup":>8}')
+    report('time', baseline, candidate)
+    print(f'{"  queries":<28} {detail_queries:12d} {bulk_queries:12d}')
+
+
+if __name__ == '__main__':
+    main()
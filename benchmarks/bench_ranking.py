@@ -0,0 +1,57 @@
+"""
+Benchmark of ranked-feed scoring on synthetic candidate sets: the vectorized
+NumPy pass against the pure Python fallback. Fails if the orders differ.
+
+    python benchmarks/bench_ranking.py [--candidates 10000]
+"""
+import argparse
+import random
+from datetime import timedelta
+
+from _setup import report, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--candidates', type=int, default=10000)
+    parser.add_argument('--authors', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from django.utils import timezone
+
+    from InstagramAPI.API import ranking
+
+    if ranking.np is None:
+        raise SystemExit('NumPy is not installed, nothing to compare')
+
+    random.seed(0)
+    now = timezone.now()
+    candidates = [
+        (
+            post_id,
+            random.randrange(args.authors),
+            now - timedelta(minutes=random.randrange(7 * 24 * 60)),
+            int(random.paretovariate(1.2)) - 1,
+            int(random.paretovariate(1.5)) - 1,
+        )
+        for post_id in range(1, args.candidates + 1)
+    ]
+    affinity = {author: random.randrange(20) for author in random.sample(range(args.authors), args.authors // 3)}
+    options = ranking.ranking_options()
+
+    vectorized, expected = timeit(lambda: ranking.rank(candidates, affinity, now, options), args.repeat)
+    numpy, ranking.np = ranking.np, None
+    try:
+        fallback, actual = timeit(lambda: ranking.rank(candidates, affinity, now, options), args.repeat)
+    finally:
+        ranking.np = numpy
+
+    if actual != expected:
+        raise SystemExit('NumPy and pure Python rankings differ')
+    print(f'{"candidates: " + str(args.candidates):<28} {"python":>12} {"numpy":>12} {"speedup":>8}')
+    report('rank()', fallback, vectorized)
+
+
+if __name__ == '__main__':
+    main()
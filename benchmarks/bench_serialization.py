@@ -0,0 +1,72 @@
+"""
+Microbenchmark of list serialization: ModelSerializer + JSONRenderer against
+the compiled values() path + FastJSONRenderer. Fails if the rendered bytes
+differ.
+
+    python benchmarks/bench_serialization.py [--posts 500]
+"""
+import argparse
+import random
+
+from _setup import create_test_database, report, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    create_test_database()
+
+    from django.test import override_settings
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from InstagramAPI.API.models import Account, Comment, Likes, Post, Story
+    from InstagramAPI.API.renderers import FastJSONRenderer, orjson
+    from InstagramAPI.API.serializers import CommentSerializer, PostSerializer, StorySerializer
+
+    random.seed(0)
+    users = [Account.objects.create_user(f'user{i}', password='x') for i in range(50)]
+    posts = Post.objects.bulk_create(
+        Post(user=random.choice(users), description=f'Post number {i}   café', image=f'posts/{i}.jpg')
+        for i in range(args.posts)
+    )
+    Likes.objects.bulk_create(
+        Likes(user=random.choice(users), post=random.choice(posts)) for _ in range(args.posts * 5)
+    )
+    Comment.objects.bulk_create(
+        Comment(user=random.choice(users), post=random.choice(posts), text='Nice!') for _ in range(args.posts * 2)
+    )
+    Story.objects.bulk_create(Story(user=random.choice(users), image=f'stories/{i}.jpg') for i in range(args.posts))
+
+    request = Request(APIRequestFactory().get('/api/posts/'))
+    request.user = users[0]
+    context = {'request': request}
+
+    cases = [
+        ('PostSerializer', PostSerializer, Post),
+        ('CommentSerializer', CommentSerializer, Comment),
+        ('StorySerializer', StorySerializer, Story),
+    ]
+    print(f'orjson: {"available" if orjson else "missing, using the JSONRenderer fallback"}')
+    print(f'{"list of " + str(args.posts):<28} {"current":>12} {"fast path":>12} {"speedup":>8}')
+    for name, serializer_class, model in cases:
+        def run(renderer):
+            data = serializer_class(model.objects.order_by('pk'), many=True, context=context).data
+            return renderer.render(data)
+
+        with override_settings(API_FAST_SERIALIZATION=False, POST_FRAGMENT_CACHE={'ENABLED': False}):
+            baseline, expected = timeit(lambda: run(JSONRenderer()), args.repeat)
+        with override_settings(API_FAST_SERIALIZATION=True, POST_FRAGMENT_CACHE={'ENABLED': False}):
+            candidate, actual = timeit(lambda: run(FastJSONRenderer()), args.repeat)
+
+        if actual != expected:
+            raise SystemExit(f'{name}: fast path output differs from the current path')
+        report(name, baseline, candidate)
+
+
+if __name__ == '__main__':
+    main()
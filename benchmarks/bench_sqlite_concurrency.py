@@ -0,0 +1,119 @@
+"""
+Concurrency benchmark of the SQLite configuration: threads issuing a mix of
+post reads and like/seen writes against a file database for a fixed time,
+with SQLite's defaults, with the tuned DATABASES options from settings.py
+(WAL, pragmas, BEGIN IMMEDIATE) and with the writer queue on top. Each
+configuration runs in its own process on a fresh database.
+
+    python benchmarks/bench_sqlite_concurrency.py [--threads 8] [--seconds 5] [--writes 0.2]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCENARIOS = {
+    'default': {},
+    'tuned': {},
+    'tuned + writer queue': {'DATABASE_WRITER_QUEUE': '1'},
+}
+
+
+def run_scenario(args):
+    from django.core.management import call_command
+    from django.db import OperationalError, connection
+    from django.db.models import Count
+
+    if args.scenario == 'default':
+        connection.close()
+        connection.settings_dict['OPTIONS'] = {}
+
+    call_command('migrate', verbosity=0)
+
+    from InstagramAPI.API.db import write
+    from InstagramAPI.API.models import Account, Likes, Post
+    from InstagramAPI.API.sketches import record_view
+
+    users = [
+        Account.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+        for i in range(args.threads * 4)
+    ]
+    posts = [Post.objects.create(user=random.choice(users), image='posts/a.png', description=f'post {i}')
+             for i in range(200)]
+    post_ids = [post.pk for post in posts]
+
+    def toggle_like(user, post_id):
+        like, created = Likes.objects.get_or_create(user=user, post_id=post_id)
+        if not created:
+            like.delete()
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        done = {'reads': 0, 'writes': 0, 'errors': 0}
+        while time.monotonic() < deadline:
+            user = rng.choice(users)
+            try:
+                if rng.random() < args.writes:
+                    if rng.random() < 0.5:
+                        write(toggle_like, user, rng.choice(post_ids))
+                    else:
+                        write(record_view, rng.choice(posts), user)
+                    done['writes'] += 1
+                else:
+                    start = rng.randrange(len(post_ids) - 20)
+                    list(
+                        Post.objects.filter(pk__in=post_ids[start:start + 20])
+                        .annotate(likes_total=Count('likes'))
+                        .values('pk', 'description', 'likes_total')
+                    )
+                    done['reads'] += 1
+            except OperationalError:
+                done['errors'] += 1
+        connection.close()
+        with lock:
+            for name, value in done.items():
+                counts[name] += value
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f'{args.scenario:<24} {counts["reads"] / args.seconds:10.0f} {counts["writes"] / args.seconds:10.0f}'
+          f' {counts["errors"]:8d}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writes', type=float, default=0.2, help="Fraction of operations that write")
+    parser.add_argument('--scenario', choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        import _setup  # noqa: F401
+        run_scenario(args)
+        return
+
+    print(f'{"threads: " + str(args.threads):<24} {"reads/s":>10} {"writes/s":>10} {"errors":>8}')
+    for scenario, env in SCENARIOS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--scenario', scenario,
+                 '--threads', str(args.threads), '--seconds', str(args.seconds), '--writes', str(args.writes)],
+                env={**os.environ, **env, 'SQLITE_PATH': os.path.join(directory, 'bench.sqlite3')},
+                check=True,
+            )
+
+
+if __name__ == '__main__':
+    main()